@@ -10,6 +10,8 @@ const DocumentAnalyzer = ({ isOpen, onClose, user }) => {
   const [analysisProgress, setAnalysisProgress] = useState(0);
   const [analysisResult, setAnalysisResult] = useState(null);
   const [selectedState, setSelectedState] = useState('');
+  // Long-form explanations, loaded when opened: 'document' or the red flag index -> text
+  const [explanations, setExplanations] = useState({});
   const fileInputRef = useRef(null);
 
   const supportedFormats = [
@@ -143,6 +145,7 @@ const DocumentAnalyzer = ({ isOpen, onClose, user }) => {
       const result = await response.json();
       
       setAnalysisProgress(100);
+      setExplanations({});
       setAnalysisResult(result);
       
       setTimeout(() => {
@@ -158,6 +161,22 @@ const DocumentAnalyzer = ({ isOpen, onClose, user }) => {
     }
   };
 
+  const loadExplanation = async (key) => {
+    setExplanations(prev => ({ ...prev, [key]: '⏳ Loading detailed explanation...' }));
+    const query = key === 'document' ? '' : `?flag=${key}`;
+    try {
+      const response = await fetch(`${API_BASE_URL}${API_ENDPOINTS.EXPLAIN(analysisResult.analysisId)}${query}`);
+      const data = await response.json();
+      if (!response.ok) {
+        throw new Error(data.error || 'Explanation failed');
+      }
+      setExplanations(prev => ({ ...prev, [key]: data.explanation }));
+    } catch (error) {
+      console.error('Explanation Error:', error);
+      setExplanations(prev => ({ ...prev, [key]: `Could not load the explanation: ${error.message}` }));
+    }
+  };
+
   const removeFile = () => {
     setUploadedFile(null);
     if (fileInputRef.current) {
@@ -488,6 +507,20 @@ Terms and Conditions:
                             💡 {flag.recommendation}
                           </div>
                         )}
+                        {analysisResult.analysisId && !explanations[index] && (
+                          <button
+                            onClick={() => loadExplanation(index)}
+                            style={{ marginLeft: '8px', background: 'none', border: 'none', color: '#007bff',
+                                     cursor: 'pointer', padding: 0, fontSize: '14px' }}
+                          >
+                            Explain
+                          </button>
+                        )}
+                        {explanations[index] && (
+                          <div style={{ marginTop: '5px', color: '#555', fontSize: '14px', whiteSpace: 'pre-wrap' }}>
+                            {explanations[index]}
+                          </div>
+                        )}
                       </li>
                     ))}
                   </ul>
@@ -543,8 +576,29 @@ Terms and Conditions:
                 </div>
               )}
 
-              {/* AI Summary */}
-              {analysisResult.aiSummary && (
+              {/* Detailed explanation, written on request */}
+              {analysisResult.analysisId && (
+                <div style={{
+                  padding: '15px',
+                  backgroundColor: 'white',
+                  borderRadius: '8px',
+                  marginBottom: '15px'
+                }}>
+                  <h4 style={{ margin: '0 0 10px 0' }}>🤖 AI Analysis</h4>
+                  {explanations.document ? (
+                    <p style={{ margin: '0', lineHeight: '1.6', whiteSpace: 'pre-wrap' }}>
+                      {explanations.document}
+                    </p>
+                  ) : (
+                    <button onClick={() => loadExplanation('document')} className="btn btn-secondary">
+                      Show detailed explanation
+                    </button>
+                  )}
+                </div>
+              )}
+
+              {/* AI Summary (results without an analysisId, e.g. from history) */}
+              {!analysisResult.analysisId && analysisResult.aiSummary && (
                 <div style={{
                   padding: '15px',
                   backgroundColor: 'white',
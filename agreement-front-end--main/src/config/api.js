@@ -22,7 +22,8 @@ export const API_ENDPOINTS = {
   HISTORY: '/api/history',
   HEALTH: '/api/health',
   DELETE_DATA: '/api/delete-data',
-  CLEAR_HISTORY: '/api/clear-history'
+  CLEAR_HISTORY: '/api/clear-history',
+  EXPLAIN: (analysisId) => `/api/analysis/${analysisId}/explain`
 };
 
 // Helper function to make API calls
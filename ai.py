@@ -1,81 +1,187 @@
-import google.generativeai as genai
+import asyncio
 import os
 import json
+import math
+import time
 import traceback
-from dotenv import load_dotenv
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from rule_engine import MAX_CLAUSE_CHARS, PAGE_BREAK, HitIndexer, index_hits, scan_chunks
+import rule_packs
+import llm_backends
+import analysis_cache
+import deadlines
+import flight_recorder
+import prompt_builder
+import rate_limiter
+import model_router
+import resilience
+import revisions
+from metrics import metrics
+from json_stream import IncrementalJSONParser
+from rule_batch import analyze_texts_with_rules_batch  # noqa: F401 (re-exported for archive rescoring)
 
 # --- Part 1: Rule-Based Pre-analysis ---
 
-DANGER_KEYWORDS = {
-    # High-Risk Phrases (potentially illegal or highly unfair) - Universal
-    "waive your rights": 95,
-    "not responsible for any injury": 90,
-    "access without notice": 85,
-    "responsible for all repairs": 80,
-    "confess judgment": 98,
-    "non-refundable": 88,
-    "no refund": 88,
-    "cannot be cancelled": 92,
-    "irrevocable": 90,
-    "unlimited liability": 95,
-    "waive all claims": 93,
-    "sell your data": 94,
-    "share your information with third parties": 75,
-    "no warranty": 70,
-    "as-is": 55,
-    "at our sole discretion": 60,
-    "without notice": 80,
-    "binding arbitration": 65,
-    "class action waiver": 70,
-    "indemnify and hold harmless": 68,
-
-    # Medium-Risk Phrases (warrants caution and clarification) - Universal
-    "automatic renewal": 70,
-    "may increase": 65,
-    "at our discretion": 60,
-    "late fees": 68,
-    "termination without cause": 72,
-    "modify terms at any time": 75,
-    "collect personal information": 50,
-    "cookies and tracking": 45,
-    "third-party services": 40,
-
-    # Low-Risk Phrases (common but good to be aware of) - Universal
-    "no pets": 20,
-    "no alterations": 25,
-    "prior consent required": 15,
-    "age restriction": 20,
-}
+# The phrase tables live in versioned rule packs under rules/ (universal, per
+# document type and per state). They are compiled once, cached on disk and
+# hot-reloaded when the files change - see rule_packs.py.
 
-def analyze_text_with_rules(text):
+def analyze_text_with_rules(text, state="", document_type=None):
     """
-    Performs a simple keyword-based scan of the text.
-    Returns a list of found issues and a preliminary score.
+    Performs a single-pass keyword scan of the text using the rule packs for the
+    given state and document type.
+    Returns a list of found issues, a preliminary score, a hit index giving
+    the offsets, line/page number and surrounding clause of each occurrence,
+    and the versions of the rule packs that were applied.
     """
     print("--- 1. EXECUTING: Rule-based analysis in ai.py ---")
+    ruleset = rule_packs.registry.get(state, document_type)
+    hit_index = index_hits(text, ruleset.finditer(text))
+    return summarize_rule_hits(ruleset, hit_index)
+
+
+def analyze_text_chunks_with_rules(chunks, state="", document_type=None):
+    """
+    Streaming version of analyze_text_with_rules for very large documents.
+    Consumes an iterable of text chunks (e.g. pages from the extractors) and
+    returns the same result, while only holding about one chunk in memory.
+    """
+    print("--- 1. EXECUTING: Streaming rule-based analysis in ai.py ---")
+    ruleset = rule_packs.registry.get(state, document_type)
+    indexer = HitIndexer()
+    # Hold back enough text that a match and the rest of its clause are seen whole
+    overlap = ruleset.max_match_length + MAX_CLAUSE_CHARS
+    for window, offset, matches, done in scan_chunks(chunks, ruleset.finditer, overlap, ruleset.context_chars):
+        for start, end, rule in matches:
+            indexer.add(window, offset, start, end, rule)
+        indexer.advance(window, offset, done)
+    return summarize_rule_hits(ruleset, indexer.index)
+
+
+def summarize_rule_hits(ruleset, hit_index):
+    """Turns a hit index into found issues, a flat hit list and a preliminary score."""
     found_issues = []
+    hits = []
     total_score = 0
     issue_count = 0
-    text_lower = text.lower()
 
-    for phrase, score in DANGER_KEYWORDS.items():
-        if phrase in text_lower:
+    for phrase, score in ruleset.scores.items():
+        if phrase in hit_index:
             issue_count += 1
             total_score += score
-            found_issues.append({"phrase": phrase, "score": score})
+            issue = {"phrase": phrase, "score": score, "count": hit_index[phrase]["count"]}
+            if phrase in ruleset.patterns:
+                issue["title"] = ruleset.patterns[phrase].get("title", phrase)
+            found_issues.append(issue)
+            for hit in hit_index[phrase]["hits"]:
+                hits.append({"phrase": phrase, "score": score, **hit})
     
     preliminary_score = (total_score / issue_count) if issue_count > 0 else 0
+    hits.sort(key=lambda hit: hit["start"])
     
     return {
         "found_issues": found_issues,
-        "preliminary_score": int(preliminary_score)
+        "hits": hits,
+        "preliminary_score": int(preliminary_score),
+        "rule_pack_versions": ruleset.versions
     }
 
 
+# --- Part 1b: Rules-only ("fast") results ---
+
+# Each distinct rule hit scales the safety score by (1 - risk * weight), so one
+# high-risk term lands in RISKY and three or four in DANGEROUS.
+RULE_PENALTY_WEIGHT = 0.35
+
+# A document with no rule hits is not proven safe - the rules only know known wording
+NO_HITS_MAX_SCORE = 90
+
+# auto mode answers from the rules alone when confidence is at least this
+FAST_PATH_MIN_CONFIDENCE = float(os.getenv("FAST_PATH_MIN_CONFIDENCE", "0.75"))
+
+def rule_confidence(preliminary_findings):
+    """
+    How sure the rule engine is of its verdict, 0.0-1.0. Several distinct
+    medium/high-risk hits make a clearly risky document; few or no hits say
+    little, because the rules can only recognise wording they know.
+    """
+    weight = sum(issue["score"] / 100 for issue in preliminary_findings["found_issues"] if issue["score"] >= 40)
+    return round(min(1.0, weight / 3), 2)
+
+def build_rule_based_result(preliminary_findings):
+    """
+    Builds a complete analysis result (same schema as ensure_complete_response)
+    from the rule engine's findings alone, without calling Gemini.
+    """
+    found_issues = sorted(preliminary_findings["found_issues"], key=lambda issue: -issue["score"])
+    first_hits = {}
+    for hit in preliminary_findings.get("hits", []):
+        first_hits.setdefault(hit["phrase"], hit)
+
+    score = 100.0
+    for issue in found_issues:
+        score *= 1 - (issue["score"] / 100) * RULE_PENALTY_WEIGHT
+    score = int(round(min(score, NO_HITS_MAX_SCORE)))
+    color_label, rating_text = get_rating_band(score)
+
+    red_flags = []
+    recommendations = []
+    for issue in found_issues:
+        title = issue.get("title") or issue["phrase"].title()
+        hit = first_hits.get(issue["phrase"])
+        location = f' (page {hit["page"]}, line {hit["line"]})' if hit else ""
+        quote = f'"{hit["clause"]}"{location}' if hit else f'"{issue["phrase"]}"'
+        times = f" It appears {issue['count']} times." if issue.get("count", 1) > 1 else ""
+        red_flags.append({
+            "title": title,
+            "issue": f"{quote} - {_risk_note(issue['score'])}{times}",
+        })
+        recommendations.append(f"Ask for the \"{title}\" clause to be removed or clarified before signing")
+
+    high_risk = sum(1 for issue in found_issues if issue["score"] >= 70)
+    if found_issues:
+        summary = (f"Quick rule-based check found {len(found_issues)} risky term(s), {high_risk} of them high-risk, "
+                   f"giving a {rating_text.lower()} rating of {score}/100. "
+                   "This check only recognises known wording; run a full AI analysis for a complete review.")
+    else:
+        summary = ("Quick rule-based check found none of the known risky terms. "
+                   "This check only recognises known wording; run a full AI analysis for a complete review.")
+
+    recommendations.extend([
+        "Run a full AI analysis for a clause-by-clause review",
+        "Consider legal review for high-value agreements",
+    ])
+
+    return ensure_complete_response({
+        "overallScore": score,
+        "colorLabel": color_label,
+        "ratingText": rating_text,
+        "summary": summary,
+        "redFlags": red_flags,
+        "fairClauses": [],
+        "recommendations": recommendations,
+    })
+
+def _risk_note(score):
+    if score >= 85:
+        return "This term is often unfair or unenforceable; seek its removal or legal advice."
+    elif score >= 70:
+        return "This term strongly favours the other party; negotiate or clarify it before signing."
+    elif score >= 40:
+        return "This term warrants caution and clarification before signing."
+    else:
+        return "This is a common term, but be aware of it."
+
+
 # --- Part 2: Gemini AI Analysis (with improved error handling) ---
 
 def clean_json_response(text):
     """Clean and parse JSON response from Gemini with ultra-robust error handling"""
+    return ensure_complete_response(_decode_reply_text(text))
+
+def _decode_reply_text(text):
+    """clean_json_response() without the final ensure_complete_response()."""
     # Remove markdown code blocks
     cleaned = text.strip()
     if cleaned.startswith("```json"):
@@ -90,10 +196,7 @@ def clean_json_response(text):
     
     try:
         # First attempt: direct parse
-        result = json.loads(cleaned)
-        # Ensure all required fields exist and are properly formatted
-        result = ensure_complete_response(result)
-        return result
+        return json.loads(cleaned)
     except json.JSONDecodeError as e:
         print(f"--- JSON Parse Error: {e} ---")
         
@@ -111,9 +214,7 @@ def clean_json_response(text):
                 # Advanced multiline string repair
                 json_text = repair_multiline_json(json_text)
                 
-                result = json.loads(json_text)
-                result = ensure_complete_response(result)
-                return result
+                return json.loads(json_text)
                 
         except Exception as e2:
             print(f"--- Advanced parsing failed: {e2} ---")
@@ -181,7 +282,12 @@ def ensure_complete_response(result):
     """Ensure the response has all required fields with proper values"""
     # Ensure basic fields exist
     result['ratingScore'] = result.get('overallScore', result.get('ratingScore', 50))
-    result['ratingText'] = result.get('colorLabel', result.get('ratingText', 'YELLOW'))
+    # Both labels follow from the score, so they always agree with it and with each other
+    try:
+        band_score = float(result['ratingScore'])
+    except (TypeError, ValueError):
+        band_score = 50
+    result['colorLabel'], result['ratingText'] = get_rating_band(band_score)
     result['shortSummary'] = result.get('summary', result.get('shortSummary', ''))
     result['aiSummary'] = result.get('aiSummary', result.get('summary', ''))
     
@@ -199,6 +305,19 @@ def ensure_complete_response(result):
     
     return result
 
+def get_rating_band(score):
+    """Maps a 0-100 score (higher is safer) to its (colorLabel, ratingText) band."""
+    if score <= 20:
+        return "DARK_RED", "CRITICAL"
+    elif score <= 45:
+        return "RED", "DANGEROUS"
+    elif score <= 70:
+        return "ORANGE", "RISKY"
+    elif score <= 85:
+        return "YELLOW", "CAUTION"
+    else:
+        return "GREEN", "STABLE"
+
 def create_detailed_fallback_response(original_text):
     """Create a detailed analysis response when JSON parsing fails"""
     # Try to extract any useful information from the original text
@@ -223,21 +342,7 @@ def create_detailed_fallback_response(original_text):
     risk_score = max(10, min(90, risk_score))  # Keep within bounds
     
     # Determine color and text based on score
-    if risk_score <= 20:
-        color_label = "DARK_RED"
-        rating_text = "CRITICAL"
-    elif risk_score <= 45:
-        color_label = "RED"
-        rating_text = "DANGEROUS"
-    elif risk_score <= 70:
-        color_label = "ORANGE"
-        rating_text = "RISKY"
-    elif risk_score <= 85:
-        color_label = "YELLOW"
-        rating_text = "CAUTION"
-    else:
-        color_label = "GREEN"
-        rating_text = "STABLE"
+    color_label, rating_text = get_rating_band(risk_score)
     
     return {
         "overallScore": risk_score,
@@ -298,160 +403,742 @@ def create_detailed_fallback_response(original_text):
             "Understand your rights and obligations as outlined in the document"
         ],
         "redFlagsCount": 5,
-        "fairClausesCount": 4
+        "fairClausesCount": 4,
+        # Marks a made-up answer (the reply could not be parsed), so it is never cached
+        "isFallback": True
     }
 
-def analyze_with_gemini(text, preliminary_findings, state=""):
+# Configure model for optimal performance
+GENERATION_CONFIG = {
+    "temperature": 0.7,
+    "top_p": 0.95,
+    "top_k": 40,
+    "max_output_tokens": 2048,
+    **prompt_builder.response_format(),
+}
+
+# Greedy decoding for cacheable requests, so a cached answer is the answer the
+# model would give again. Set DETERMINISTIC_CACHED_ANALYSIS=0 to sample as usual.
+DETERMINISTIC_GENERATION_CONFIG = {
+    "temperature": 0.0,
+    "top_p": 1.0,
+    "top_k": 1,
+    "max_output_tokens": 2048,
+    **prompt_builder.response_format(),
+}
+DETERMINISTIC_CACHED_ANALYSIS = os.getenv("DETERMINISTIC_CACHED_ANALYSIS", "1") != "0"
+
+
+# Explanations are free text, a few paragraphs at most
+EXPLANATION_GENERATION_CONFIG = {
+    "temperature": 0.2,
+    "top_p": 0.95,
+    "max_output_tokens": 1024,
+}
+
+# Streamed analyses report these arrays of the reply element by element, as these events
+STREAM_ITEM_EVENTS = {"redFlags": "redFlag", "fairClauses": "fairClause", "recommendations": "recommendation"}
+
+def analyze_with_gemini(text, preliminary_findings, state="", bypass_cache=False, owner=None, deadline=None,
+                        document_type=None):
     """
     Analyzes the text using the Gemini API with 20-point risk assessment.
+
+    Results are cached by document content (see analysis_cache.py); pass
+    bypass_cache=True to always ask the model and leave the cache untouched.
+    Longer documents of a signed-in user (`owner`, their e-mail) are analyzed
+    in sections, so a revised upload only re-analyzes the sections it changed
+    (see revisions.py). With a `deadline` (deadlines.py), Gemini calls end in
+    time for it; a result cut short is flagged "deadlineExceeded". The
+    client's `document_type`, if any, takes part in choosing the model.
+    """
+    use_cache, key, route = _plan_cache(text, state, bypass_cache, preliminary_findings, deadline, document_type)
+    if use_cache:
+        cached = analysis_cache.get_cache().get(key)
+        if cached is not None:
+            return _cache_hit(cached)
+
+    if use_cache and revisions.applies(text, owner):
+        result = _generate_sectioned_analysis(text, state, preliminary_findings, route, owner)
+    else:
+        result = _generate_analysis(text, state, preliminary_findings, route)
+    return _finish_result(result, use_cache, key)
+
+async def analyze_with_gemini_async(text, preliminary_findings, state="", bypass_cache=False, owner=None,
+                                    deadline=None, document_type=None):
+    """
+    analyze_with_gemini for asyncio callers (asgi.py): waits on Gemini without
+    holding a thread, so one process can have hundreds of analyses in flight.
+    """
+    use_cache, key, route = _plan_cache(text, state, bypass_cache, preliminary_findings, deadline, document_type)
+    if use_cache:
+        cached = await asyncio.to_thread(analysis_cache.get_cache().get, key)
+        if cached is not None:
+            return _cache_hit(cached)
+
+    if use_cache and revisions.applies(text, owner):
+        result = await _generate_sectioned_analysis_async(text, state, preliminary_findings, route, owner)
+    else:
+        result = await _generate_analysis_async(text, state, preliminary_findings, route)
+    return await asyncio.to_thread(_finish_result, result, use_cache, key)
+
+def analyze_with_gemini_stream(text, preliminary_findings, state="", bypass_cache=False, owner=None,
+                               deadline=None, document_type=None):
+    """
+    analyze_with_gemini as a generator of (event, data) pairs for progressive
+    display: "field" ({"overallScore": 62}, ...), "redFlag", "fairClause" and
+    "recommendation" as soon as the model has written each one, and finally
+    "result" with the same result analyze_with_gemini returns.
+    """
+    use_cache, key, route = _plan_cache(text, state, bypass_cache, preliminary_findings, deadline, document_type)
+    if use_cache:
+        cached = analysis_cache.get_cache().get(key)
+        if cached is not None:
+            yield "result", _cache_hit(cached)
+            return
+
+    if use_cache and revisions.applies(text, owner):
+        # Sections come back whole, so their findings are sent together once merged
+        result = _generate_sectioned_analysis(text, state, preliminary_findings, route, owner)
+        for result_key, event in STREAM_ITEM_EVENTS.items():
+            for item in result.get(result_key, []):
+                yield event, item
+    else:
+        result = yield from _generate_analysis_stream(text, state, preliminary_findings, route)
+    yield "result", _finish_result(result, use_cache, key)
+
+def explain_with_gemini(text, analysis, state="", flag=None):
+    """
+    Long-form explanation of a compact analysis result, or of its red flag
+    `flag` only, written when the reader asks for it. Returns
+    {"explanation": text} or a result with an "error" key.
+    """
+    print("--- EXECUTING: Gemini explanation ---")
+    key_error = _api_key_error()
+    if key_error:
+        return key_error
+    try:
+        prompt = prompt_builder.build_explanation_prompt(text, analysis, state, flag)
+        route = model_router.default_route(EXPLANATION_GENERATION_CONFIG, "explanation")
+        with flight_recorder.record("explanation", route, prompt) as call:
+            response, _ = _call_model(route, prompt, call)
+            call.received(response)
+            explanation = _chunk_text(response).strip()
+            call.parse = "text" if explanation else "empty"
+    except Exception as e:
+        if _is_timeout(e):
+            return _timeout_response()
+        return _gemini_error_response(e)
+
+    metrics.increment("explain.generated")
+    metrics.increment("explain.input_tokens", prompt.input_tokens)
+    if not explanation:
+        return {"error": "The AI could not explain this analysis. Please try again."}
+    return {"explanation": explanation}
+
+def _plan_cache(text, state, bypass_cache, preliminary_findings=None, deadline=None, document_type=None):
+    """Returns (use_cache, cache key, model route) for a request."""
+    use_cache = analysis_cache.CACHE_ENABLED and not bypass_cache
+    if bypass_cache:
+        metrics.increment("analysis_cache.bypassed")
+        generation_config = GENERATION_CONFIG
+    else:
+        generation_config = DETERMINISTIC_GENERATION_CONFIG if DETERMINISTIC_CACHED_ANALYSIS else GENERATION_CONFIG
+
+    # Model tier and reply budget from the document and its rule-based score (model_router.py)
+    rule_score = build_rule_based_result(preliminary_findings)['overallScore'] if preliminary_findings else None
+    route = model_router.choose_route(text, generation_config, rule_score, deadline, document_type)
+
+    key = None
+    if use_cache:
+        # The rule findings are part of the prompt, so the rule packs that produced them are part of the key
+        rule_packs_used = (preliminary_findings or {}).get("rule_pack_versions", {})
+        key = analysis_cache.cache_key(text, state, prompt_builder.PROMPT_VERSION, route.model,
+                                       dict(route.generation_config, max_input_tokens=prompt_builder.MAX_INPUT_TOKENS,
+                                            rule_packs=rule_packs_used, backend=llm_backends.backend_name()))
+    return use_cache, key, route
+
+def _cache_hit(cached):
+    print("--- 2. CACHE HIT: Reusing the stored Gemini analysis ---")
+    cached['cached'] = True
+    return cached
+
+def _finish_result(result, use_cache, key):
     """
+    Stores a usable result in the cache and marks it as freshly generated.
+    Answers of a fallback model are not cached under the routed model's key,
+    nor results cut short by the request deadline.
+    """
+    is_fallback = result.pop("isFallback", False)
+    if (use_cache and "error" not in result and not is_fallback and not result.get("modelFallback")
+            and not result.get("deadlineExceeded")):
+        analysis_cache.get_cache().put(key, result)
+    if "error" not in result:
+        result['cached'] = False
+    return result
+
+def _generate_analysis(text, state, preliminary_findings, route):
     print("--- 2. EXECUTING: Gemini analysis with 20-point risk assessment in ai.py ---")
     try:
-        # Force reload environment variables
-        from dotenv import load_dotenv
-        load_dotenv(override=True)
+        prepared = _prepare_generation(text, state, preliminary_findings, route)
+        if isinstance(prepared, dict):
+            return prepared
+        route, prompts = prepared
+        if len(prompts) > 1:
+            return _generate_chunked_analysis(route, prompts)
         
-        api_key = os.getenv("GEMINI_API_KEY")
-        print(f"--- DEBUG: API Key loaded: {api_key[:20] if api_key else 'None'}... ---")
-        
-        if not api_key or len(api_key) < 30: # Basic check for a valid key format
-            print("--- FATAL ERROR: Gemini API key is missing or invalid in .env file. ---")
-            return {
-                "error": "Server configuration error: Ensure a valid GEMINI_API_KEY is in your .env file."
-            }
+        # Generate content with timeout handling
+        with flight_recorder.record("analysis", route, prompts[0]) as call:
+            try:
+                response, model_name = _call_model(route, prompts[0], call)
+            except Exception as timeout_error:
+                if _is_timeout(timeout_error):
+                    call.failed(timeout_error)
+                    return _timeout_response()
+                raise timeout_error
+            call.received(response)
             
-        # Remove quotes if present
-        api_key = api_key.strip('"\'')
+            print("--- 3. RECEIVED response from Gemini with 20-point analysis. ---")
+            return _tag_model(_parse_gemini_response(response, call), route, model_name)
+
+    except Exception as e:
+        return _gemini_error_response(e)
+
+async def _generate_analysis_async(text, state, preliminary_findings, route):
+    print("--- 2. EXECUTING: async Gemini analysis with 20-point risk assessment in ai.py ---")
+    try:
+        prepared = _prepare_generation(text, state, preliminary_findings, route)
+        if isinstance(prepared, dict):
+            return prepared
+        route, prompts = prepared
+        if len(prompts) > 1:
+            return await _generate_chunked_analysis_async(route, prompts)
         
-        genai.configure(api_key=api_key)
+        with flight_recorder.record("analysis", route, prompts[0]) as call:
+            try:
+                response, model_name = await _call_model_async(route, prompts[0], call)
+            except Exception as timeout_error:
+                if _is_timeout(timeout_error):
+                    call.failed(timeout_error)
+                    return _timeout_response()
+                raise timeout_error
+            call.received(response)
+            
+            print("--- 3. RECEIVED response from Gemini with 20-point analysis. ---")
+            return _tag_model(_parse_gemini_response(response, call), route, model_name)
+
+    except Exception as e:
+        return _gemini_error_response(e)
+
+def _generate_analysis_stream(text, state, preliminary_findings, route):
+    """Yields progress events while generating; returns the result (use with yield from)."""
+    print("--- 2. EXECUTING: streaming Gemini analysis with 20-point risk assessment in ai.py ---")
+    try:
+        prepared = _prepare_generation(text, state, preliminary_findings, route)
+        if isinstance(prepared, dict):
+            return prepared
+        route, prompts = prepared
+        if len(prompts) > 1:
+            return (yield from _stream_chunked_analysis(route, prompts))
         
-        # Configure model for optimal performance
-        generation_config = {
-            "temperature": 0.7,
-            "top_p": 0.95,
-            "top_k": 40,
-            "max_output_tokens": 2048,
+        parser = IncrementalJSONParser(STREAM_ITEM_EVENTS)
+        pieces = []
+        with flight_recorder.record("stream", route, prompts[0]) as call:
+            try:
+                # Only the request itself is retried; a stream that breaks midway is not restarted
+                response, model_name = route.call(
+                    prompts[0], _charged(route, prompts[0], lambda model: model.generate_content(
+                        prompts[0].contents, stream=True, **route.request_options())),
+                    hedge=False, record=call)
+                for chunk in response:
+                    piece = _chunk_text(chunk)
+                    if piece:
+                        call.first_token()
+                    pieces.append(piece)
+                    for kind, name, value in parser.feed(piece):
+                        yield (STREAM_ITEM_EVENTS[name], value) if kind == "item" else ("field", {name: value})
+            except Exception as timeout_error:
+                if route.time_left() < deadlines.MIN_CALL_SECONDS:
+                    out_of_time = deadlines.BudgetExceeded("the streamed reply did not finish before the request deadline")
+                    raise out_of_time from timeout_error
+                if _is_timeout(timeout_error):
+                    call.failed(timeout_error)
+                    return _timeout_response()
+                raise timeout_error
+            # A streamed response has its usage and finish reason once it has been read
+            call.received(response)
+            
+            print("--- 3. RECEIVED streamed response from Gemini with 20-point analysis. ---")
+            return _tag_model(_parse_gemini_text("".join(pieces), getattr(response, "usage_metadata", None), call),
+                              route, model_name)
+
+    except Exception as e:
+        return _gemini_error_response(e)
+
+def _chunk_text(chunk):
+    # The last streamed chunk can carry only the finish reason and no text
+    try:
+        return chunk.text
+    except ValueError:
+        return ""
+
+def _prepare_generation(text, state, preliminary_findings, route, spans=None):
+    """
+    Returns (route, prompts) for a request, or an error result when the key is
+    missing. With `spans`, there is one prompt per (start, end) section.
+    """
+    key_error = _api_key_error()
+    if key_error:
+        return key_error
+    # Too little time left for an answer: the caller falls back to the rules
+    if route.deadline is not None:
+        route.deadline.check("gemini", deadlines.MIN_GEMINI_SECONDS)
+    
+    # System instruction + one copy of the document (or of each chunk), within the token budget
+    if spans is None:
+        prompts = prompt_builder.build_analysis_prompts(text, state, preliminary_findings)
+    else:
+        prompts = prompt_builder.build_section_prompts(text, spans, state, preliminary_findings)
+    return route, prompts
+
+def _api_key_error():
+    """An error result when the Gemini key is missing, else None (the stub backend needs none)."""
+    backend = llm_backends.get_backend()
+    if not backend.needs_api_key:
+        return None
+    api_key = backend.api_key()
+    
+    if not api_key or len(api_key) < 30: # Basic check for a valid key format
+        print("--- FATAL ERROR: Gemini API key is missing or invalid in .env file. ---")
+        return {
+            "error": "Server configuration error: Ensure a valid GEMINI_API_KEY is in your .env file."
         }
-        
-        model = genai.GenerativeModel(
-            'gemini-2.5-flash',
-            generation_config=generation_config
-        )
+    return None
 
-        location_context = f"Location: {state}, India." if state else "Location: General."
+def _call_model(route, prompt, record=None):
+    """
+    generate_content for a prompt on the route's models (model_router.py),
+    with retries, hedging and a circuit breaker per model (resilience.py),
+    each attempt waiting for the node-wide quota (rate_limiter.py) and noted
+    on `record` (flight_recorder.py).
+    Returns (response, name of the model that answered).
+    """
+    return route.call(prompt, _charged(route, prompt, lambda model: model.generate_content(
+        prompt.contents, **route.request_options())), record=record)
 
-        system_prompt = f"""You are Kiro, a Legal Document Auditor and Risk Analyst. Analyze this document thoroughly.
+async def _call_model_async(route, prompt, record=None):
+    return await route.call_async(prompt, _charged_async(route, prompt, lambda model: model.generate_content_async(
+        prompt.contents, **route.request_options())), record=record)
 
-This could be any type of public document: lease agreement, terms & conditions, service agreement, employment contract, privacy policy, NDA, or general contract.
+def _charged(route, prompt, fn):
+    """fn(model), first reserving quota, so every retry, hedge and fallback model is charged."""
+    def attempt(model):
+        time.sleep(_reserve_quota(route, prompt))
+        return fn(model)
+    return attempt
 
-RATING: 0-20=CRITICAL, 21-45=DANGEROUS, 46-70=RISKY, 71-85=CAUTION, 86-100=STABLE
+def _charged_async(route, prompt, make_call):
+    async def attempt(model):
+        await asyncio.sleep(_reserve_quota(route, prompt))
+        return await make_call(model)
+    return attempt
 
-{location_context}
+def _analyze_prompt(route, prompt):
+    """One prompt through the model and the parser (a map step of chunked and sectioned analyses)."""
+    with flight_recorder.record("chunk", route, prompt) as call:
+        response, model_name = _call_model(route, prompt, call)
+        call.received(response)
+        return _tag_model(_parse_gemini_response(response, call), route, model_name)
 
-Analyze for:
-- Unfair or one-sided terms
-- Hidden fees or charges
-- Liability limitations
-- Data privacy concerns
-- Cancellation/termination terms
-- Missing protections
-- Legal compliance issues
-- Ambiguous language
+async def _analyze_prompt_async(route, prompt):
+    with flight_recorder.record("chunk", route, prompt) as call:
+        response, model_name = await _call_model_async(route, prompt, call)
+        call.received(response)
+        return _tag_model(_parse_gemini_response(response, call), route, model_name)
 
-Return ONLY this JSON format (no markdown):
-{{"overallScore":75,"ratingScore":75,"colorLabel":"YELLOW","ratingText":"CAUTION","summary":"Comprehensive 15-20 line summary covering all key aspects including main terms, obligations, rights, fees, termination, liability, data usage (if applicable), and overall fairness assessment with specific concerns and positive aspects identified","shortSummary":"Brief one-sentence summary","aiSummary":"Detailed 15-20 line analysis explaining key findings, risk factors, legal compliance issues, missing protections, unfair clauses, balanced terms, and overall assessment with specific recommendations","redFlags":[{{"title":"Unfair Termination Clause","issue":"Can terminate with only 7 days notice which may be below legal minimum"}},{{"title":"Excessive Fees","issue":"Hidden fees not clearly disclosed upfront"}},{{"title":"Liability Limitation","issue":"Company not responsible for any damages or losses"}},{{"title":"No Privacy Protection","issue":"Can share personal data with third parties without consent"}},{{"title":"Automatic Renewal","issue":"Auto-renews without clear notification or easy cancellation"}}],"fairClauses":[{{"title":"Clear Payment Terms","recommendation":"Payment amount and schedule are clearly specified"}},{{"title":"Defined Service Period","recommendation":"Service duration is clearly stated with start and end dates"}},{{"title":"Refund Policy","recommendation":"Refund terms are clearly outlined"}},{{"title":"Contact Information","recommendation":"Support and contact details are provided"}}],"recommendations":["Review all terms carefully before accepting","Negotiate unfavorable terms if possible","Clarify any ambiguous language","Verify compliance with applicable laws","Document all communications","Consider legal review for high-value agreements","Understand your rights and obligations","Keep copies of all documents"],"redFlagsCount":5,"fairClausesCount":4}}
+def _tag_model(result, route, model_name):
+    """Notes on a result which model wrote it, and whether that was a fallback."""
+    if "error" not in result:
+        result['model'] = model_name
+        if model_name != route.model:
+            result['modelFallback'] = True
+    return result
 
-Document: {text}"""
+def _quota_tokens(prompt):
+    return prompt.input_tokens + rate_limiter.OUTPUT_TOKEN_ALLOWANCE
 
-        full_prompt = f"{system_prompt}\n\n{text}"
-        
-        # Generate content with timeout handling
-        try:
-            response = model.generate_content(full_prompt)
-        except Exception as timeout_error:
-            if "timeout" in str(timeout_error).lower() or "504" in str(timeout_error):
-                print("--- ERROR: Request timed out. Document may be too long. ---")
-                return {
-                    "error": "Analysis timed out. Please try with a shorter document or try again in a moment."
-                }
-            raise timeout_error
-        
-        # Clean the response to ensure it's a valid JSON string
-        cleaned_response_text = response.text.strip()
-        
-        # Remove markdown code blocks if present
-        if cleaned_response_text.startswith("```json"):
-            cleaned_response_text = cleaned_response_text[7:]
-        elif cleaned_response_text.startswith("```"):
-            cleaned_response_text = cleaned_response_text[3:]
-            
-        if cleaned_response_text.endswith("```"):
-            cleaned_response_text = cleaned_response_text[:-3]
-        
-        # Clean up any remaining whitespace
-        cleaned_response_text = cleaned_response_text.strip()
-        
-        print("--- 3. RECEIVED response from Gemini with 20-point analysis. ---")
-        
-        # Clean and parse JSON response
-        result = clean_json_response(response.text)
-        
-        if result is None:
-            print("--- ERROR: Failed to parse JSON response ---")
-            print(f"--- Raw response (first 500 chars): {response.text[:500]}... ---")
-            return {
-                "error": "Failed to parse AI response. The analysis was generated but couldn't be formatted properly. Please try again."
-            }
-        
-        print("--- JSON parsed successfully ---")
-        
-        # Map to legacy format for backward compatibility
-        result['ratingScore'] = result.get('overallScore', 50)
-        result['ratingText'] = result.get('colorLabel', 'YELLOW')
-        result['shortSummary'] = result.get('summary', '')
-        result['aiSummary'] = result.get('summary', '')
-        result['redFlagsCount'] = len(result.get('redFlags', []))
-        result['fairClausesCount'] = len(result.get('fairClauses', []))
-        
-        # Ensure all expected fields exist
-        if 'redFlags' not in result:
-            result['redFlags'] = []
-        if 'fairClauses' not in result:
-            result['fairClauses'] = []
-        if 'recommendations' not in result:
-            result['recommendations'] = []
-        
-        return result
+def _reserve_quota(route, prompt):
+    """
+    Reserves quota for a call (rate_limiter.py) and returns the wait before
+    it may start; raises BudgetExceeded when that wait would run into the
+    request deadline.
+    """
+    time_left = route.time_left() - deadlines.MIN_CALL_SECONDS
+    try:
+        return rate_limiter.limiter.reserve(_quota_tokens(prompt), max_wait=time_left)
+    except rate_limiter.RateLimitExceeded as e:
+        if e.retry_after <= rate_limiter.limiter.max_wait:
+            raise deadlines.BudgetExceeded(f"a {e.retry_after:.1f}s wait for quota would pass the request deadline") from e
+        raise
 
-    except Exception as e:
-        # --- IMPROVED ERROR LOGGING ---
-        print("\n" + "="*50)
-        print("---!!! GEMINI API ERROR !!! ---")
-        print(f"--- An exception occurred: {e} ---")
-        
-        # Check for specific error types
-        error_message = str(e).lower()
-        if "api key" in error_message and ("invalid" in error_message or "expired" in error_message):
-            print("--- ERROR TYPE: API Key Issue ---")
-            return {
-                "error": "Your Gemini API key has expired or is invalid. Please get a new API key from https://aistudio.google.com/app/apikey and update your .env file."
-            }
-        elif "quota" in error_message or "limit" in error_message:
-            print("--- ERROR TYPE: Quota/Rate Limit ---")
-            return {
-                "error": "API quota exceeded. Please try again later or check your Gemini API usage limits."
-            }
-        elif "network" in error_message or "connection" in error_message:
-            print("--- ERROR TYPE: Network Issue ---")
-            return {
-                "error": "Network connection issue. Please check your internet connection and try again."
-            }
-        else:
-            print("--- ERROR TYPE: Unknown ---")
-        
-        # Print the full traceback to the console for detailed debugging
-        traceback.print_exc() 
+def _is_timeout(error):
+    return "timeout" in str(error).lower() or "504" in str(error)
+
+def _timeout_response():
+    print("--- ERROR: Request timed out. Document may be too long. ---")
+    return {
+        "error": "Analysis timed out. Please try with a shorter document or try again in a moment."
+    }
+
+def _gemini_error_response(e):
+    """Logs a failed Gemini call and turns it into an error result for the user."""
+    # --- IMPROVED ERROR LOGGING ---
+    print("\n" + "="*50)
+    print("---!!! GEMINI API ERROR !!! ---")
+    print(f"--- An exception occurred: {e} ---")
+    
+    if isinstance(e, rate_limiter.RateLimitExceeded):
+        retry_after = max(1, math.ceil(e.retry_after))
+        print(f"--- ERROR TYPE: Local quota queue full, predicted wait {retry_after}s ---")
         print("="*50 + "\n")
         return {
-            "error": "Failed to get analysis from AI. Please try again later."
+            "error": f"The AI analysis service is busy. Please try again in about {retry_after} seconds.",
+            "retryAfter": retry_after,
+        }
+    if isinstance(e, deadlines.BudgetExceeded):
+        print("--- ERROR TYPE: No time left before the request deadline ---")
+        print("="*50 + "\n")
+        return {
+            "error": "The analysis took too long to finish. Please try again in a moment.",
+            "deadlineExceeded": True,
+        }
+    if isinstance(e, resilience.CircuitOpenError):
+        print("--- ERROR TYPE: Circuit open, not calling Gemini ---")
+        print("="*50 + "\n")
+        return {
+            "error": "The AI analysis service is temporarily unavailable. Please try again in a moment.",
+            "circuitOpen": True,
+        }
+    # Check for specific error types
+    error_message = str(e).lower()
+    if "api key" in error_message and ("invalid" in error_message or "expired" in error_message):
+        print("--- ERROR TYPE: API Key Issue ---")
+        return {
+            "error": "Your Gemini API key has expired or is invalid. Please get a new API key from https://aistudio.google.com/app/apikey and update your .env file."
+        }
+    elif "quota" in error_message or "limit" in error_message:
+        print("--- ERROR TYPE: Quota/Rate Limit ---")
+        return {
+            "error": "API quota exceeded. Please try again later or check your Gemini API usage limits."
+        }
+    elif "network" in error_message or "connection" in error_message:
+        print("--- ERROR TYPE: Network Issue ---")
+        return {
+            "error": "Network connection issue. Please check your internet connection and try again."
         }
+    else:
+        print("--- ERROR TYPE: Unknown ---")
+    
+    # Print the full traceback to the console for detailed debugging
+    traceback.print_exc() 
+    print("="*50 + "\n")
+    return {
+        "error": "Failed to get analysis from AI. Please try again later."
+    }
+
+def _parse_gemini_response(response, record=None):
+    """Parses a generate_content response into a complete analysis result."""
+    return _parse_gemini_text(response.text, getattr(response, "usage_metadata", None), record)
+
+def _parse_gemini_text(response_text, usage=None, record=None):
+    """Parses the model's reply text into a complete analysis result; the outcome is noted on `record`."""
+    # Real token count, to compare against the local estimate in /api/metrics
+    if usage is not None:
+        metrics.increment("prompt.actual_input_tokens", usage.prompt_token_count)
+    
+    result = _parse_json_mode_reply(response_text) if prompt_builder.JSON_MODE else None
+    outcome = "json_mode"
+    if result is None:
+        # Free-text reply (JSON mode off) or a JSON-mode reply that did not parse:
+        # clean, repair, and as a last resort build the canned fallback analysis
+        result = _decode_reply_text(response_text)
+        if result is not None and result.get("isFallback"):
+            metrics.increment("parse.canned_fallback")
+            outcome = "canned_fallback"
+        else:
+            metrics.increment("parse.repaired")
+            outcome = "repaired"
+    if record is not None:
+        record.parse = outcome if result is not None else "failed"
+    
+    if result is None:
+        print("--- ERROR: Failed to parse JSON response ---")
+        print(f"--- Raw response (first 500 chars): {response_text[:500]}... ---")
+        return {
+            "error": "Failed to parse AI response. The analysis was generated but couldn't be formatted properly. Please try again."
+        }
+    
+    print("--- JSON parsed successfully ---")
+    return ensure_complete_response(result)
+
+def _parse_json_mode_reply(response_text):
+    """Parses a JSON-mode reply directly; None when it is not a JSON object (e.g. cut off at max_output_tokens)."""
+    try:
+        result = json.loads(response_text)
+    except json.JSONDecodeError as e:
+        print(f"--- WARNING: JSON-mode reply did not parse ({e}), falling back to repair ---")
+        metrics.increment("parse.json_mode_failed")
+        return None
+    if not isinstance(result, dict):
+        metrics.increment("parse.json_mode_failed")
+        return None
+    metrics.increment("parse.json_mode")
+    return result
+
+# --- Map-reduce analysis of long documents ---
+
+# Chunk calls of all requests in this process share one bounded pool, so a
+# burst of long documents cannot open an unbounded number of Gemini calls.
+MAP_REDUCE_WORKERS = int(os.getenv("MAP_REDUCE_WORKERS", "8"))
+_chunk_pool = ThreadPoolExecutor(max_workers=MAP_REDUCE_WORKERS, thread_name_prefix="gemini-chunk")
+
+# A merged score never sits more than this far above the worst chunk, so one
+# dangerous section is not averaged away by many harmless ones.
+MAX_SCORE_ABOVE_WORST_CHUNK = 15
+
+def _generate_chunked_analysis(route, prompts):
+    """Map step: analyzes the chunks concurrently; reduce step: merge_chunk_results."""
+    print(f"--- 2b. Analyzing {len(prompts)} chunks in parallel ---")
+    futures = [_chunk_pool.submit(_analyze_prompt, route, prompt) for prompt in prompts]
+
+    outcomes = []
+    for future in futures:
+        try:
+            outcomes.append(future.result())
+        except Exception as e:
+            outcomes.append(e)
+    return _reduce_chunk_outcomes(prompts, outcomes)
+
+async def _generate_chunked_analysis_async(route, prompts):
+    """_generate_chunked_analysis on the event loop, at most MAP_REDUCE_WORKERS calls at a time."""
+    print(f"--- 2b. Analyzing {len(prompts)} chunks concurrently ---")
+    semaphore = asyncio.Semaphore(MAP_REDUCE_WORKERS)
+
+    async def analyze_chunk(prompt):
+        async with semaphore:
+            return await _analyze_prompt_async(route, prompt)
+
+    outcomes = await asyncio.gather(*(analyze_chunk(prompt) for prompt in prompts), return_exceptions=True)
+    return _reduce_chunk_outcomes(prompts, outcomes)
+
+def _stream_chunked_analysis(route, prompts):
+    """_generate_chunked_analysis that yields each chunk's new findings as soon as the chunk is done."""
+    print(f"--- 2b. Analyzing {len(prompts)} chunks in parallel (streaming) ---")
+    futures = {_chunk_pool.submit(_analyze_prompt, route, prompt): index for index, prompt in enumerate(prompts)}
+
+    outcomes = [None] * len(prompts)
+    seen = set()
+    for future in as_completed(futures):
+        try:
+            outcome = future.result()
+        except Exception as e:
+            outcome = e
+        outcomes[futures[future]] = outcome
+        if isinstance(outcome, Exception) or "error" in outcome or outcome.get("isFallback"):
+            continue
+        for key, event in STREAM_ITEM_EVENTS.items():
+            for item in outcome.get(key, []):
+                title = _normalize_title(item.get('title', '') if isinstance(item, dict) else item)
+                if (key, title) not in seen:
+                    seen.add((key, title))
+                    yield event, item
+    return _reduce_chunk_outcomes(prompts, outcomes)
+
+def _reduce_chunk_outcomes(prompts, outcomes):
+    """Merges the usable chunk results; each outcome is a result dict or an exception."""
+    results = []
+    weights = []
+    first_error = None
+    for prompt, outcome in zip(prompts, outcomes):
+        if isinstance(outcome, Exception):
+            print(f"--- WARNING: Chunk {prompt.part}/{prompt.parts} failed: {outcome} ---")
+            first_error = first_error or outcome
+            continue
+        if "error" in outcome or outcome.get("isFallback"):
+            print(f"--- WARNING: Chunk {prompt.part}/{prompt.parts} returned no usable analysis ---")
+            continue
+        results.append(outcome)
+        weights.append(prompt.document_tokens)
+
+    metrics.increment("map_reduce.chunks", len(prompts))
+    metrics.increment("map_reduce.failed_chunks", len(prompts) - len(results))
+    out_of_time = any(isinstance(outcome, deadlines.BudgetExceeded) for outcome in outcomes)
+    # Half the document unanalyzed is not an analysis of the document
+    if len(results) * 2 < len(prompts):
+        if first_error is not None:
+            raise first_error
+        return {"error": "Failed to analyze enough of this long document. Please try again."}
+
+    print("--- 3. RECEIVED all chunk analyses, merging ---")
+    merged = merge_chunk_results(results, weights)
+    if len(results) < len(prompts):
+        merged['partialAnalysis'] = True
+        if out_of_time:
+            merged['deadlineExceeded'] = True
+    return merged
+
+# --- Incremental analysis of revised documents ---
+
+def _generate_sectioned_analysis(text, state, preliminary_findings, route, owner):
+    """Analyzes the sections not analyzed before (in parallel) and merges them with the cached ones."""
+    print("--- 2. EXECUTING: sectioned Gemini analysis (reusing unchanged sections) in ai.py ---")
+    try:
+        plan = _plan_sections(text, state, preliminary_findings, route, owner)
+        if "error" in plan:
+            return plan
+        futures = {index: _chunk_pool.submit(_analyze_prompt, plan["route"], plan["prompts"][index])
+                   for index, cached in enumerate(plan["cached"]) if cached is None}
+        outcomes = list(plan["cached"])
+        for index, future in futures.items():
+            try:
+                outcomes[index] = future.result()
+            except Exception as e:
+                outcomes[index] = e
+        return _finish_sections(plan, outcomes)
+    except Exception as e:
+        return _gemini_error_response(e)
+
+async def _generate_sectioned_analysis_async(text, state, preliminary_findings, route, owner):
+    print("--- 2. EXECUTING: async sectioned Gemini analysis (reusing unchanged sections) in ai.py ---")
+    try:
+        # Hashing, cache and SQLite lookups are blocking work; keep them off the event loop
+        plan = await asyncio.to_thread(_plan_sections, text, state, preliminary_findings, route, owner)
+        if "error" in plan:
+            return plan
+        semaphore = asyncio.Semaphore(MAP_REDUCE_WORKERS)
+
+        async def analyze_section(prompt, cached):
+            if cached is not None:
+                return cached
+            async with semaphore:
+                return await _analyze_prompt_async(plan["route"], prompt)
+
+        outcomes = await asyncio.gather(*(analyze_section(prompt, cached)
+                                          for prompt, cached in zip(plan["prompts"], plan["cached"])),
+                                        return_exceptions=True)
+        return await asyncio.to_thread(_finish_sections, plan, outcomes)
+    except Exception as e:
+        return _gemini_error_response(e)
+
+def _plan_sections(text, state, preliminary_findings, route, owner):
+    """Splits the document into content-defined sections and looks up the ones already analyzed."""
+    clauses = revisions.split_clauses(text)
+    spans = revisions.split_sections(text, clauses)
+    prepared = _prepare_generation(text, state, preliminary_findings, route, spans=spans)
+    if isinstance(prepared, dict):
+        return prepared
+    route, prompts = prepared
+
+    owner_key = revisions.owner_key(owner)
+    # Keyed by the section's own text (not its part number), per user
+    settings = dict(route.generation_config, max_input_tokens=prompt_builder.MAX_INPUT_TOKENS, section=True, owner=owner_key,
+                    rule_packs=(preliminary_findings or {}).get("rule_pack_versions", {}),
+                    backend=llm_backends.backend_name())
+    keys = [analysis_cache.cache_key(text[start:end], state, prompt_builder.PROMPT_VERSION, route.model, settings)
+            for start, end in spans]
+    cache = analysis_cache.get_cache()
+    return {
+        "route": route,
+        "prompts": prompts,
+        "keys": keys,
+        "cached": [cache.get(key) for key in keys],
+        "owner": owner_key,
+        "document_key": analysis_cache.cache_key(text),
+        "fingerprints": [revisions.clause_fingerprint(text[start:end]) for start, end in clauses],
+    }
+
+def _finish_sections(plan, outcomes):
+    """Caches the newly analyzed sections, merges all of them and notes what was reused."""
+    cache = analysis_cache.get_cache()
+    reused = sum(1 for cached in plan["cached"] if cached is not None)
+    for key, cached, outcome in zip(plan["keys"], plan["cached"], outcomes):
+        if (cached is None and isinstance(outcome, dict) and "error" not in outcome and not outcome.get("isFallback")
+                and not outcome.get("modelFallback")):
+            cache.put(key, outcome)
+    metrics.increment("incremental.sections", len(outcomes))
+    metrics.increment("incremental.reused_sections", reused)
+    print(f"--- Reused {reused} of {len(outcomes)} section analyses ---")
+
+    result = _reduce_chunk_outcomes(plan["prompts"], outcomes)
+    if "error" in result:
+        return result
+
+    store = revisions.get_store()
+    previous = store.find_previous(plan["owner"], plan["document_key"], plan["fingerprints"])
+    store.record(plan["owner"], plan["document_key"], plan["fingerprints"])
+    if previous is not None:
+        metrics.increment("incremental.revisions")
+    result['incremental'] = {
+        "sections": len(outcomes),
+        "reusedSections": reused,
+        "revisionOf": previous[0][:16] if previous else None,
+        "sharedClauses": previous[1] if previous else None,
+        "clauseChanges": previous[2] if previous else None,
+    }
+    return result
+
+def merge_chunk_results(results, weights):
+    """
+    Combines per-chunk analyses into one result: a size-weighted overall score
+    (capped relative to the worst chunk), redFlags/fairClauses deduplicated by
+    title and recommendations deduplicated by text.
+    """
+    total_weight = sum(weights) or len(results)
+    weighted = sum(result.get('overallScore', 50) * (weight or 1) for result, weight in zip(results, weights)) / total_weight
+    worst = min(result.get('overallScore', 50) for result in results)
+    score = int(round(min(weighted, worst + MAX_SCORE_ABOVE_WORST_CHUNK)))
+    color_label, _ = get_rating_band(score)
+
+    summaries = [result.get('summary', '') for result in results if result.get('summary')]
+    merged = {
+        "overallScore": score,
+        "colorLabel": color_label,
+        "summary": " ".join(summaries),
+        "redFlags": _dedupe_by_title(flag for result in results for flag in result.get('redFlags', [])),
+        "fairClauses": _dedupe_by_title(clause for result in results for clause in result.get('fairClauses', [])),
+        "recommendations": _dedupe_text(rec for result in results for rec in result.get('recommendations', [])),
+        "chunkCount": len(results),
+    }
+    models = sorted({result['model'] for result in results if result.get('model')})
+    if models:
+        merged['model'] = ", ".join(models)
+    if any(result.get('modelFallback') for result in results):
+        merged['modelFallback'] = True
+    return ensure_complete_response(merged)
+
+def _normalize_title(title):
+    return " ".join("".join(ch if ch.isalnum() else " " for ch in str(title).lower()).split())
+
+def _dedupe_by_title(items):
+    """Keeps the first item per normalized title; a later, more detailed issue text wins."""
+    by_title = {}
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        key = _normalize_title(item.get('title', ''))
+        kept = by_title.get(key)
+        if kept is None:
+            by_title[key] = dict(item)
+        elif len(str(item.get('issue', ''))) > len(str(kept.get('issue', ''))):
+            kept['issue'] = item['issue']
+    return list(by_title.values())
+
+def _dedupe_text(texts):
+    seen = set()
+    unique = []
+    for text in texts:
+        key = _normalize_title(text)
+        if key not in seen:
+            seen.add(key)
+            unique.append(text)
+    return unique
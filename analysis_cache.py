@@ -0,0 +1,302 @@
+# analysis_cache.py - Caches Gemini analysis results by document content
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import stat
+import tempfile
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+from metrics import metrics
+
+# Set ANALYSIS_CACHE_ENABLED=0 to always call Gemini
+CACHE_ENABLED = os.getenv("ANALYSIS_CACHE_ENABLED", "1") != "0"
+
+# In-process tier: most recently used results, bounded by count and total size
+MEMORY_MAX_ENTRIES = int(os.getenv("ANALYSIS_CACHE_MAX_ENTRIES", "256"))
+MEMORY_MAX_BYTES = int(os.getenv("ANALYSIS_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+
+
+def _user_tag():
+    return str(os.getuid()) if hasattr(os, "getuid") else os.getenv("USERNAME", "user")
+
+
+# Node-local files (SQLite databases, compiled rules) live in a directory only
+# this user can open: they hold documents, e-mails and pickled matchers
+DATA_DIR = os.getenv("LEKHA_DATA_DIR", os.path.join(tempfile.gettempdir(), f"lekha_{_user_tag()}"))
+
+
+def private_dir(path=DATA_DIR):
+    """
+    Creates `path` and any missing parents (mode 0700) if needed and returns
+    it; raises OSError when an existing one is not a directory of this user
+    or others may write to it. One others may only read (as older versions
+    left it) is closed again.
+    """
+    missing = []
+    directory = os.path.abspath(path)
+    while not os.path.lexists(directory):
+        missing.append(directory)
+        directory = os.path.dirname(directory)
+    for directory in reversed(missing):
+        # os.makedirs gives only the last directory its mode; the parents would be 0755
+        try:
+            os.mkdir(directory, 0o700)
+        except FileExistsError:
+            pass
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode):
+        raise OSError(f"{path} is not a directory")
+    if hasattr(os, "getuid"):
+        if info.st_uid != os.getuid() or info.st_mode & 0o022:
+            raise OSError(f"{path} must be owned by this user and closed to others (mode 0700)")
+        if info.st_mode & 0o077:
+            os.chmod(path, 0o700)
+    return path
+
+
+def _create_private_file(path):
+    """Creates the file at `path` readable by this user only (0600), in a private directory."""
+    directory = os.path.dirname(os.path.abspath(path))
+    if directory == os.path.abspath(DATA_DIR) or not os.path.isdir(directory):
+        private_dir(directory)
+    fd = os.open(path, os.O_RDWR | os.O_CREAT | getattr(os, "O_NOFOLLOW", 0), 0o600)
+    try:
+        # Files from before this check may have been created world-readable
+        if hasattr(os, "getuid") and os.fstat(fd).st_uid == os.getuid():
+            os.fchmod(fd, 0o600)
+    finally:
+        os.close(fd)
+
+
+def connect(local, path, synchronous=None):
+    """
+    This thread's connection (kept on `local`, a threading.local) to the
+    SQLite file at `path`, in WAL mode. The file is created mode 0600 (SQLite
+    gives its -wal and -shm files the same mode).
+    """
+    db = getattr(local, "db", None)
+    if db is None:
+        _create_private_file(path)
+        db = sqlite3.connect(path, timeout=5, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        if synchronous:
+            db.execute(f"PRAGMA synchronous={synchronous}")
+        local.db = db
+    return db
+
+
+_singletons_lock = threading.RLock()
+
+
+def process_singleton(namespace, name, factory):
+    """namespace[name] (a module's globals()), created with factory() on first use."""
+    instance = namespace.get(name)
+    if instance is None:
+        with _singletons_lock:
+            instance = namespace.get(name)
+            if instance is None:
+                instance = namespace[name] = factory()
+    return instance
+
+
+# Persistent tier: one SQLite file shared by all workers on the node (also holds
+# the revision fingerprints and the documents kept for explanations)
+CACHE_DB_PATH = os.getenv("ANALYSIS_CACHE_PATH", os.path.join(DATA_DIR, 'analysis_cache.sqlite3'))
+DISK_MAX_ENTRIES = int(os.getenv("ANALYSIS_CACHE_DISK_MAX_ENTRIES", "20000"))
+
+# Results older than this (seconds) are treated as missing in both tiers
+CACHE_TTL = float(os.getenv("ANALYSIS_CACHE_TTL", str(7 * 24 * 3600)))
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text):
+    """
+    Canonical form of a document for cache keys: Unicode NFC with every run of
+    whitespace (including page breaks) collapsed to one space, so the same
+    template extracted from PDF, DOCX or pasted text hashes the same.
+    """
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFC", text)).strip()
+
+
+def cache_key(text, state="", prompt_version="", model_name="", settings=None):
+    """SHA-256 over the normalized text and everything else that shapes the answer."""
+    digest = hashlib.sha256()
+    for part in (prompt_version, model_name, json.dumps(settings or {}, sort_keys=True),
+                 (state or "").strip().lower(), normalize_text(text)):
+        digest.update(part.encode("utf-8") + b"\0")
+    return digest.hexdigest()
+
+
+class MemoryCache:
+    """LRU of JSON-encoded results with entry-count, byte-size and TTL limits."""
+
+    def __init__(self, max_entries=MEMORY_MAX_ENTRIES, max_bytes=MEMORY_MAX_BYTES, ttl=CACHE_TTL):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (stored_at, encoded)
+        self._bytes = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.time() - entry[0] > self.ttl:
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, encoded, stored_at=None):
+        if len(encoded) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (stored_at or time.time(), encoded)
+            self._bytes += len(encoded)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                metrics.increment("analysis_cache.memory_evictions")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def total_bytes(self):
+        return self._bytes
+
+    def _remove(self, key):
+        _, encoded = self._entries.pop(key)
+        self._bytes -= len(encoded)
+
+
+class DiskCache:
+    """
+    SQLite tier shared by the worker processes on one node. WAL mode lets
+    readers and the single writer work at the same time.
+    """
+
+    def __init__(self, path=CACHE_DB_PATH, max_entries=DISK_MAX_ENTRIES, ttl=CACHE_TTL):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._local = threading.local()
+        self._writes = 0
+        self.available = True
+        try:
+            with self._connect() as db:
+                db.execute("CREATE TABLE IF NOT EXISTS analysis_cache ("
+                           "key TEXT PRIMARY KEY, result TEXT NOT NULL, stored_at REAL NOT NULL)")
+                db.execute("CREATE INDEX IF NOT EXISTS analysis_cache_stored_at ON analysis_cache (stored_at)")
+        except (sqlite3.Error, OSError) as e:
+            # A read-only filesystem (e.g. serverless) just means no persistent tier
+            print(f"--- WARNING: Analysis cache disabled at {path}: {e} ---")
+            self.available = False
+
+    def _connect(self):
+        return connect(self._local, self.path, synchronous="NORMAL")
+
+    def get(self, key):
+        if not self.available:
+            return None
+        try:
+            row = self._connect().execute(
+                "SELECT stored_at, result FROM analysis_cache WHERE key = ? AND stored_at >= ?",
+                (key, time.time() - self.ttl)).fetchone()
+        except sqlite3.Error as e:
+            print(f"--- WARNING: Analysis cache read failed: {e} ---")
+            return None
+        return row
+
+    def put(self, key, encoded, stored_at=None):
+        if not self.available:
+            return
+        try:
+            db = self._connect()
+            db.execute("INSERT OR REPLACE INTO analysis_cache (key, result, stored_at) VALUES (?, ?, ?)",
+                       (key, encoded, stored_at or time.time()))
+            self._writes += 1
+            if self._writes % 100 == 0:
+                self.prune()
+        except sqlite3.Error as e:
+            print(f"--- WARNING: Analysis cache write failed: {e} ---")
+
+    def prune(self):
+        """Drops expired rows and the oldest rows beyond max_entries."""
+        db = self._connect()
+        db.execute("DELETE FROM analysis_cache WHERE stored_at < ?", (time.time() - self.ttl,))
+        db.execute("DELETE FROM analysis_cache WHERE key IN (SELECT key FROM analysis_cache "
+                   "ORDER BY stored_at DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+
+    def clear(self):
+        if self.available:
+            self._connect().execute("DELETE FROM analysis_cache")
+
+    def __len__(self):
+        if not self.available:
+            return 0
+        return self._connect().execute("SELECT COUNT(*) FROM analysis_cache").fetchone()[0]
+
+
+class AnalysisCache:
+    """Memory tier in front of the disk tier; disk hits are promoted to memory."""
+
+    def __init__(self, memory=None, disk=None):
+        self.memory = memory if memory is not None else MemoryCache()
+        self.disk = disk if disk is not None else DiskCache()
+
+    def get(self, key):
+        """Returns a fresh copy of the cached result, or None."""
+        entry = self.memory.get(key)
+        if entry is not None:
+            metrics.increment("analysis_cache.memory_hits")
+            return json.loads(entry[1])
+        entry = self.disk.get(key)
+        if entry is not None:
+            metrics.increment("analysis_cache.disk_hits")
+            self.memory.put(key, entry[1], entry[0])
+            return json.loads(entry[1])
+        metrics.increment("analysis_cache.misses")
+        return None
+
+    def put(self, key, result):
+        encoded = json.dumps(result)
+        self.memory.put(key, encoded)
+        self.disk.put(key, encoded)
+        metrics.increment("analysis_cache.stores")
+
+    def clear(self):
+        self.memory.clear()
+        self.disk.clear()
+
+    def stats(self):
+        return {
+            "enabled": CACHE_ENABLED,
+            "memory_entries": len(self.memory),
+            "memory_bytes": self.memory.total_bytes,
+            "disk_entries": len(self.disk),
+            "disk_available": self.disk.available,
+        }
+
+
+_cache = None
+
+
+def get_cache():
+    """The process-wide cache, created on first use."""
+    return process_singleton(globals(), "_cache", AnalysisCache)
@@ -1,6 +1,6 @@
 # app.py (Complete, Updated, and Secured Version)
 
-from flask import Flask, request, jsonify, g
+from flask import Flask, Response, request, jsonify, g, stream_with_context
 from flask_cors import CORS
 import mysql.connector
 from mysql.connector import Error
@@ -9,8 +9,13 @@ import os
 import json
 import re
 import tempfile
+import codecs
+import hmac
+import io
+import time
 from dotenv import load_dotenv
 from urllib.parse import urlparse
+from werkzeug.datastructures import FileStorage
 
 # --- IMPORTS for handling PDF and DOCX files ---
 import PyPDF2
@@ -39,8 +44,20 @@ POPPLER_PATH = os.getenv("POPPLER_PATH", r'C:\Users\JAY GAVALI\Downloads\rent ag
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 CA_PATH = os.path.join(BASE_DIR, 'ca.pem')
 
+# Shared secret for the /api/admin/* endpoints (unset: they are disabled)
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
 # Import the AI analysis logic from your ai.py file
 import ai
+import analysis_cache
+import deadlines
+import explanations
+import flight_recorder
+import jobs
+import model_router
+import rate_limiter
+import resilience
+from metrics import metrics
 
 # Configure Flask to serve React build files
 # The React app will be built and placed in agreement-front-end--main/build
@@ -337,104 +354,288 @@ def login_user():
         print(f"Unexpected login error: {e}")
         return jsonify({"error": "An unexpected error occurred"}), 500
 
+# --- TEXT EXTRACTION ---
+# Extractors yield the document in chunks (PDF pages, DOCX paragraphs or blocks
+# of plain text) so callers can stream them, e.g. into
+# ai.analyze_text_chunks_with_rules, instead of holding several full copies.
+
+TEXT_CHUNK_SIZE = 64 * 1024
+
+class ExtractionError(Exception):
+    """A readable file that we cannot analyze (encrypted, scanned without OCR...)."""
+
+def iter_uploaded_text(file, deadline=None):
+    """Yields the text of an uploaded PDF, DOCX or plain-text file in chunks."""
+    filename = file.filename.lower()
+    if filename.endswith('.pdf'):
+        yield from iter_pdf_text(file, deadline)
+    elif filename.endswith('.docx'):
+        doc = docx.Document(file.stream)
+        for para in doc.paragraphs:
+            yield para.text + '\n'
+    else:  # Assume .txt or other plain text formats
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        while True:
+            block = file.stream.read(TEXT_CHUNK_SIZE)
+            if not block:
+                break
+            yield decoder.decode(block)
+        yield decoder.decode(b'', final=True)
+
+def iter_pdf_text(file, deadline=None):
+    """
+    Yields PDF pages separated by form feeds, falling back to OCR for scanned
+    PDFs. OCR stops early, with the pages read so far, when the next page
+    would not fit in the extraction budget of `deadline` (deadlines.py).
+    """
+    pdf_reader = PyPDF2.PdfReader(file.stream)
+    # Check for encrypted PDFs that cannot be read
+    if pdf_reader.is_encrypted:
+        raise ExtractionError("Cannot process encrypted PDF files.")
+
+    # First, try the fast text extraction. Page breaks before the first page with
+    # text are held back, so a scanned PDF can still switch to OCR cleanly.
+    pending_breaks = 0
+    found_text = False
+    for number, page in enumerate(pdf_reader.pages):
+        page_text = page.extract_text() or ""
+        if number:
+            pending_breaks += 1
+        if found_text or page_text.strip():
+            yield ai.PAGE_BREAK * pending_breaks + page_text
+            pending_breaks = 0
+            found_text = True
+
+    if found_text:
+        return
+
+    # OCR FALLBACK
+    # If the text is still empty, it's likely a scanned PDF.
+    if not OCR_AVAILABLE:
+        raise ExtractionError("This appears to be a scanned PDF. OCR is not available on this server. Please convert to text format or use a different document.")
+
+    print("--- Text extraction failed, falling back to OCR. ---")
+    # We need to save the file temporarily to use its path
+    file.stream.seek(0)
+    fd, temp_path = tempfile.mkstemp(suffix=".pdf")
+    try:
+        with os.fdopen(fd, 'wb') as tmp:
+            tmp.write(file.stream.read())
+
+        # One page at a time, so OCR can stop before the extraction budget runs out
+        page_count = len(pdf_reader.pages)
+        page_seconds = deadlines.MIN_OCR_PAGE_SECONDS
+        for number in range(1, page_count + 1):
+            if deadline is not None and deadline.budget("extract") < page_seconds:
+                deadline.degrade(f"Only the first {number - 1} of {page_count} scanned pages could be read in time.")
+                break
+            start = time.monotonic()
+            image = convert_from_path(temp_path, poppler_path=POPPLER_PATH, first_page=number, last_page=number)[0]
+            yield (ai.PAGE_BREAK if number > 1 else "") + pytesseract.image_to_string(image)
+            page_seconds = max(deadlines.MIN_OCR_PAGE_SECONDS, time.monotonic() - start)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
 # --- Document Analysis Endpoint ---
+ANALYSIS_MODES = ('full', 'fast', 'auto')
+
+# Shared by the Flask view below and the async view in asgi.py
+USER_ID_SQL = "SELECT id FROM users WHERE email = %s"
+INSERT_ANALYSIS_SQL = "INSERT INTO analysis_history (user_id, analysis_result) VALUES (%s, %s)"
+
+def read_document_text(text, file, deadline=None):
+    """
+    Returns the document text from pasted text or an uploaded file (anything
+    with .filename and .stream). Raises ExtractionError with a message for the user.
+    """
+    if text:
+        document_text = text
+    elif file is not None:
+        if not file or file.filename == '':
+            raise ExtractionError("No file selected")
+        try:
+            document_text = ''.join(iter_uploaded_text(file, deadline))
+        except ExtractionError:
+            raise
+        except Exception as e:
+            # Provide a more user-friendly error for corrupted files
+            print(f"File Read Error: {e}")
+            raise ExtractionError("Could not read the uploaded file. It may be corrupted or in an unsupported format.")
+    else:
+        document_text = ""
+
+    if not document_text.strip():
+        raise ExtractionError("Could not extract any text from the document. It might be empty or a scanned image.")
+    return document_text
+
+def parse_analysis_options(values):
+    """Reads the analysis form fields; returns a dict with an "error" key when invalid."""
+    # full: always ask Gemini; fast: rule engine only; auto: Gemini only when the rules are unsure
+    mode = (values.get('mode') or 'full').strip().lower() or 'full'
+    if mode not in ANALYSIS_MODES:
+        return {"error": f"Invalid mode. Use one of: {', '.join(ANALYSIS_MODES)}"}
+    return {
+        "state": values.get('state') or '',
+        "email": values.get('email') or None,
+        "document_type": values.get('document_type') or None,
+        "mode": mode,
+        # cache=bypass always asks Gemini and leaves the analysis cache untouched
+        "bypass_cache": (values.get('cache') or '').strip().lower() == 'bypass',
+    }
+
+def choose_analysis_mode(mode, preliminary_findings):
+    """Resolves auto mode from the rule confidence; returns (mode, confidence)."""
+    confidence = ai.rule_confidence(preliminary_findings)
+    if mode == 'auto':
+        mode = 'fast' if confidence >= ai.FAST_PATH_MIN_CONFIDENCE else 'full'
+    return mode, confidence
+
+def fall_back_to_rules(analysis_result, preliminary_findings, mode, deadline=None):
+    """
+    While the Gemini circuit is open (unless configured to fail), or when the
+    request deadline left Gemini no time, answer with the rule-based result
+    (marked degraded) instead of an error. A Gemini result that the deadline
+    cut short (some chunks missing) is kept, marked degraded.
+    Returns (analysis_result, mode).
+    """
+    out_of_time = analysis_result.pop("deadlineExceeded", False)
+    if out_of_time and "error" not in analysis_result:
+        analysis_result['degraded'] = True
+        if deadline is not None:
+            deadline.degrade("The AI review covered only part of the document in the time available.")
+        return analysis_result, mode
+    if out_of_time or (analysis_result.get("circuitOpen") and resilience.CIRCUIT_OPEN_FALLBACK == "rules"):
+        metrics.increment("analysis.degraded_to_rules")
+        analysis_result = ai.build_rule_based_result(preliminary_findings)
+        analysis_result['degraded'] = True
+        if out_of_time and deadline is not None:
+            deadline.degrade("The AI review could not finish in the time available; this is the rule-based analysis.")
+        return analysis_result, 'fast'
+    return analysis_result, mode
+
+def analysis_error_status(analysis_result):
+    """(status, headers) for a failed analysis: 429 with Retry-After when the Gemini quota queue is full."""
+    if "retryAfter" in analysis_result:
+        return 429, {'Retry-After': str(analysis_result['retryAfter'])}
+    return 500, {}
+
+def build_final_result(analysis_result, preliminary_findings, mode, confidence):
+    """The complete result object sent to the frontend and saved to history."""
+    final_result = analysis_result
+    final_result['redFlagsCount'] = len(analysis_result.get('redFlags', []))
+    final_result['fairClausesCount'] = len(analysis_result.get('fairClauses', []))
+    final_result['analysisMode'] = mode
+    final_result['ruleConfidence'] = confidence
+    # Rule hits (with clause offsets) so the frontend can point at the clause
+    final_result['ruleFindings'] = preliminary_findings
+    final_result['rulePackVersions'] = preliminary_findings['rule_pack_versions']
+    return final_result
+
+def remember_analysis(document_text, state, final_result):
+    """Keeps the document for /api/analysis/<id>/explain and adds its analysisId to the result."""
+    analysis_id = explanations.get_store().save_analysis(document_text, state, final_result)
+    if analysis_id:
+        final_result['analysisId'] = analysis_id
+    return final_result
+
+def save_within_deadline(email, final_result, deadline):
+    """save_analysis_history, unless too little of the request's time is left for it."""
+    if deadline.budget("save") < deadlines.MIN_SAVE_SECONDS:
+        deadline.degrade("The analysis could not be saved to your history in the time available.")
+        deadline.annotate(final_result)
+        return
+    with deadline.stage("save"):
+        save_analysis_history(email, final_result)
+
+def save_analysis_history(email, final_result):
+    """Stores the result for a logged-in user (no-op when the database is unavailable)."""
+    db = get_db()
+    if not db:
+        return
+    cursor = db.cursor()
+    try:
+        cursor.execute(USER_ID_SQL, (email,))
+        user = cursor.fetchone()
+        if user:
+            user_id = user[0]  # The user ID
+            # Convert the final result dictionary to a JSON string for storage.
+            cursor.execute(INSERT_ANALYSIS_SQL, (user_id, json.dumps(final_result)))
+            db.commit()
+            print(f"Analysis saved for user_id: {user_id}")
+    except Error as e:
+        db.rollback()
+        print(f"Error saving analysis to DB: {e}")
+    finally:
+        cursor.close()
+
+def run_analysis(document_text, options, progress=None, deadline=None):
+    """
+    Rules, then Gemini (unless fast mode), then the history insert. Returns the
+    final result, or a dict with an "error" key. `progress(stage, percent)` is
+    called before each step when given. `deadline` (deadlines.py) bounds the
+    steps of a request; background jobs have none.
+    """
+    progress = progress or (lambda stage, percent: None)
+    deadline = deadline or deadlines.Deadline(None)
+    state = options['state']
+
+    # Step 1: Get the analysis from your AI module (ai.py)
+    progress("rules", 20)
+    with deadline.stage("rules"):
+        preliminary_findings = ai.analyze_text_with_rules(document_text, state, options['document_type'])
+    mode, confidence = choose_analysis_mode(options['mode'], preliminary_findings)
+
+    if mode == 'fast':
+        analysis_result = ai.build_rule_based_result(preliminary_findings)
+    else:
+        progress("gemini", 30)
+        with deadline.stage("gemini"):
+            analysis_result = ai.analyze_with_gemini(document_text, preliminary_findings, state,
+                                                     bypass_cache=options['bypass_cache'], owner=options['email'],
+                                                     deadline=deadline, document_type=options['document_type'])
+        analysis_result, mode = fall_back_to_rules(analysis_result, preliminary_findings, mode, deadline)
+
+    if "error" in analysis_result:
+        deadline.log()
+        return analysis_result
+
+    # Step 2: Create the complete final result object to be sent and saved
+    final_result = deadline.annotate(build_final_result(analysis_result, preliminary_findings, mode, confidence))
+    remember_analysis(document_text, state, final_result)
+
+    # Step 3: Save the complete result to the database if the user is logged in
+    if options['email']:
+        progress("saving", 90)
+        save_within_deadline(options['email'], final_result, deadline)
+    deadline.log()
+    return final_result
+
 @app.route('/api/analyze', methods=['POST'])
 def analyze_document():
+    # The platform's request time limit, split between the stages below
+    deadline = deadlines.start()
     try:
-        document_text = ""
-        
+        # async=1: queue the analysis and answer with a job id right away
+        if (request.values.get('async') or '').strip().lower() in ('1', 'true'):
+            body, status = submit_analysis_job(request.values, request.form.get('text'), request.files.get('file'))
+            headers = {'Location': body['statusUrl']} if status == 202 else {}
+            return jsonify(body), status, headers
+
         # Extract text from either pasted content or an uploaded file
-        if 'text' in request.form and request.form['text']:
-            document_text = request.form['text']
-        elif 'file' in request.files:
-            file = request.files['file']
-            if not file or file.filename == '':
-                return jsonify({"error": "No file selected"}), 400
-            
-            try:
-                if file.filename.lower().endswith('.pdf'):
-                    pdf_reader = PyPDF2.PdfReader(file.stream)
-                    # Check for encrypted PDFs that cannot be read
-                    if pdf_reader.is_encrypted:
-                        return jsonify({"error": "Cannot process encrypted PDF files."}), 400
-                    
-                    # First, try the fast text extraction
-                    for page in pdf_reader.pages:
-                        document_text += page.extract_text() or ""
-
-                    # OCR FALLBACK
-                    # If the text is still empty, it's likely a scanned PDF.
-                    if not document_text.strip() and OCR_AVAILABLE:
-                        print("--- Text extraction failed, falling back to OCR. ---")
-                        # We need to save the file temporarily to use its path
-                        file.stream.seek(0)
-                        
-                        fd, temp_path = tempfile.mkstemp(suffix=".pdf")
-                        try:
-                            with os.fdopen(fd, 'wb') as tmp:
-                                tmp.write(file.stream.read())
-                            
-                            images = convert_from_path(temp_path, poppler_path=POPPLER_PATH)
-                            for image in images:
-                                document_text += pytesseract.image_to_string(image) + "\n"
-                        finally:
-                            if os.path.exists(temp_path):
-                                os.remove(temp_path)
-                    elif not document_text.strip() and not OCR_AVAILABLE:
-                        return jsonify({"error": "This appears to be a scanned PDF. OCR is not available on this server. Please convert to text format or use a different document."}), 400
-
-                elif file.filename.lower().endswith('.docx'):
-                    doc = docx.Document(file.stream)
-                    document_text = '\n'.join([para.text for para in doc.paragraphs])
-                else:  # Assume .txt or other plain text formats
-                    document_text = file.read().decode('utf-8')
-            except Exception as e:
-                # Provide a more user-friendly error for corrupted files
-                print(f"File Read Error: {e}")
-                return jsonify({"error": "Could not read the uploaded file. It may be corrupted or in an unsupported format."}), 400
-        
-        if not document_text.strip():
-            return jsonify({"error": "Could not extract any text from the document. It might be empty or a scanned image."}), 400
+        try:
+            with deadline.stage("extract"):
+                document_text = read_document_text(request.form.get('text'), request.files.get('file'), deadline)
+        except ExtractionError as e:
+            return jsonify({"error": str(e)}), 400
 
-        state = request.form.get('state', '')
-        email = request.form.get('email', None)
+        options = parse_analysis_options(request.values)
+        if "error" in options:
+            return jsonify(options), 400
 
-        # Step 1: Get the analysis from your AI module (ai.py)
-        preliminary_findings = ai.analyze_text_with_rules(document_text)
-        gemini_result = ai.analyze_with_gemini(document_text, preliminary_findings, state)
-        
-        if "error" in gemini_result:
-            return jsonify(gemini_result), 500
-
-        # Step 2: Create the complete final result object to be sent and saved
-        final_result = gemini_result
-        final_result['redFlagsCount'] = len(gemini_result.get('redFlags', []))
-        final_result['fairClausesCount'] = len(gemini_result.get('fairClauses', []))
-
-        # Step 3: Save the complete result to the database if the user is logged in
-        if email:
-            db = get_db()
-            if db:
-                cursor = db.cursor()
-                try:
-                    cursor.execute("SELECT id FROM users WHERE email = %s", (email,))
-                    user = cursor.fetchone()
-                    if user:
-                        user_id = user[0]  # The user ID
-                        # Convert the final result dictionary to a JSON string for storage.
-                        result_json_string = json.dumps(final_result)
-                        
-                        cursor.execute(
-                            "INSERT INTO analysis_history (user_id, analysis_result) VALUES (%s, %s)",
-                            (user_id, result_json_string)
-                        )
-                        db.commit()
-                        print(f"Analysis saved for user_id: {user_id}")
-                except Error as e:
-                    db.rollback()
-                    print(f"Error saving analysis to DB: {e}")
-                finally:
-                    cursor.close()
+        final_result = run_analysis(document_text, options, deadline=deadline)
+        if "error" in final_result:
+            return jsonify(final_result), *analysis_error_status(final_result)
 
         # Step 4: Return the complete result to the frontend
         return jsonify(final_result)
@@ -443,6 +644,176 @@ def analyze_document():
         print(f"Unexpected analysis error: {e}")
         return jsonify({"error": "An unexpected error occurred during analysis"}), 500
 
+# --- Background Analysis Jobs ---
+# Scanned PDFs (OCR) plus Gemini can outlast a request timeout, so
+# /api/analyze?async=1 only stores the upload and returns a job id; a worker
+# thread runs extraction -> rules -> Gemini -> history and /api/jobs/<id>
+# reports progress and, at the end, the same result /api/analyze returns.
+
+def run_analysis_job(payload, upload, filename, progress):
+    """jobs.JobQueue handler: the body of /api/analyze for one queued request."""
+    progress("extracting", 10)
+    file = FileStorage(stream=io.BytesIO(upload), filename=filename) if upload is not None else None
+    try:
+        document_text = read_document_text(payload.get('text'), file)
+    except ExtractionError as e:
+        return {"error": str(e)}
+    # get_db() keeps its connection on flask.g, which needs an app context
+    with app.app_context():
+        return run_analysis(document_text, payload['options'], progress)
+
+job_queue = jobs.JobQueue(run_analysis_job)
+
+def submit_analysis_job(values, text, file):
+    """
+    Validates the request and queues it; returns (body, status). `file` is
+    anything with .filename and .stream (also used by asgi.py).
+    """
+    options = parse_analysis_options(values)
+    if "error" in options:
+        return options, 400
+    if not text:
+        if file is None:
+            return {"error": "Could not extract any text from the document. It might be empty or a scanned image."}, 400
+        if not file or file.filename == '':
+            return {"error": "No file selected"}, 400
+    if not job_queue.available:
+        return {"error": "Background analysis is not available on this server"}, 503
+
+    upload = None if text else file.stream.read()
+    job_id = job_queue.submit({"text": text, "options": options}, upload, None if text else file.filename)
+    return {"jobId": job_id, "status": jobs.QUEUED, "statusUrl": f"/api/jobs/{job_id}"}, 202
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Status, stage and progress (0-100) of a background analysis; "result" once it has finished."""
+    job = job_queue.get(job_id) if job_queue.available else None
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job), 200
+
+@app.route('/api/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    """Cancels a queued job, or a running one before its next step."""
+    job = job_queue.cancel(job_id) if job_queue.available else None
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job), 200
+
+def sse_event(name, data):
+    """Formats one Server-Sent Event."""
+    return f"event: {name}\ndata: {json.dumps(data)}\n\n"
+
+# --- Streaming Document Analysis Endpoint ---
+@app.route('/api/analyze/stream', methods=['POST'])
+def analyze_document_stream():
+    """
+    /api/analyze as Server-Sent Events: a "rules" event with the rule-engine
+    result right away, then "field", "redFlag", "fairClause" and
+    "recommendation" events while Gemini writes its reply, and finally
+    "result" with the same payload /api/analyze returns (or "error").
+    """
+    deadline = deadlines.start()
+    try:
+        with deadline.stage("extract"):
+            document_text = read_document_text(request.form.get('text'), request.files.get('file'), deadline)
+    except ExtractionError as e:
+        return jsonify({"error": str(e)}), 400
+
+    options = parse_analysis_options(request.values)
+    if "error" in options:
+        return jsonify(options), 400
+
+    def generate():
+        try:
+            with deadline.stage("rules"):
+                preliminary_findings = ai.analyze_text_with_rules(document_text, options['state'],
+                                                                  options['document_type'])
+            mode, confidence = choose_analysis_mode(options['mode'], preliminary_findings)
+            rule_result = ai.build_rule_based_result(preliminary_findings)
+            yield sse_event("rules", {
+                "analysisMode": mode,
+                "ruleConfidence": confidence,
+                "ruleFindings": preliminary_findings,
+                "preliminaryResult": rule_result,
+            })
+
+            if mode == 'fast':
+                analysis_result = rule_result
+            else:
+                with deadline.stage("gemini"):
+                    for event, data in ai.analyze_with_gemini_stream(document_text, preliminary_findings,
+                                                                     options['state'],
+                                                                     bypass_cache=options['bypass_cache'],
+                                                                     owner=options['email'], deadline=deadline,
+                                                                     document_type=options['document_type']):
+                        if event == "result":
+                            analysis_result = data
+                        else:
+                            yield sse_event(event, data)
+                analysis_result, mode = fall_back_to_rules(analysis_result, preliminary_findings, mode, deadline)
+
+            if "error" in analysis_result:
+                yield sse_event("error", analysis_result)
+                return
+
+            final_result = deadline.annotate(build_final_result(analysis_result, preliminary_findings, mode,
+                                                                confidence))
+            remember_analysis(document_text, options['state'], final_result)
+            if options['email']:
+                save_within_deadline(options['email'], final_result, deadline)
+            deadline.log()
+            yield sse_event("result", final_result)
+
+        except Exception as e:
+            print(f"Unexpected streaming analysis error: {e}")
+            yield sse_event("error", {"error": "An unexpected error occurred during analysis"})
+
+    # X-Accel-Buffering stops nginx from holding events back until the response ends
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# --- On-demand Explanations ---
+@app.route('/api/analysis/<analysis_id>/explain', methods=['GET'])
+def explain_analysis(analysis_id):
+    """
+    Long-form explanation of an analysis (its analysisId), or of one of its red
+    flags with ?flag=<index>. Written by Gemini on first request, then cached.
+    """
+    store = explanations.get_store()
+    stored = store.get_analysis(analysis_id)
+    if stored is None:
+        return jsonify({"error": "Analysis not found or expired. Please analyze the document again."}), 404
+    document_text, state, analysis = stored
+
+    flag_index = request.args.get('flag')
+    flag = None
+    if flag_index is not None:
+        red_flags = analysis.get('redFlags') or []
+        if not flag_index.isdigit() or int(flag_index) >= len(red_flags):
+            return jsonify({"error": f"Invalid flag. This analysis has {len(red_flags)} red flag(s), numbered from 0."}), 400
+        flag_index = int(flag_index)
+        flag = red_flags[flag_index]
+
+    target = explanations.target_key(flag_index)
+    explanation = store.get_explanation(analysis_id, target)
+    cached = explanation is not None
+    if cached:
+        metrics.increment("explain.cache_hits")
+    else:
+        result = ai.explain_with_gemini(document_text, analysis, state, flag)
+        if "error" in result:
+            return jsonify(result), *analysis_error_status(result)
+        explanation = result['explanation']
+        store.put_explanation(analysis_id, target, explanation)
+
+    return jsonify({
+        "analysisId": analysis_id,
+        "flag": flag,
+        "explanation": explanation,
+        "cached": cached,
+    }), 200
+
 # --- Get Analysis History Endpoint ---
 @app.route('/api/history/<email>', methods=['GET'])
 def get_history(email):
@@ -627,6 +998,40 @@ def clear_analysis_history():
         print(f"❌ Unexpected error in clear_history: {e}")
         return jsonify({"error": "An unexpected error occurred"}), 500
 
+# Metrics endpoint: open like /api/health, so it reports counts only (no paths or process ids)
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Counters and histograms of this worker process (cache hits/misses, retries, Gemini latency and tokens, ...), cache sizes and circuit state"""
+    return jsonify({
+        "counters": metrics.snapshot(),
+        "histograms": metrics.histograms(),
+        "flightRecorder": flight_recorder.recorder.stats(),
+        "analysisCache": analysis_cache.get_cache().stats(),
+        "gemini": resilience.gemini.stats(),
+        "modelRouting": model_router.stats(),
+        "geminiRateLimit": rate_limiter.limiter.stats(),
+        "jobs": job_queue.stats(),
+    }), 200
+
+def admin_allowed():
+    """Requests must send ADMIN_TOKEN as X-Admin-Token; without ADMIN_TOKEN, none are allowed."""
+    if not ADMIN_TOKEN:
+        # Behind a reverse proxy every request looks local, so the address proves nothing
+        return False
+    return hmac.compare_digest(request.headers.get('X-Admin-Token', ''), ADMIN_TOKEN)
+
+@app.route('/api/admin/gemini-calls', methods=['GET'])
+def get_gemini_calls():
+    """The most recent Gemini calls of this worker process (flight_recorder.py), newest first; ?limit= caps the list"""
+    if not admin_allowed():
+        return jsonify({"error": "Not authorized"}), 403
+    try:
+        limit = max(0, int(request.args.get('limit', 100)))
+    except ValueError:
+        return jsonify({"error": "limit must be a number"}), 400
+    return jsonify(dict(flight_recorder.recorder.stats(), pid=os.getpid(),
+                        calls=flight_recorder.recorder.recent(limit))), 200
+
 # Health check endpoint
 @app.route('/api/health', methods=['GET'])
 def health_check():
@@ -0,0 +1,208 @@
+# asgi.py - ASGI entry point with an async /api/analyze
+#
+#   uvicorn asgi:app --host 0.0.0.0 --port 5000 --workers 2
+#
+# POST /api/analyze runs on the event loop: text extraction and the rule scan
+# go to worker threads, the Gemini call uses the async client and the history
+# insert uses aiomysql, so a waiting analysis holds no thread and one process
+# can keep hundreds of them in flight. Every other route is served by the
+# Flask app in app.py, unchanged.
+
+import asyncio
+import contextlib
+import json
+import os
+import ssl
+from urllib.parse import urlparse
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Mount, Route
+
+import ai
+import app as flask_app
+import deadlines
+from app import ExtractionError
+
+# The history insert is skipped (with a warning) when aiomysql is not installed
+try:
+    import aiomysql
+    AIOMYSQL_AVAILABLE = True
+except ImportError:
+    AIOMYSQL_AVAILABLE = False
+
+# Connections kept open per worker process for history inserts
+DB_POOL_SIZE = int(os.getenv("ASYNC_DB_POOL_SIZE", "10"))
+
+
+class UploadAdapter:
+    """Gives a Starlette UploadFile the .filename/.stream of a Flask FileStorage."""
+
+    def __init__(self, upload):
+        self.filename = upload.filename or ''
+        self.stream = upload.file
+
+    def __bool__(self):
+        return bool(self.filename)
+
+
+async def analyze_document(request):
+    # The platform's request time limit, split between the stages below (deadlines.py)
+    deadline = deadlines.start()
+    try:
+        form = await request.form()
+        upload = form.get('file')
+        file = UploadAdapter(upload) if upload is not None and not isinstance(upload, str) else None
+        values = dict(form)
+        values.setdefault('cache', request.query_params.get('cache'))
+        values.setdefault('async', request.query_params.get('async'))
+
+        # async=1: queue the analysis on the job workers of app.py and return the job id
+        if (values.get('async') or '').strip().lower() in ('1', 'true'):
+            body, status = await asyncio.to_thread(flask_app.submit_analysis_job, values, form.get('text'), file)
+            headers = {'Location': body['statusUrl']} if status == 202 else {}
+            return JSONResponse(body, status_code=status, headers=headers)
+
+        # Extract text from either pasted content or an uploaded file
+        try:
+            with deadline.stage("extract"):
+                document_text = await asyncio.to_thread(flask_app.read_document_text, form.get('text'), file,
+                                                        deadline)
+        except ExtractionError as e:
+            return JSONResponse({"error": str(e)}, status_code=400)
+
+        options = flask_app.parse_analysis_options(values)
+        if "error" in options:
+            return JSONResponse(options, status_code=400)
+        state = options['state']
+
+        # Step 1: the rule scan is CPU work, keep it off the event loop
+        with deadline.stage("rules"):
+            preliminary_findings = await asyncio.to_thread(
+                ai.analyze_text_with_rules, document_text, state, options['document_type'])
+        mode, confidence = flask_app.choose_analysis_mode(options['mode'], preliminary_findings)
+
+        if mode == 'fast':
+            analysis_result = ai.build_rule_based_result(preliminary_findings)
+        else:
+            with deadline.stage("gemini"):
+                analysis_result = await ai.analyze_with_gemini_async(
+                    document_text, preliminary_findings, state, bypass_cache=options['bypass_cache'],
+                    owner=options['email'], deadline=deadline, document_type=options['document_type'])
+            analysis_result, mode = flask_app.fall_back_to_rules(analysis_result, preliminary_findings, mode,
+                                                                 deadline)
+
+        if "error" in analysis_result:
+            status, headers = flask_app.analysis_error_status(analysis_result)
+            return JSONResponse(analysis_result, status_code=status, headers=headers)
+
+        # Step 2: Create the complete final result object to be sent and saved
+        final_result = deadline.annotate(
+            flask_app.build_final_result(analysis_result, preliminary_findings, mode, confidence))
+        await asyncio.to_thread(flask_app.remember_analysis, document_text, state, final_result)
+
+        # Step 3: Save the complete result to the database if the user is logged in (and there is time)
+        if options['email']:
+            if deadline.budget("save") >= deadlines.MIN_SAVE_SECONDS:
+                with deadline.stage("save"):
+                    await save_analysis_history(options['email'], final_result)
+            else:
+                deadline.degrade("The analysis could not be saved to your history in the time available.")
+                deadline.annotate(final_result)
+
+        deadline.log()
+        return JSONResponse(final_result)
+
+    except Exception as e:
+        print(f"Unexpected analysis error: {e}")
+        return JSONResponse({"error": "An unexpected error occurred during analysis"}, status_code=500)
+
+
+# --- Async database access (history inserts) ---
+
+_db_pool = None
+_db_pool_lock = asyncio.Lock()
+
+
+def _db_settings():
+    """aiomysql connection settings, chosen like app.get_db_connection (Aiven first, then local)."""
+    use_local_fallback = os.getenv("USE_LOCAL_DB_FALLBACK", "false").lower() == "true"
+    database_url = os.getenv("DATABASE_URL")
+    if database_url and not use_local_fallback:
+        parsed = urlparse(database_url)
+        return {
+            'host': parsed.hostname,
+            'user': parsed.username,
+            'password': parsed.password,
+            'db': parsed.path[1:] if parsed.path else 'defaultdb',
+            'port': parsed.port or 10102,
+            'ssl': ssl.create_default_context(cafile=flask_app.CA_PATH),
+        }
+    return {
+        'host': os.getenv("DB_HOST", 'localhost'),
+        'user': os.getenv("DB_USER", 'root'),
+        'password': os.getenv("DB_PASSWORD") or '',
+        'db': os.getenv("DB_NAME", 'rent_agreements_db'),
+        'port': int(os.getenv("DB_PORT", 3306)),
+    }
+
+
+async def get_db_pool():
+    """The worker's aiomysql pool, created on first use; None when the database is unavailable."""
+    global _db_pool
+    if not AIOMYSQL_AVAILABLE:
+        return None
+    async with _db_pool_lock:
+        if _db_pool is None:
+            try:
+                _db_pool = await aiomysql.create_pool(minsize=1, maxsize=DB_POOL_SIZE, autocommit=False,
+                                                      **_db_settings())
+            except Exception as e:
+                print(f"❌ Async database connection error: {e}")
+                return None
+    return _db_pool
+
+
+async def save_analysis_history(email, final_result):
+    """Stores the result for a logged-in user; database errors are logged, never raised (the analysis is done)."""
+    pool = await get_db_pool()
+    if pool is None:
+        print("--- WARNING: Analysis not saved: no async database connection ---")
+        return
+    try:
+        async with pool.acquire() as connection:
+            async with connection.cursor() as cursor:
+                try:
+                    await cursor.execute(flask_app.USER_ID_SQL, (email,))
+                    user = await cursor.fetchone()
+                    if user:
+                        await cursor.execute(flask_app.INSERT_ANALYSIS_SQL, (user[0], json.dumps(final_result)))
+                        await connection.commit()
+                        print(f"Analysis saved for user_id: {user[0]}")
+                except Exception:
+                    await connection.rollback()
+                    raise
+    except Exception as e:
+        # A database that went away after the pool was created
+        print(f"Error saving analysis to DB: {e}")
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    yield
+    global _db_pool
+    if _db_pool is not None:
+        _db_pool.close()
+        await _db_pool.wait_closed()
+        _db_pool = None
+
+
+app = Starlette(
+    routes=[
+        Route('/api/analyze', analyze_document, methods=['POST']),
+        # Everything else (auth, history, React build...) is the Flask app, run in a thread pool
+        Mount('/', app=WSGIMiddleware(flask_app.app)),
+    ],
+    lifespan=lifespan,
+)
@@ -0,0 +1,73 @@
+"""
+Benchmark: rescoring an archive with analyze_texts_with_rules_batch vs calling
+analyze_text_with_rules one document at a time.
+
+Run from the project root:
+    python benchmarks/bench_batch_rules.py                 # 100k agreements
+    python benchmarks/bench_batch_rules.py --docs 10000 --size 4000
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ai
+import rule_batch
+from corpus import generate_corpus
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--docs', type=int, default=100_000)
+    parser.add_argument('--size', type=int, default=2000, help="characters per agreement")
+    parser.add_argument('--processes', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    texts = list(generate_corpus(args.docs, seed=args.seed, size=args.size, risky_ratio=0.2))
+    megabytes = sum(len(text) for text in texts) / (1024 * 1024)
+    print(f"Generated {args.docs} agreements ({megabytes:.1f} MB) in {time.perf_counter() - start:.1f}s")
+    print(f"NumPy available: {rule_batch.NUMPY_AVAILABLE}, processes: {args.processes}")
+
+    # analyze_text_with_rules prints a progress line per call; keep it out of the timing output
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        single = [ai.analyze_text_with_rules(text) for text in texts]
+    single_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batch_one = ai.analyze_texts_with_rules_batch(texts, processes=1)
+    batch_one_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batch_pool = ai.analyze_texts_with_rules_batch(texts, processes=args.processes)
+    batch_pool_time = time.perf_counter() - start
+
+    for name, batch in (("1 process", batch_one), ("process pool", batch_pool)):
+        mismatches = sum(
+            1 for one, other in zip(single, batch['results'])
+            if one['preliminary_score'] != other['preliminary_score']
+        )
+        if mismatches:
+            print(f"!!! {mismatches} score mismatches for batch ({name})")
+
+    print(f"{'mode':<28} {'seconds':>8} {'docs/s':>10} {'speedup':>8}")
+    for name, seconds in (
+        ("analyze_text_with_rules loop", single_time),
+        ("batch, 1 process", batch_one_time),
+        (f"batch, {args.processes} processes", batch_pool_time),
+    ):
+        print(f"{name:<28} {seconds:>8.2f} {args.docs / seconds:>10.0f} {single_time / seconds:>7.1f}x")
+
+    non_zero = len(batch_pool['hit_matrix']['indices'])
+    print(f"Hit matrix: {args.docs} x {len(batch_pool['rule_ids'])}, {non_zero} non-zero entries")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""
+Benchmark: end-to-end latency of POST /api/analyze with mode=fast (rules only,
+no Gemini call), measured through the Flask test client.
+
+Run from the project root:
+    python benchmarks/bench_fast_mode.py
+    python benchmarks/bench_fast_mode.py --requests 2000 --size 20000
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as app_module
+from corpus import generate_corpus
+
+# The latency target for mode=fast
+P99_TARGET_MS = 50
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--size', type=int, default=8000, help="characters per agreement")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    texts = list(generate_corpus(args.requests, seed=args.seed, size=args.size, risky_ratio=0.2))
+    client = app_module.app.test_client()
+    # Warm up: the first request loads and compiles the rule packs
+    client.post('/api/analyze', data={'text': texts[0], 'mode': 'fast'})
+
+    timings = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for text in texts:
+            start = time.perf_counter()
+            response = client.post('/api/analyze', data={'text': text, 'mode': 'fast'})
+            timings.append((time.perf_counter() - start) * 1000)
+            if response.status_code != 200:
+                raise SystemExit(f"Request failed with {response.status_code}: {response.get_json()}")
+
+    p99 = percentile(timings, 0.99)
+    print(f"{args.requests} requests, {args.size} characters each")
+    print(f"p50 {statistics.median(timings):.2f} ms   p95 {percentile(timings, 0.95):.2f} ms   "
+          f"p99 {p99:.2f} ms   max {max(timings):.2f} ms")
+    print(f"p99 target {P99_TARGET_MS} ms: {'met' if p99 < P99_TARGET_MS else 'MISSED'}")
+
+
+if __name__ == '__main__':
+    main()
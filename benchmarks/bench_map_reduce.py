@@ -0,0 +1,76 @@
+"""
+Benchmark: end-to-end latency of analyze_with_gemini on a long agreement with
+map-reduce chunking vs a single call, against a simulated Gemini whose latency
+grows with the prompt size (no network, no API key needed).
+
+Run from the project root:
+    python benchmarks/bench_map_reduce.py
+    python benchmarks/bench_map_reduce.py --pages 120 --ms-per-1k-tokens 150
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ai
+import analysis_cache
+import gemini_client
+import prompt_builder
+from corpus import generate_agreement
+
+REPLY = json.dumps({"overallScore": 60, "colorLabel": "ORANGE", "summary": "ok",
+                    "redFlags": [{"title": "Late Fees", "issue": "x"}], "fairClauses": [], "recommendations": []})
+
+
+class SimulatedModel:
+    def __init__(self, base_seconds, seconds_per_token):
+        self.base_seconds = base_seconds
+        self.seconds_per_token = seconds_per_token
+
+    def generate_content(self, contents):
+        time.sleep(self.base_seconds + prompt_builder.estimate_tokens(contents) * self.seconds_per_token)
+        return type("Response", (), {"text": REPLY})()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, default=60)
+    parser.add_argument('--chars-per-page', type=int, default=3000)
+    parser.add_argument('--base-ms', type=float, default=800, help="fixed latency per call")
+    parser.add_argument('--ms-per-1k-tokens', type=float, default=100, help="latency per 1k prompt tokens")
+    args = parser.parse_args()
+
+    text = generate_agreement(seed=0, size=args.pages * args.chars_per_page, pages=args.pages)
+    model = SimulatedModel(args.base_ms / 1000, args.ms_per_1k_tokens / 1000 / 1000)
+    analysis_cache.CACHE_ENABLED = False
+    gemini_client.registry.api_key = lambda: "k" * 39
+    gemini_client.registry.get_model = lambda *a, **k: model
+
+    findings = ai.analyze_text_with_rules(text)
+    tokens = prompt_builder.estimate_tokens(text)
+    print(f"{args.pages} pages, {len(text)} characters, ~{tokens} tokens")
+
+    timings = {}
+    for name, min_tokens in (("single call", 10 ** 9), ("map-reduce", prompt_builder.MAP_REDUCE_MIN_TOKENS)):
+        prompt_builder.MAP_REDUCE_MIN_TOKENS = min_tokens
+        with contextlib.redirect_stdout(io.StringIO()):
+            prompts = prompt_builder.build_analysis_prompts(text, "", findings)
+            start = time.perf_counter()
+            ai.analyze_with_gemini(text, findings)
+            timings[name] = time.perf_counter() - start
+        slowest = max(model.base_seconds + p.input_tokens * model.seconds_per_token for p in prompts)
+        trimmed = sum(p.trimmed_chars for p in prompts)
+        print(f"{name:<12} {len(prompts):>3} call(s)  {timings[name]:6.2f}s  "
+              f"(slowest call {slowest:.2f}s, {trimmed} characters trimmed)")
+
+    print(f"speedup {timings['single call'] / timings['map-reduce']:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Benchmark: prompt v3 (document only) vs v4 (rule findings listed, document
+condensed) vs v5 (v4 with a compact reply) vs v6 (v5 with unflagged clauses
+shortened) - input tokens per prompt and, with --live, real input/output
+tokens and latency from Gemini.
+
+Run from the project root:
+    python benchmarks/bench_prompt_focus.py                  # offline, token estimates
+    python benchmarks/bench_prompt_focus.py --live --runs 3  # needs GEMINI_API_KEY
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ai
+import gemini_client
+import prompt_builder
+from corpus import generate_agreement
+
+# (characters, pages) of the test agreements
+DOCUMENTS = [(4_000, 1), (20_000, 8), (40_000, 16)]
+VERSIONS = ["3", "4", "5", "6"]
+
+
+def build_prompt(text, version):
+    with contextlib.redirect_stdout(io.StringIO()):
+        findings = ai.analyze_text_with_rules(text)
+        return prompt_builder.build_analysis_prompt(text, "", findings, version=version)
+
+
+def run_live(prompt, runs):
+    model = gemini_client.registry.get_model(generation_config=ai.DETERMINISTIC_GENERATION_CONFIG,
+                                             system_instruction=prompt.system_instruction)
+    inputs, outputs, seconds = [], [], []
+    for _ in range(runs):
+        start = time.perf_counter()
+        response = model.generate_content(prompt.contents)
+        seconds.append(time.perf_counter() - start)
+        inputs.append(response.usage_metadata.prompt_token_count)
+        outputs.append(response.usage_metadata.candidates_token_count)
+    return statistics.median(inputs), statistics.median(outputs), statistics.median(seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--live', action='store_true', help="call Gemini and report real tokens and latency")
+    parser.add_argument('--runs', type=int, default=3, help="live calls per document and version")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.live:
+        print(f"{'document':<18} {'prompt':>6} {'input tok':>10} {'output tok':>11} {'seconds':>8}")
+    else:
+        print(f"{'document':<18} {'prompt':>6} {'est. input tok':>15} {'condensed chars':>16} {'vs v3':>7}")
+
+    for size, pages in DOCUMENTS:
+        text = generate_agreement(seed=args.seed, size=size, pages=pages, furniture=True)
+        name = f"{size // 1000}k chars/{pages}p"
+        baseline = None
+        for version in VERSIONS:
+            prompt = build_prompt(text, version)
+            if args.live:
+                inputs, outputs, seconds = run_live(prompt, args.runs)
+                print(f"{name:<18} {'v' + version:>6} {inputs:>10.0f} {outputs:>11.0f} {seconds:>8.2f}")
+            else:
+                baseline = baseline or prompt.input_tokens
+                change = (prompt.input_tokens - baseline) / baseline
+                print(f"{name:<18} {'v' + version:>6} {prompt.input_tokens:>15} {prompt.condensed_chars:>16} "
+                      f"{change:>+7.0%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""
+Benchmark: single-pass PhraseMatcher vs the old one-substring-scan-per-rule loop,
+and the anchored PatternMatcher vs one regex scan per pattern rule.
+
+Run from the project root:
+    python benchmarks/bench_rule_matcher.py
+    python benchmarks/bench_rule_matcher.py --rules 1000 5000 10000 --doc-mb 1
+    python benchmarks/bench_rule_matcher.py --pattern-rules 10 100 1000
+"""
+
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rule_engine import PatternMatcher, PhraseMatcher, pattern_rule_regex
+
+# The per-rule regex loop is too slow to time beyond this many pattern rules
+LEGACY_PATTERN_LIMIT = 100
+
+
+def make_vocabulary(rng, size=5000):
+    """Random lowercase pseudo-words, 3-10 letters long."""
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    return [''.join(rng.choice(letters) for _ in range(rng.randint(3, 10))) for _ in range(size)]
+
+
+def make_rules(rng, vocabulary, count):
+    """Random 2-4 word phrases with a score, like the phrases of a rule pack."""
+    rules = {}
+    while len(rules) < count:
+        phrase = ' '.join(rng.choice(vocabulary) for _ in range(rng.randint(2, 4)))
+        rules[phrase] = rng.randint(10, 99)
+    return rules
+
+
+def make_document(rng, vocabulary, rules, size_bytes):
+    """Random words of roughly size_bytes with a rule phrase planted every ~2 KB."""
+    phrases = list(rules)
+    parts = []
+    length = 0
+    while length < size_bytes:
+        if rng.random() < 0.005:
+            word = rng.choice(phrases)
+        else:
+            word = rng.choice(vocabulary)
+        parts.append(word)
+        length += len(word) + 1
+    return ' '.join(parts)
+
+
+def legacy_scan(rules, text):
+    """The original analyze_text_with_rules loop: one substring scan per rule."""
+    text_lower = text.lower()
+    return {phrase for phrase in rules if phrase in text_lower}
+
+
+def make_pattern_rules(rng, vocabulary, count):
+    """Proximity rules ("word A within 4 words of word B")."""
+    return [{"id": f"rule-{i}", "near": [rng.choice(vocabulary), rng.choice(vocabulary)], "within": 4}
+            for i in range(count)]
+
+
+def legacy_pattern_scan(patterns, text):
+    """One case-insensitive regex scan per pattern rule."""
+    return {rule_id for rule_id, pattern in patterns if pattern.search(text)}
+
+
+def best_of(func, repeat):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rules', type=int, nargs='+', default=[1000, 2500, 5000, 10000])
+    parser.add_argument('--pattern-rules', type=int, nargs='*', default=[10, 100, 1000])
+    parser.add_argument('--doc-mb', type=float, default=1.0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    vocabulary = make_vocabulary(rng)
+    size_bytes = int(args.doc_mb * 1024 * 1024)
+
+    print(f"Document size: {args.doc_mb} MB, best of {args.repeat} runs")
+    print(f"{'rules':>7} {'compile s':>10} {'legacy s':>10} {'matcher s':>10} {'speedup':>8} {'legacy MB/s':>12} {'matcher MB/s':>13}")
+
+    for count in args.rules:
+        rules = make_rules(rng, vocabulary, count)
+        text = make_document(rng, vocabulary, rules, size_bytes)
+        mb = len(text) / (1024 * 1024)
+
+        compile_start = time.perf_counter()
+        matcher = PhraseMatcher(rules)
+        compile_time = time.perf_counter() - compile_start
+
+        legacy_time, legacy_found = best_of(lambda: legacy_scan(rules, text), args.repeat)
+        matcher_time, matcher_found = best_of(lambda: matcher.find_all(text), args.repeat)
+
+        if legacy_found != matcher_found:
+            print(f"!!! Result mismatch for {count} rules: "
+                  f"{len(legacy_found ^ matcher_found)} phrases differ")
+
+        print(f"{count:>7} {compile_time:>10.3f} {legacy_time:>10.3f} {matcher_time:>10.3f} "
+              f"{legacy_time / matcher_time:>7.1f}x {mb / legacy_time:>12.1f} {mb / matcher_time:>13.1f}")
+
+    if not args.pattern_rules:
+        return
+
+    print()
+    print(f"Pattern rules (proximity), best of {args.repeat} runs")
+    print(f"{'rules':>7} {'compile s':>10} {'re-loop s':>10} {'matcher s':>10} {'speedup':>8}")
+    text = ' '.join(rng.choice(vocabulary) for _ in range(size_bytes // 7))
+
+    for count in args.pattern_rules:
+        rules = make_pattern_rules(rng, vocabulary, count)
+        compile_start = time.perf_counter()
+        matcher = PatternMatcher(rules)
+        compile_time = time.perf_counter() - compile_start
+        matcher_time, matcher_found = best_of(lambda: {rule for _, _, rule in matcher.finditer(text)}, args.repeat)
+
+        if count <= LEGACY_PATTERN_LIMIT:
+            patterns = [(rule['id'], re.compile(pattern_rule_regex(rule), re.IGNORECASE)) for rule in rules]
+            legacy_time, legacy_found = best_of(lambda: legacy_pattern_scan(patterns, text), args.repeat)
+            if legacy_found != matcher_found:
+                print(f"!!! Result mismatch for {count} pattern rules")
+            print(f"{count:>7} {compile_time:>10.3f} {legacy_time:>10.3f} {matcher_time:>10.3f} "
+                  f"{legacy_time / matcher_time:>7.1f}x")
+        else:
+            print(f"{count:>7} {compile_time:>10.3f} {'-':>10} {matcher_time:>10.3f} {'-':>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+"""
+Shared setup for the micro-benchmark suite (benchmarks/test_bench_*.py).
+
+Needs pytest-benchmark. Run from the project root:
+
+    # compare against the saved baseline; fail on a >35% slowdown of the median
+    python -m pytest benchmarks --benchmark-storage=benchmarks/baselines \
+        --benchmark-compare --benchmark-compare-fail=median:35%
+
+    # after an intended performance change, save a new baseline
+    python -m pytest benchmarks --benchmark-storage=benchmarks/baselines --benchmark-save=baseline
+
+Baselines are machine specific (pytest-benchmark files them per platform and
+Python version), so compare runs on the same kind of machine. The parser
+benchmarks take tens of microseconds and are noisy on shared machines; judge
+them by a trend over a few runs rather than by one failed check.
+"""
+
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+sys.path.insert(0, BENCHMARKS_DIR)
+
+from corpus import generate_agreement  # noqa: E402
+
+# Agreement sizes (characters) the size-dependent benchmarks run at
+DOCUMENT_SIZES = {"4k": 4_000, "64k": 64_000, "1m": 1_000_000}
+
+
+@pytest.fixture(scope="session", params=list(DOCUMENT_SIZES))
+def agreement(request):
+    """A deterministic agreement at each benchmark size (20% risky clauses, 4 pages per 4k)."""
+    size = DOCUMENT_SIZES[request.param]
+    return generate_agreement(seed=1, size=size, risky_ratio=0.2, negated_ratio=0.05, pages=max(1, size // 4000))
@@ -0,0 +1,232 @@
+"""
+Deterministic synthetic agreement generator for benchmarks.
+
+The same seed always gives the same documents, so benchmark numbers from
+different runs and machines are comparable.
+
+    from corpus import generate_agreement, generate_corpus
+    text = generate_agreement(seed=7, size=20_000, risky_ratio=0.3)
+
+It also renders agreements as PDF / DOCX uploads and produces Gemini-style
+JSON replies (clean, fenced or with broken multiline strings) for the parser
+benchmarks.
+"""
+
+import io
+import json
+import random
+
+TITLES = [
+    "RENTAL AGREEMENT",
+    "LEAVE AND LICENSE AGREEMENT",
+    "TERMS AND CONDITIONS OF SERVICE",
+    "PRIVACY POLICY",
+    "EMPLOYMENT AGREEMENT",
+]
+
+PARTIES = ["the Tenant", "the Licensee", "the User", "the Employee", "the Customer"]
+OWNERS = ["the Landlord", "the Licensor", "the Company", "the Employer", "the Provider"]
+
+# Ordinary clauses that should not trigger any rule
+FAIR_CLAUSES = [
+    "{party} shall pay the monthly amount of Rs. {amount} on or before the {day}th day of each month.",
+    "Either party may end this agreement by giving {days} days written notice to the other party.",
+    "The security deposit of Rs. {amount} shall be refunded within {days} days of the end of this agreement.",
+    "{owner} shall carry out structural repairs at its own cost within a reasonable time.",
+    "{party} may use the premises only for residential purposes during the term of {months} months.",
+    "Any dispute shall first be referred to mediation in the city where the premises are located.",
+    "{owner} shall give {party} a written receipt for every payment received.",
+    "Personal data is processed only to provide the service and is deleted within {days} days of a request.",
+    "This agreement is governed by the laws of India and the courts at {city} have jurisdiction.",
+    "{party} may request a copy of this agreement and all notices at any time.",
+    "Normal wear and tear shall not be deducted from the security deposit.",
+    "Both parties shall keep the terms of this agreement confidential.",
+]
+
+# Clauses that contain rule-pack phrases or pattern-rule wording
+RISKY_CLAUSES = [
+    "The security deposit is non-refundable under any circumstances.",
+    "{owner} may access the premises without notice at any time.",
+    "{party} is responsible for all repairs, including structural defects.",
+    "Late fees of {percent}% per day shall apply to any delayed payment.",
+    "This agreement is subject to automatic renewal unless cancelled {days} days in advance.",
+    "The monthly charges may be increased at any time at the sole discretion of {owner}.",
+    "{party} agrees to waive all of your rights to claim damages.",
+    "{owner} may enter the premises on 24 hours notice.",
+    "All disputes shall be settled by binding arbitration and {party} accepts a class action waiver.",
+    "{owner} may sell your data and share your information with third parties.",
+    "The deposit will be forfeited if {party} leaves before {months} months.",
+    "The premises are provided as-is with no warranty of any kind.",
+    "{party} shall indemnify and hold harmless {owner} against all claims.",
+    "{owner} may modify terms at any time without notice.",
+    "This booking cannot be cancelled and there is no refund.",
+]
+
+# Clauses that contain rule wording in a negated form ("no late fees")
+NEGATED_CLAUSES = [
+    "There are no late fees for payments made within the grace period.",
+    "{owner} does not sell your data to advertisers.",
+    "The rent will not be increased at any time during the lock-in.",
+]
+
+CITIES = ["Mumbai", "Pune", "Chennai", "Bengaluru", "Delhi", "Kolkata"]
+
+
+def _fill(template, rng):
+    return template.format(
+        party=rng.choice(PARTIES),
+        owner=rng.choice(OWNERS),
+        amount=rng.randrange(5000, 90000, 500),
+        day=rng.randint(1, 10),
+        days=rng.choice([7, 15, 30, 60, 90]),
+        months=rng.choice([6, 11, 12, 24, 36]),
+        percent=rng.choice([1, 2, 5, 10]),
+        city=rng.choice(CITIES),
+    )
+
+
+def generate_agreement(seed=0, size=4000, risky_ratio=0.2, negated_ratio=0.05, pages=1, furniture=False):
+    """
+    Returns one synthetic agreement of roughly `size` characters.
+
+    risky_ratio / negated_ratio are the fraction of clauses drawn from the risky
+    and negated clause lists; the rest are fair clauses. Pages are separated by
+    a form feed, like PDF extraction in app.py. furniture=True adds what PDF
+    extraction usually brings along: a running header and a page-number footer
+    on every page.
+    """
+    rng = random.Random(seed)
+    title = rng.choice(TITLES)
+    lines = [title, ""]
+    if furniture:
+        # Own generator, so furniture=False documents stay exactly as before
+        header_rng = random.Random(f"{seed}-header")
+        header = (f"{title} - {header_rng.choice(CITIES)} - Ref. {header_rng.randint(1000, 9999)}/"
+                  f"{header_rng.randint(2015, 2025)} - Confidential")
+        lines.insert(0, header)
+    page = 1
+    length = sum(len(line) + 1 for line in lines)
+    page_size = max(1, size // max(1, pages))
+    page_length = 0
+    clause_number = 1
+
+    while length < size:
+        roll = rng.random()
+        if roll < risky_ratio:
+            template = rng.choice(RISKY_CLAUSES)
+        elif roll < risky_ratio + negated_ratio:
+            template = rng.choice(NEGATED_CLAUSES)
+        else:
+            template = rng.choice(FAIR_CLAUSES)
+
+        line = f"{clause_number}. {_fill(template, rng)}"
+        if pages > 1 and page_length + len(line) > page_size:
+            if furniture:
+                lines.extend(["", f"Page {page}"])
+                line = f"\f{header}\n\n{line}"
+            else:
+                line = "\f" + line
+            page += 1
+            page_length = 0
+        lines.append(line)
+        clause_number += 1
+        length += len(line) + 1
+        page_length += len(line) + 1
+
+    return "\n".join(lines)
+
+
+def generate_corpus(count, seed=0, size=4000, risky_ratio=0.2, negated_ratio=0.05):
+    """Yields `count` agreements; document i always uses seed + i."""
+    for index in range(count):
+        yield generate_agreement(seed + index, size, risky_ratio, negated_ratio)
+
+
+def generate_model_response(seed=0, red_flags=6, fair_clauses=4, style="fenced"):
+    """
+    Returns a Gemini-style analysis reply as text.
+
+    style: "clean"     - plain JSON
+           "fenced"    - JSON inside a ```json markdown block (the usual reply)
+           "multiline" - fenced, with summary/issue strings broken across lines,
+                         which forces clean_json_response into repair_multiline_json
+    """
+    rng = random.Random(seed)
+    result = {
+        "overallScore": rng.randint(10, 95),
+        "colorLabel": rng.choice(["DARK_RED", "RED", "ORANGE", "YELLOW", "GREEN"]),
+        "summary": " ".join(_fill(rng.choice(FAIR_CLAUSES), rng) for _ in range(3)),
+        "redFlags": [
+            {"title": f"Risky clause {i + 1}", "issue": " ".join(_fill(rng.choice(RISKY_CLAUSES), rng) for _ in range(2))}
+            for i in range(red_flags)
+        ],
+        "fairClauses": [
+            {"title": f"Fair clause {i + 1}", "explanation": _fill(rng.choice(FAIR_CLAUSES), rng)}
+            for i in range(fair_clauses)
+        ],
+        "recommendations": [_fill(rng.choice(FAIR_CLAUSES), rng) for _ in range(3)],
+    }
+    text = json.dumps(result, indent=2)
+
+    if style == "multiline":
+        lines = []
+        for line in text.split("\n"):
+            # Break long "key": "value" strings between sentences, like the model sometimes does
+            breaks = [i for i in range(len(line) - 2) if line[i:i + 2] == ". " and line[i + 2].isupper()]
+            if '": "' in line and line.rstrip().endswith('",') and breaks:
+                lines.extend([line[:breaks[0] + 1], "  " + line[breaks[0] + 2:]])
+            else:
+                lines.append(line)
+        text = "\n".join(lines)
+    if style in ("fenced", "multiline"):
+        text = f"```json\n{text}\n```"
+    return text
+
+
+def render_docx(text):
+    """The text as .docx bytes, one paragraph per line."""
+    import docx
+    document = docx.Document()
+    for line in text.replace("\f", "\n").split("\n"):
+        document.add_paragraph(line)
+    buffer = io.BytesIO()
+    document.save(buffer)
+    return buffer.getvalue()
+
+
+def render_pdf(text, lines_per_page=60):
+    """
+    The text as a minimal text-layer PDF. Form feeds start a new page, and so
+    does every `lines_per_page` lines. Written by hand so the benchmarks need no
+    PDF-writing library.
+    """
+    pages = []
+    for page_text in text.split("\f"):
+        lines = page_text.split("\n")
+        for start in range(0, max(1, len(lines)), lines_per_page):
+            pages.append(lines[start:start + lines_per_page])
+
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for lines in pages:
+        escaped = [line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") for line in lines]
+        stream = "BT /F1 9 Tf 11 TL 36 806 Td " + " ".join(f"({line}) Tj T*" for line in escaped) + " ET"
+        stream = stream.encode("latin-1", "replace")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                       b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % (len(objects)))
+        kids.append(b"%d 0 R" % len(objects))
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(kids), len(kids))
+
+    output = io.BytesIO()
+    output.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(output.tell())
+        output.write(b"%d 0 obj\n%s\nendobj\n" % (number, body))
+    xref = output.tell()
+    output.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    for offset in offsets:
+        output.write(b"%010d 00000 n \n" % offset)
+    output.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+    return output.getvalue()
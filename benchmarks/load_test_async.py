@@ -0,0 +1,151 @@
+"""
+Load test: how many analyses one worker process keeps in flight, sync vs async.
+
+Starts one worker of each server in a child process, with Gemini replaced by
+the stub backend of llm_backends.py (a --distribution of latencies around
+--latency seconds, optional --error-rate and --truncation-rate; no network or
+API key), then fires --requests analyses with --concurrency parallel clients:
+
+  * sync:  gunicorn, 1 gthread worker with --threads threads, app:app (Flask)
+  * async: uvicorn, 1 worker, asgi:app (async /api/analyze)
+
+Effective concurrency = requests x latency / wall time, i.e. how many Gemini
+waits the worker overlapped on average.
+
+Run from the project root (needs gunicorn, uvicorn, starlette, a2wsgi):
+    python benchmarks/load_test_async.py
+    python benchmarks/load_test_async.py --requests 500 --concurrency 300 --latency 2
+    python benchmarks/load_test_async.py --distribution lognormal --error-rate 0.05
+"""
+
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import statistics
+import sys
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from corpus import generate_agreement
+
+LOGNORMAL_SIGMA = 0.35
+
+
+def _stub_gemini(latency_spec, error_rate, truncation_rate):
+    import analysis_cache
+    import llm_backends
+
+    analysis_cache.CACHE_ENABLED = False
+    llm_backends.set_backend(llm_backends.StubBackend(latency=latency_spec, error_rate=error_rate,
+                                                      truncation_rate=truncation_rate))
+
+
+def _serve_sync(port, threads, stub):
+    from gunicorn.app.base import BaseApplication
+    import app as flask_app
+    _stub_gemini(*stub)
+
+    class Server(BaseApplication):
+        def load_config(self):
+            for key, value in {"bind": f"127.0.0.1:{port}", "workers": 1, "worker_class": "gthread",
+                               "threads": threads, "timeout": 600, "loglevel": "warning"}.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return flask_app.app
+
+    Server().run()
+
+
+def _serve_async(port, stub):
+    import uvicorn
+    import asgi
+    _stub_gemini(*stub)
+    uvicorn.run(asgi.app, host="127.0.0.1", port=port, log_level="warning", backlog=4096)
+
+
+def _wait_until_up(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/api/metrics", timeout=1).read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise SystemExit(f"Server on port {port} did not start")
+
+
+def _post(port, body):
+    start = time.perf_counter()
+    request = urllib.request.Request(f"http://127.0.0.1:{port}/api/analyze", data=body, method="POST",
+                                     headers={"Content-Type": "application/x-www-form-urlencoded"})
+    with urllib.request.urlopen(request, timeout=600) as response:
+        ok = response.status == 200 and "ratingScore" in json.loads(response.read())
+    return ok, time.perf_counter() - start
+
+
+def run_load(port, requests, concurrency, body):
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        start = time.perf_counter()
+        outcomes = list(pool.map(lambda _: _post(port, body), range(requests)))
+        wall = time.perf_counter() - start
+    return wall, [latency for ok, latency in outcomes if ok], sum(1 for ok, _ in outcomes if not ok)
+
+
+def latency_spec(distribution, mean):
+    """A llm_backends latency spec with the given mean (a lognormal's median sits below its mean)."""
+    if distribution == "lognormal":
+        return f"lognormal:{mean * math.exp(-LOGNORMAL_SIGMA ** 2 / 2):.4f},{LOGNORMAL_SIGMA}"
+    return f"{distribution}:{mean}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=1.0, help="mean simulated Gemini seconds per call")
+    parser.add_argument('--distribution', choices=("fixed", "lognormal", "exponential"), default="fixed",
+                        help="distribution of the simulated latency (same mean)")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="share of calls failing with 503")
+    parser.add_argument('--truncation-rate', type=float, default=0.0, help="share of replies cut off mid-JSON")
+    parser.add_argument('--threads', type=int, default=4, help="gthread threads of the sync worker")
+    parser.add_argument('--port', type=int, default=5601)
+    args = parser.parse_args()
+    stub = (latency_spec(args.distribution, args.latency), args.error_rate, args.truncation_rate)
+
+    body = urllib.parse.urlencode({"text": generate_agreement(seed=0, size=4000)}).encode()
+    context = multiprocessing.get_context("fork")
+    servers = (
+        (f"sync (gunicorn gthread x{args.threads})", context.Process(
+            target=_serve_sync, args=(args.port, args.threads, stub), daemon=True), args.port),
+        ("async (uvicorn asgi:app)", context.Process(
+            target=_serve_async, args=(args.port + 1, stub), daemon=True), args.port + 1),
+    )
+
+    print(f"{args.requests} requests, {args.concurrency} concurrent clients, "
+          f"{args.latency}s mean simulated Gemini latency ({stub[0]})")
+    print(f"{'server (1 worker)':<30} {'wall s':>8} {'req/s':>8} {'p50 s':>8} {'p99 s':>8} {'in flight':>10} {'failed':>7}")
+    for name, process, port in servers:
+        process.start()
+        try:
+            _wait_until_up(port)
+            wall, latencies, failed = run_load(port, args.requests, args.concurrency, body)
+        finally:
+            process.terminate()
+            process.join()
+        latencies.sort()
+        p99 = latencies[min(len(latencies) - 1, int(0.99 * len(latencies)))] if latencies else float('nan')
+        in_flight = len(latencies) * args.latency / wall
+        print(f"{name:<30} {wall:>8.1f} {len(latencies) / wall:>8.1f} "
+              f"{statistics.median(latencies) if latencies else float('nan'):>8.2f} {p99:>8.2f} {in_flight:>10.1f} {failed:>7}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+"""Benchmarks for text extraction from uploaded PDF, DOCX and plain-text files."""
+
+import io
+
+import pytest
+from werkzeug.datastructures import FileStorage
+
+import app as app_module
+from corpus import generate_agreement, render_docx, render_pdf
+
+# (characters, pages) of the extraction benchmark documents
+EXTRACTION_SIZES = {"4-pages": (16_000, 4), "40-pages": (160_000, 40)}
+
+
+def extract(data, filename):
+    upload = FileStorage(stream=io.BytesIO(data), filename=filename)
+    return ''.join(app_module.iter_uploaded_text(upload))
+
+
+@pytest.fixture(scope="module", params=list(EXTRACTION_SIZES))
+def document(request):
+    size, pages = EXTRACTION_SIZES[request.param]
+    return generate_agreement(seed=6, size=size, pages=pages)
+
+
+def test_extract_pdf(benchmark, document):
+    data = render_pdf(document)
+    text = benchmark(extract, data, "agreement.pdf")
+    assert "AGREEMENT" in text or "POLICY" in text or "SERVICE" in text
+
+
+def test_extract_docx(benchmark, document):
+    data = render_docx(document)
+    text = benchmark(extract, data, "agreement.docx")
+    assert len(text) >= len(document) * 0.9
+
+
+def test_extract_txt(benchmark, document):
+    data = document.encode('utf-8')
+    text = benchmark(extract, data, "agreement.txt")
+    assert text == document
@@ -0,0 +1,42 @@
+"""Benchmarks for parsing and normalising Gemini replies."""
+
+import copy
+import json
+
+import pytest
+
+import ai
+from corpus import generate_model_response
+
+
+@pytest.mark.parametrize("style", ["clean", "fenced", "multiline"])
+@pytest.mark.parametrize("red_flags", [5, 40], ids=["5-flags", "40-flags"])
+def test_clean_json_response(benchmark, style, red_flags):
+    raw = generate_model_response(seed=3, red_flags=red_flags, style=style)
+    result = benchmark(ai.clean_json_response, raw)
+    assert result['redFlagsCount'] == red_flags
+
+
+@pytest.mark.parametrize("red_flags", [5, 40], ids=["5-flags", "40-flags"])
+def test_repair_multiline_json(benchmark, red_flags):
+    raw = generate_model_response(seed=4, red_flags=red_flags, style="multiline")
+    json_text = raw[raw.find('{'):raw.rfind('}') + 1]
+    repaired = benchmark(ai.repair_multiline_json, json_text)
+    assert len(json.loads(repaired)['redFlags']) == red_flags
+
+
+def test_ensure_complete_response(benchmark):
+    result = json.loads(generate_model_response(seed=5, red_flags=10, style="clean"))
+    # ensure_complete_response fills the dict in place, so give each round a fresh copy
+    completed = benchmark.pedantic(ai.ensure_complete_response, setup=lambda: ((copy.deepcopy(result),), {}),
+                                   rounds=2000)
+    assert completed['redFlagsCount'] == 10
+
+
+@pytest.mark.parametrize("style", ["clean", "multiline"], ids=["json-mode", "free-text"])
+def test_parse_gemini_text(benchmark, monkeypatch, style):
+    # JSON mode parses directly; a free-text reply pays for the failed parse plus the repair
+    monkeypatch.setattr(ai.prompt_builder, "JSON_MODE", True)
+    raw = generate_model_response(seed=6, red_flags=10, style=style)
+    result = benchmark(ai._parse_gemini_text, raw)
+    assert result['redFlagsCount'] == 10
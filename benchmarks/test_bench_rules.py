@@ -0,0 +1,42 @@
+"""Benchmarks for the rule-based pre-analysis."""
+
+import pytest
+
+import ai
+import rule_packs
+from corpus import generate_agreement
+
+
+@pytest.fixture(autouse=True)
+def warm_rule_packs():
+    # Compile and cache the rule packs outside the timed calls
+    rule_packs.registry.get("", None)
+    rule_packs.registry.get("Maharashtra", "lease")
+
+
+def test_analyze_text_with_rules(benchmark, agreement):
+    result = benchmark(ai.analyze_text_with_rules, agreement)
+    assert result['found_issues']
+
+
+def test_analyze_text_with_rules_state_and_type(benchmark, agreement):
+    result = benchmark(ai.analyze_text_with_rules, agreement, "Maharashtra", "lease")
+    assert result['found_issues']
+
+
+@pytest.mark.parametrize("risky_ratio", [0.0, 0.5], ids=["fair", "half-risky"])
+def test_analyze_text_with_rules_clause_mix(benchmark, risky_ratio):
+    text = generate_agreement(seed=2, size=64_000, risky_ratio=risky_ratio)
+    benchmark(ai.analyze_text_with_rules, text)
+
+
+def test_analyze_text_chunks_with_rules(benchmark, agreement):
+    chunks = [agreement[i:i + 16_384] for i in range(0, len(agreement), 16_384)]
+    result = benchmark(ai.analyze_text_chunks_with_rules, chunks)
+    assert result['found_issues']
+
+
+def test_build_rule_based_result(benchmark, agreement):
+    findings = ai.analyze_text_with_rules(agreement)
+    result = benchmark(ai.build_rule_based_result, findings)
+    assert result['redFlags']
@@ -0,0 +1,43 @@
+"""
+Shared setup for the root test modules.
+"""
+
+import atexit
+import os
+import shutil
+import tempfile
+
+# Stores created when a module is imported (app.job_queue, the rule artifact
+# cache) must not open the node's real files under /tmp/lekha_<uid>, so the
+# data directory is a throwaway one, set before analysis_cache reads it
+_DATA_DIR = tempfile.mkdtemp(prefix="lekha_test_")
+atexit.register(shutil.rmtree, _DATA_DIR, True)
+os.environ["LEKHA_DATA_DIR"] = _DATA_DIR
+os.environ["ANALYSIS_CACHE_PATH"] = os.path.join(_DATA_DIR, "analysis_cache.sqlite3")
+os.environ["ANALYSIS_JOB_DB_PATH"] = os.path.join(_DATA_DIR, "jobs.sqlite3")
+os.environ["RULE_CACHE_DIR"] = os.path.join(_DATA_DIR, "rule_cache")
+
+import pytest  # noqa: E402
+
+import analysis_cache  # noqa: E402
+import explanations  # noqa: E402
+import rate_limiter  # noqa: E402
+import revisions  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def private_rate_limiter(monkeypatch, tmp_path):
+    # The real limiter's buckets are shared through a file in /tmp; tests must
+    # neither drain them nor wait on what other runs (or a local server) used
+    monkeypatch.setattr(rate_limiter, "limiter", rate_limiter.TokenBucketLimiter(path=str(tmp_path / "rate_limit")))
+
+
+@pytest.fixture(autouse=True)
+def private_stores(monkeypatch, tmp_path):
+    # Every /api/analyze keeps its document for explanations and caches its
+    # result; each test gets empty stores of its own
+    path = str(tmp_path / "analysis_cache.sqlite3")
+    monkeypatch.setattr(analysis_cache, "_cache", analysis_cache.AnalysisCache(
+        analysis_cache.MemoryCache(), analysis_cache.DiskCache(path)))
+    monkeypatch.setattr(explanations, "_store", explanations.ExplanationStore(path=path))
+    monkeypatch.setattr(revisions, "_store", revisions.RevisionStore(path))
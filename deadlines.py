@@ -0,0 +1,124 @@
+# deadlines.py - Time budget of one /api/analyze request, split between its stages
+#
+# The platform ends a request after a fixed time (30 s on Vercel). A Deadline
+# is created when the request arrives and handed to every stage: extraction
+# (and OCR), the rule scan, Gemini and the history insert. A stage may use its
+# own budget, but never the time reserved for the stages after it, so a slow
+# OCR pass leaves Gemini less time instead of getting the whole request
+# killed, and Gemini gives up in time for the result to be saved and sent.
+# Stages that had to cut their work short say so with degrade(); the result
+# is then marked "degraded" with the reasons.
+
+import math
+import os
+import time
+from contextlib import contextmanager
+
+from metrics import metrics
+
+# Seconds from arrival to response, a few under the platform limit (0 disables the deadline)
+REQUEST_DEADLINE = float(os.getenv("ANALYSIS_DEADLINE_SECONDS", "25"))
+
+STAGES = ("extract", "rules", "gemini", "save")
+
+# Most time each stage may take (None: whatever the later stages leave)
+STAGE_BUDGETS = {
+    "extract": float(os.getenv("DEADLINE_EXTRACT_SECONDS", "10")),
+    "rules": None,
+    "gemini": None,
+    "save": float(os.getenv("DEADLINE_SAVE_SECONDS", "2")),
+}
+
+# Gemini is not called with less than this left (the answer is then rule-only),
+# and a retry or the next model of the route needs at least MIN_CALL_SECONDS
+MIN_GEMINI_SECONDS = float(os.getenv("DEADLINE_MIN_GEMINI_SECONDS", "4"))
+MIN_CALL_SECONDS = 1.0
+# A scanned page is only OCR'd with at least this (or the last page's time) left for extraction
+MIN_OCR_PAGE_SECONDS = 1.0
+# The history insert is skipped with less than this left
+MIN_SAVE_SECONDS = 0.5
+
+
+def _reserve(stage):
+    """Time held back for `stage` while the stages before it run."""
+    return {"gemini": MIN_GEMINI_SECONDS, "save": STAGE_BUDGETS["save"]}.get(stage, 0.0)
+
+
+class BudgetExceeded(Exception):
+    """Raised instead of starting work that cannot finish before the request deadline."""
+
+
+class Deadline:
+    """
+    The time left of one request. budget(stage) is how long `stage` may run
+    from now; with seconds=None there is no deadline and every budget is
+    unlimited (background jobs).
+    """
+
+    def __init__(self, seconds=REQUEST_DEADLINE):
+        self.seconds = seconds
+        self.expires_at = None if seconds is None else time.monotonic() + seconds
+        self.timings = {}
+        self.degraded_reasons = []
+
+    @property
+    def limited(self):
+        return self.expires_at is not None
+
+    def remaining(self):
+        if self.expires_at is None:
+            return math.inf
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def budget(self, stage):
+        """Seconds `stage` may use now: its own budget, less what the later stages need."""
+        if not self.limited:
+            return math.inf
+        later = STAGES[STAGES.index(stage) + 1:]
+        left = self.remaining() - sum(_reserve(name) for name in later)
+        limit = STAGE_BUDGETS[stage]
+        return max(0.0, left if limit is None else min(limit, left))
+
+    def check(self, stage, minimum=None):
+        """budget(stage), or BudgetExceeded when that is under `minimum` seconds (MIN_CALL_SECONDS)."""
+        minimum = MIN_CALL_SECONDS if minimum is None else minimum
+        budget = self.budget(stage)
+        if budget < minimum:
+            metrics.increment(f"deadline.{stage}.exhausted")
+            raise BudgetExceeded(f"{budget:.1f}s left for {stage} before the request deadline")
+        return budget
+
+    @contextmanager
+    def stage(self, name):
+        """Times a stage, for the log line and the deadline.<stage>.seconds counters."""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - start
+            self.timings[name] = self.timings.get(name, 0.0) + elapsed
+            metrics.increment(f"deadline.{name}.seconds", elapsed)
+
+    def degrade(self, reason):
+        """Notes that a stage cut its work short to stay within the deadline."""
+        print(f"--- Deadline: {reason} ---")
+        metrics.increment("deadline.degraded")
+        self.degraded_reasons.append(reason)
+
+    def annotate(self, result):
+        """Marks a result degraded, with the reasons, when any stage cut its work short."""
+        if self.degraded_reasons:
+            result['degraded'] = True
+            result['degradedReasons'] = list(self.degraded_reasons)
+        return result
+
+    def log(self):
+        if self.timings:
+            stages = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self.timings.items())
+            left = f", {self.remaining():.1f}s left" if self.limited else ""
+            print(f"--- Stage timings: {stages}{left} ---")
+
+
+def start():
+    """The Deadline of a request arriving now (unlimited when ANALYSIS_DEADLINE_SECONDS is 0)."""
+    return Deadline(REQUEST_DEADLINE if REQUEST_DEADLINE > 0 else None)
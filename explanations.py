@@ -0,0 +1,124 @@
+# explanations.py - Keeps analyzed documents for on-demand explanations (/api/analysis/<id>/explain)
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import analysis_cache
+import prompt_builder
+
+# Documents (kept for every analysis, signed in or not) and explanations older than this (seconds) are deleted
+EXPLANATION_TTL = float(os.getenv("EXPLANATION_TTL", str(24 * 3600)))
+
+# What an explanation needs from a final result; the rest (rule findings...) is not kept
+ANALYSIS_FIELDS = ("ratingScore", "ratingText", "summary", "redFlags")
+
+
+def analysis_id(text, state, analysis):
+    """
+    Content address of a document with its result: re-uploads that got the
+    same result share an id (and its explanations), and a flag index always
+    refers to the result it was shown in.
+    """
+    return analysis_cache.cache_key(text, state, settings=analysis)[:32]
+
+
+def target_key(flag_index=None):
+    """Cache key of the explanation of the whole analysis, or of one red flag."""
+    target = "document" if flag_index is None else f"redFlag:{flag_index}"
+    return f"{target}:v{prompt_builder.EXPLANATION_VERSION}"
+
+
+class ExplanationStore:
+    """
+    Analyzed documents (text, state and the compact result) and the
+    explanations generated for them, in the analysis cache's SQLite file.
+    """
+
+    def __init__(self, path=analysis_cache.CACHE_DB_PATH, ttl=EXPLANATION_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        self._writes = 0
+        self.available = True
+        try:
+            db = self._connect()
+            db.execute("CREATE TABLE IF NOT EXISTS analysis_documents ("
+                       "analysis_id TEXT PRIMARY KEY, document TEXT NOT NULL, state TEXT NOT NULL, "
+                       "analysis TEXT NOT NULL, stored_at REAL NOT NULL)")
+            db.execute("CREATE TABLE IF NOT EXISTS analysis_explanations ("
+                       "analysis_id TEXT NOT NULL, target TEXT NOT NULL, explanation TEXT NOT NULL, "
+                       "stored_at REAL NOT NULL, PRIMARY KEY (analysis_id, target))")
+        except (sqlite3.Error, OSError) as e:
+            print(f"--- WARNING: On-demand explanations disabled at {path}: {e} ---")
+            self.available = False
+
+    def _connect(self):
+        return analysis_cache.connect(self._local, self.path)
+
+    def save_analysis(self, text, state, final_result):
+        """Stores the document with its result; returns its analysis id, or None when it was not stored."""
+        if not self.available:
+            return None
+        analysis = {field: final_result.get(field) for field in ANALYSIS_FIELDS}
+        key = analysis_id(text, state, analysis)
+        try:
+            # Refreshing stored_at keeps a document that is still being re-analyzed
+            self._connect().execute("INSERT OR REPLACE INTO analysis_documents VALUES (?, ?, ?, ?, ?)",
+                                    (key, text, state or "", json.dumps(analysis), time.time()))
+            self._wrote()
+        except sqlite3.Error as e:
+            print(f"--- WARNING: Could not store the analysis for explanations: {e} ---")
+            return None
+        return key
+
+    def get_analysis(self, key):
+        """(document text, state, compact result) of a stored analysis, or None."""
+        if not self.available:
+            return None
+        row = self._connect().execute(
+            "SELECT document, state, analysis FROM analysis_documents WHERE analysis_id = ? AND stored_at >= ?",
+            (key, time.time() - self.ttl)).fetchone()
+        if row is None:
+            return None
+        return row[0], row[1], json.loads(row[2])
+
+    def get_explanation(self, key, target):
+        if not self.available:
+            return None
+        row = self._connect().execute(
+            "SELECT explanation FROM analysis_explanations WHERE analysis_id = ? AND target = ? AND stored_at >= ?",
+            (key, target, time.time() - self.ttl)).fetchone()
+        return row[0] if row else None
+
+    def put_explanation(self, key, target, explanation):
+        if not self.available:
+            return
+        try:
+            self._connect().execute("INSERT OR REPLACE INTO analysis_explanations VALUES (?, ?, ?, ?)",
+                                    (key, target, explanation, time.time()))
+            self._wrote()
+        except sqlite3.Error as e:
+            print(f"--- WARNING: Could not store the explanation: {e} ---")
+
+    def _wrote(self):
+        self._writes += 1
+        if self._writes % 100 == 0:
+            self.prune()
+
+    def prune(self):
+        """Drops documents and explanations older than the TTL."""
+        db = self._connect()
+        cutoff = time.time() - self.ttl
+        db.execute("DELETE FROM analysis_documents WHERE stored_at < ?", (cutoff,))
+        db.execute("DELETE FROM analysis_explanations WHERE stored_at < ?", (cutoff,))
+
+
+_store = None
+
+
+def get_store():
+    """The process-wide explanation store, created on first use."""
+    return analysis_cache.process_singleton(globals(), "_store", ExplanationStore)
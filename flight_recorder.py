@@ -0,0 +1,169 @@
+# flight_recorder.py - One record per model call, kept in a ring buffer for /api/admin/gemini-calls
+#
+# Each analysis, chunk, section or explanation call gets a CallRecord: prompt
+# size (characters and estimated tokens), the tokens the provider counted
+# (usage_metadata), finish reason, time to first token, total latency, the
+# attempts it took (retries and fallback models) and how its reply parsed.
+# The most recent FLIGHT_RECORDER_SIZE records are kept per worker process,
+# and every record also feeds the histograms of /api/metrics (metrics.py).
+# Records hold no document or reply text.
+
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from metrics import TOKEN_BUCKETS, metrics
+
+# Records kept per worker process (0 disables the recorder; the histograms still fill)
+FLIGHT_RECORDER_SIZE = int(os.getenv("FLIGHT_RECORDER_SIZE", "500"))
+
+
+def _finish_reason(response):
+    """The first candidate's finish reason by name (STOP, MAX_TOKENS, SAFETY, ...), or None."""
+    try:
+        reason = response.candidates[0].finish_reason
+    except (AttributeError, IndexError, TypeError, ValueError):
+        return None
+    if reason is None:
+        return None
+    return str(getattr(reason, "name", reason))
+
+
+class CallRecord:
+    """Telemetry of one model call; the model route fills in the attempts, ai.py the rest."""
+
+    def __init__(self, kind, route, prompt):
+        self.kind = kind
+        self.tier = route.tier
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self.part = f"{prompt.part}/{prompt.parts}"
+        self.prompt_chars = len(prompt.system_instruction or "") + len(prompt.contents)
+        self.estimated_tokens = prompt.input_tokens
+        self.models = []
+        self.attempts = 0
+        self.prompt_tokens = None
+        self.output_tokens = None
+        self.finish_reason = None
+        self.time_to_first_token = None
+        self.latency = None
+        self.parse = None
+        self.error = None
+
+    def elapsed(self):
+        return time.perf_counter() - self._start
+
+    def attempt(self, model_name):
+        """Notes one generate_content call (first try, retry, hedge or fallback model)."""
+        self.attempts += 1
+        if model_name not in self.models:
+            self.models.append(model_name)
+
+    def first_token(self):
+        """Notes the arrival of the first reply text (of a streamed reply)."""
+        if self.time_to_first_token is None:
+            self.time_to_first_token = self.elapsed()
+
+    def received(self, response):
+        """Notes the complete reply: latency, usage_metadata and finish reason."""
+        self.latency = self.elapsed()
+        # Without streaming, the first token arrives with the whole reply
+        self.first_token()
+        usage = getattr(response, "usage_metadata", None)
+        self.prompt_tokens = getattr(usage, "prompt_token_count", None)
+        self.output_tokens = getattr(usage, "candidates_token_count", None)
+        self.finish_reason = _finish_reason(response)
+
+    def failed(self, error):
+        """Notes the error that ended the call (after its retries and fallbacks)."""
+        self.error = type(error).__name__
+        if self.latency is None:
+            self.latency = self.elapsed()
+
+    def as_dict(self):
+        return {
+            "kind": self.kind,
+            "tier": self.tier,
+            "part": self.part,
+            "model": self.models[-1] if self.models else None,
+            "startedAt": round(self.started_at, 3),
+            "promptChars": self.prompt_chars,
+            "estimatedTokens": self.estimated_tokens,
+            "promptTokens": self.prompt_tokens,
+            "outputTokens": self.output_tokens,
+            "finishReason": self.finish_reason,
+            "timeToFirstToken": None if self.time_to_first_token is None else round(self.time_to_first_token, 3),
+            "latency": None if self.latency is None else round(self.latency, 3),
+            "retries": max(0, self.attempts - len(self.models)),
+            "fallbacks": max(0, len(self.models) - 1),
+            "parse": self.parse,
+            "error": self.error,
+        }
+
+
+class FlightRecorder:
+    """The most recent call records of this process, newest last."""
+
+    def __init__(self, size=FLIGHT_RECORDER_SIZE):
+        self._lock = threading.Lock()
+        self._records = deque(maxlen=max(size, 0))
+
+    def add(self, record):
+        with self._lock:
+            self._records.append(record)
+        _observe(record)
+
+    def recent(self, limit=None):
+        """Up to `limit` of the newest records as dicts, newest first."""
+        with self._lock:
+            records = list(self._records)
+        records.reverse()
+        return [record.as_dict() for record in records[:limit]]
+
+    def stats(self):
+        with self._lock:
+            return {"size": self._records.maxlen, "recorded": len(self._records)}
+
+    def reset(self):
+        with self._lock:
+            self._records.clear()
+
+
+def _observe(record):
+    """Feeds a record into the histograms and counters of /api/metrics."""
+    if record.latency is not None:
+        metrics.observe("gemini.latency_seconds", record.latency)
+    if record.time_to_first_token is not None:
+        metrics.observe("gemini.time_to_first_token_seconds", record.time_to_first_token)
+    metrics.observe("gemini.estimated_prompt_tokens", record.estimated_tokens, TOKEN_BUCKETS)
+    if record.prompt_tokens is not None:
+        metrics.observe("gemini.prompt_tokens", record.prompt_tokens, TOKEN_BUCKETS)
+    if record.output_tokens is not None:
+        metrics.observe("gemini.output_tokens", record.output_tokens, TOKEN_BUCKETS)
+    metrics.observe("gemini.attempts", record.attempts, (1, 2, 3, 4, 6, 8))
+    if record.finish_reason is not None:
+        metrics.increment(f"gemini.finish_reason.{record.finish_reason}")
+    if record.error is not None:
+        metrics.increment("gemini.failed_calls")
+
+
+@contextmanager
+def record(kind, route, prompt):
+    """
+    A CallRecord for one call on `route`, added to the recorder when the
+    block ends; an exception leaving the block is noted as the call's error.
+    """
+    call = CallRecord(kind, route, prompt)
+    try:
+        yield call
+    except Exception as e:
+        call.failed(e)
+        raise
+    finally:
+        recorder.add(call)
+
+
+# Process-wide recorder of Gemini calls
+recorder = FlightRecorder()
@@ -0,0 +1,125 @@
+# gemini_client.py - One shared Gemini client per process instead of per-request setup
+
+import json
+import os
+import threading
+import time
+
+import google.generativeai as genai
+from google.generativeai import client as genai_client
+from dotenv import load_dotenv
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ENV_FILE = os.path.join(BASE_DIR, '.env')
+
+# Model used when a caller does not ask for a specific one
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+
+# "grpc" (library default) or "rest"
+GEMINI_TRANSPORT = os.getenv("GEMINI_TRANSPORT") or None
+
+# How often (seconds) the .env file is checked for a changed key
+ENV_RELOAD_INTERVAL = float(os.getenv("GEMINI_ENV_RELOAD_INTERVAL", "5"))
+
+
+def _freeze(config):
+    """Hashable form of a generation_config dict (which may nest a response schema), for use as a cache key."""
+    return json.dumps(config or {}, sort_keys=True)
+
+
+class GeminiClientRegistry:
+    """
+    Configures the Gemini library once per process (again only when the API
+    key or transport changes) and keeps one GenerativeModel per model name,
+    generation config and system instruction. The models share the library's cached client, so its
+    HTTP/gRPC connection stays open between requests.
+
+    genai.configure replaces process-wide state, so it only ever runs under the
+    lock; the common path (nothing changed) takes no lock at all.
+    """
+
+    # The LLM backend interface (llm_backends.py)
+    name = "gemini"
+    needs_api_key = True
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (api_key, transport) and the models built for it, swapped as one tuple
+        self._state = (None, {})
+        self._env_stamp = None
+        self._env_checked_at = float('-inf')
+
+    def api_key(self):
+        """The current GEMINI_API_KEY, picking up edits to .env without a restart."""
+        self._reload_env()
+        return os.getenv("GEMINI_API_KEY", "").strip().strip('"\'')
+
+    def get_model(self, model_name=None, generation_config=None, system_instruction=None):
+        model_name = model_name or GEMINI_MODEL
+        config = (self.api_key(), GEMINI_TRANSPORT)
+        key = (model_name, _freeze(generation_config), system_instruction)
+
+        current_config, models = self._state
+        if current_config == config and key in models:
+            return models[key]
+
+        with self._lock:
+            current_config, models = self._state
+            if current_config != config:
+                genai.configure(api_key=config[0], transport=GEMINI_TRANSPORT)
+                # Build the shared client now, while no other thread can reconfigure
+                genai_client.get_default_generative_client()
+                models = {}
+                print(f"--- Gemini client configured (transport: {GEMINI_TRANSPORT or 'default'}) ---")
+            model = models.get(key)
+            if model is None:
+                model = genai.GenerativeModel(model_name, generation_config=generation_config,
+                                              system_instruction=system_instruction)
+                models = {**models, key: model}
+            self._state = (config, models)
+            return model
+
+    def warm_up(self, model_name=None, generation_config=None):
+        """
+        Worker boot hook: builds the client and makes one cheap call so the TLS
+        connection is open before the first real request. Never raises.
+        """
+        if not self.api_key():
+            print("--- Gemini warm-up skipped: GEMINI_API_KEY is not set ---")
+            return False
+        start = time.perf_counter()
+        try:
+            self.get_model(model_name, generation_config).count_tokens("warm-up")
+        except Exception as e:
+            print(f"--- WARNING: Gemini warm-up failed: {e} ---")
+            return False
+        print(f"--- Gemini client warmed up in {time.perf_counter() - start:.2f}s ---")
+        return True
+
+    def reset(self):
+        """Forgets the configured client; the next get_model configures again."""
+        with self._lock:
+            self._state = (None, {})
+            self._env_stamp = None
+            self._env_checked_at = float('-inf')
+
+    def _reload_env(self):
+        now = time.monotonic()
+        if now - self._env_checked_at < ENV_RELOAD_INTERVAL:
+            return
+        with self._lock:
+            if now - self._env_checked_at < ENV_RELOAD_INTERVAL:
+                return
+            self._env_checked_at = now
+            try:
+                stamp = os.stat(ENV_FILE).st_mtime_ns
+            except OSError:
+                stamp = None
+            if stamp != self._env_stamp:
+                self._env_stamp = stamp
+                if stamp is not None:
+                    load_dotenv(ENV_FILE, override=True)
+
+
+# Process-wide registry used by ai.analyze_with_gemini
+registry = GeminiClientRegistry()
@@ -0,0 +1,14 @@
+# gunicorn.conf.py - Picked up automatically by `gunicorn app:app`
+
+import os
+
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+
+
+def post_worker_init(worker):
+    # Each worker opens its own Gemini connection (gRPC channels must not be
+    # shared across fork), so warm it up here rather than in the master.
+    import llm_backends
+    llm_backends.get_backend().warm_up()
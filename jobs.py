@@ -0,0 +1,234 @@
+# jobs.py - SQLite-backed background queue for long analyses (/api/analyze?async=1, /api/jobs/<id>)
+#
+# The queue lives in one SQLite file, so every worker process on a node can
+# report on any job. Each process runs its own small pool of threads that
+# claim queued jobs. This needs a long-running server (gunicorn, uvicorn):
+# serverless functions stop their threads once the response has been sent.
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+import analysis_cache
+from metrics import metrics
+
+# Job database (uploads, pasted text and e-mails), created mode 0600; the default sits in the private data dir
+JOB_DB_PATH = os.getenv("ANALYSIS_JOB_DB_PATH", os.path.join(analysis_cache.DATA_DIR, 'jobs.sqlite3'))
+
+# Threads per worker process running analyses
+JOB_WORKERS = int(os.getenv("ANALYSIS_JOB_WORKERS", "2"))
+
+# Finished jobs (and their results) are deleted after this many seconds
+JOB_RETENTION = float(os.getenv("ANALYSIS_JOB_RETENTION", str(24 * 3600)))
+
+# Idle workers look for jobs submitted by other processes this often (seconds)
+JOB_POLL_INTERVAL = float(os.getenv("ANALYSIS_JOB_POLL_INTERVAL", "1"))
+
+QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED = "queued", "running", "succeeded", "failed", "cancelled"
+
+
+class JobCancelled(Exception):
+    """Raised from a job's progress callback once the job has been cancelled."""
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobQueue:
+    """
+    Jobs are rows in SQLite: queued -> running -> succeeded / failed /
+    cancelled. `handler(payload, upload, filename, progress)` does the work
+    and returns a result dict (one with an "error" key fails the job); it
+    calls progress(stage, percent) between steps, which raises JobCancelled
+    once the job has been cancelled.
+    """
+
+    def __init__(self, handler, path=JOB_DB_PATH, workers=JOB_WORKERS, retention=JOB_RETENTION,
+                 poll_interval=JOB_POLL_INTERVAL):
+        self.handler = handler
+        self.path = path
+        self.workers = workers
+        self.retention = retention
+        self.poll_interval = poll_interval
+        self._local = threading.local()
+        self._wakeup = threading.Event()
+        self._threads = []
+        self._threads_pid = None
+        self._start_lock = threading.Lock()
+        self.available = True
+        try:
+            db = self._connect()
+            db.execute("CREATE TABLE IF NOT EXISTS analysis_jobs ("
+                       "id TEXT PRIMARY KEY, status TEXT NOT NULL, stage TEXT, progress INTEGER NOT NULL DEFAULT 0, "
+                       "payload TEXT NOT NULL, upload BLOB, filename TEXT, result TEXT, "
+                       "cancel_requested INTEGER NOT NULL DEFAULT 0, worker_pid INTEGER, "
+                       "created_at REAL NOT NULL, started_at REAL, finished_at REAL)")
+            db.execute("CREATE INDEX IF NOT EXISTS analysis_jobs_status ON analysis_jobs (status, created_at)")
+        except (sqlite3.Error, OSError) as e:
+            print(f"--- WARNING: Background analysis jobs disabled at {path}: {e} ---")
+            self.available = False
+
+    def _connect(self):
+        return analysis_cache.connect(self._local, self.path)
+
+    # --- API used by the views ---
+
+    def submit(self, payload, upload=None, filename=None):
+        """Queues a job and returns its id."""
+        job_id = uuid.uuid4().hex
+        self._connect().execute(
+            "INSERT INTO analysis_jobs (id, status, stage, payload, upload, filename, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (job_id, QUEUED, QUEUED, json.dumps(payload), upload, filename, time.time()))
+        metrics.increment("jobs.submitted")
+        self.prune()
+        self.start()
+        self._wakeup.set()
+        return job_id
+
+    def get(self, job_id):
+        """Status, progress and (once finished) the result of a job, or None."""
+        row = self._connect().execute(
+            "SELECT status, stage, progress, result, created_at, started_at, finished_at "
+            "FROM analysis_jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        status, stage, progress, result, created_at, started_at, finished_at = row
+        job = {
+            "jobId": job_id,
+            "status": status,
+            "stage": stage,
+            "progress": progress,
+            "createdAt": created_at,
+            "startedAt": started_at,
+            "finishedAt": finished_at,
+        }
+        if result is not None:
+            result = json.loads(result)
+            if status == FAILED:
+                job["error"] = result.get("error")
+            job["result"] = result
+        return job
+
+    def cancel(self, job_id):
+        """
+        Cancels a job: a queued one at once, a running one at its next
+        progress report. Returns the job, or None when it does not exist.
+        """
+        db = self._connect()
+        cursor = db.execute("UPDATE analysis_jobs SET status = ?, stage = ?, finished_at = ?, upload = NULL "
+                            "WHERE id = ? AND status = ?", (CANCELLED, CANCELLED, time.time(), job_id, QUEUED))
+        if cursor.rowcount:
+            metrics.increment("jobs.cancelled")
+        else:
+            db.execute("UPDATE analysis_jobs SET cancel_requested = 1 WHERE id = ? AND status = ?",
+                       (job_id, RUNNING))
+        return self.get(job_id)
+
+    def prune(self):
+        """Deletes jobs that finished more than `retention` seconds ago."""
+        self._connect().execute("DELETE FROM analysis_jobs WHERE finished_at < ?", (time.time() - self.retention,))
+
+    def stats(self):
+        counts = dict.fromkeys((QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED), 0)
+        if self.available:
+            counts.update(self._connect().execute(
+                "SELECT status, COUNT(*) FROM analysis_jobs GROUP BY status").fetchall())
+        return {"workers": self.workers, "available": self.available, **counts}
+
+    # --- Workers ---
+
+    def start(self):
+        """Starts this process's worker threads (again after a fork) and requeues orphaned jobs."""
+        with self._start_lock:
+            if self._threads_pid == os.getpid():
+                return
+            self._threads_pid = os.getpid()
+            self._recover()
+            self._threads = [threading.Thread(target=self._work, name=f"analysis-job-{n}", daemon=True)
+                             for n in range(self.workers)]
+            for thread in self._threads:
+                thread.start()
+
+    def _recover(self):
+        """Jobs left running by a worker process that has since died go back to the queue."""
+        db = self._connect()
+        for job_id, pid in db.execute("SELECT id, worker_pid FROM analysis_jobs WHERE status = ?",
+                                      (RUNNING,)).fetchall():
+            if pid is None or not _pid_alive(pid):
+                db.execute("UPDATE analysis_jobs SET status = ?, stage = ?, progress = 0, worker_pid = NULL "
+                           "WHERE id = ? AND status = ?", (QUEUED, QUEUED, job_id, RUNNING))
+                metrics.increment("jobs.recovered")
+                print(f"--- Requeued analysis job {job_id} of stopped worker {pid} ---")
+
+    def _claim(self):
+        """Atomically moves the oldest queued job to running; returns its row or None."""
+        db = self._connect()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            row = db.execute("SELECT id, payload, upload, filename FROM analysis_jobs WHERE status = ? "
+                             "ORDER BY created_at LIMIT 1", (QUEUED,)).fetchone()
+            if row is not None:
+                db.execute("UPDATE analysis_jobs SET status = ?, stage = ?, worker_pid = ?, started_at = ? "
+                           "WHERE id = ?", (RUNNING, RUNNING, os.getpid(), time.time(), row[0]))
+            db.execute("COMMIT")
+        except sqlite3.Error:
+            db.execute("ROLLBACK")
+            raise
+        return row
+
+    def _work(self):
+        while True:
+            try:
+                row = self._claim()
+            except sqlite3.Error as e:
+                print(f"--- WARNING: Could not claim an analysis job: {e} ---")
+                row = None
+            if row is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+            try:
+                self.run(*row)
+            except sqlite3.Error as e:
+                # The job keeps its last stored state; the thread goes on to the next one
+                print(f"--- WARNING: Could not store the outcome of analysis job {row[0]}: {e} ---")
+                metrics.increment("jobs.store_failed")
+
+    def run(self, job_id, payload, upload, filename):
+        """Runs one claimed job through the handler and stores the outcome."""
+        db = self._connect()
+
+        def progress(stage, percent):
+            cancelled = db.execute("SELECT cancel_requested FROM analysis_jobs WHERE id = ?", (job_id,)).fetchone()
+            if cancelled is None or cancelled[0]:
+                raise JobCancelled(job_id)
+            db.execute("UPDATE analysis_jobs SET stage = ?, progress = ? WHERE id = ?", (stage, percent, job_id))
+
+        started = time.perf_counter()
+        try:
+            result = self.handler(json.loads(payload), upload, filename, progress)
+            status = FAILED if "error" in result else SUCCEEDED
+        except JobCancelled:
+            result, status = None, CANCELLED
+        except Exception as e:
+            print(f"Unexpected analysis job error: {e}")
+            result, status = {"error": "An unexpected error occurred during analysis"}, FAILED
+
+        # A failed or cancelled job keeps the progress it had reached
+        db.execute("UPDATE analysis_jobs SET status = ?, stage = ?, progress = CASE WHEN ? THEN 100 ELSE progress END, "
+                   "result = ?, finished_at = ?, upload = NULL WHERE id = ?",
+                   (status, status, status == SUCCEEDED, None if result is None else json.dumps(result),
+                    time.time(), job_id))
+        metrics.increment(f"jobs.{status}")
+        metrics.increment("jobs.seconds", time.perf_counter() - started)
@@ -0,0 +1,117 @@
+# json_stream.py - Incremental parser for a JSON object arriving in pieces (streamed model output)
+
+import json
+
+
+class IncrementalJSONParser:
+    """
+    Feed it text as it arrives; it returns what became complete since the last
+    feed, without waiting for the whole document:
+
+        ("item", key, value)   an element of one of the `item_keys` arrays of
+                               the top-level object, e.g. one red flag
+        ("field", key, value)  a top-level scalar, e.g. overallScore
+
+    Anything before the first "{" (such as a ```json fence) is skipped. Strings
+    may contain raw newlines, which Gemini sometimes emits. Malformed elements
+    are skipped rather than raised; the final full-text parse still decides the
+    result.
+    """
+
+    def __init__(self, item_keys=()):
+        self.item_keys = set(item_keys)
+        self.buffer = ""
+        self.done = False
+        self._pos = 0
+        self._stack = []
+        self._in_string = False
+        self._escape = False
+        self._string_start = None
+        self._expect_key = False
+        self._key = None
+        self._value_start = None
+        self._item_start = None
+
+    def feed(self, text):
+        self.buffer += text
+        events = []
+        buffer = self.buffer
+        for i in range(self._pos, len(buffer)):
+            if self.done:
+                break
+            ch = buffer[i]
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if len(self._stack) == 1 and self._expect_key:
+                        self._key = _loads(buffer[self._string_start:i + 1])
+                continue
+
+            if not self._stack:
+                if ch == '{':
+                    self._stack.append(ch)
+                    self._expect_key = True
+                continue
+
+            depth = len(self._stack)
+            if ch in ' \t\r\n':
+                continue
+            if ch == '"':
+                self._in_string = True
+                self._string_start = i
+                self._start_value(i, depth)
+            elif ch in '{[':
+                self._start_value(i, depth)
+                self._stack.append(ch)
+            elif ch in '}]':
+                self._end_value(i, depth, events)
+                self._stack.pop()
+                if not self._stack:
+                    self.done = True
+            elif ch == ',':
+                self._end_value(i, depth, events)
+                if depth == 1:
+                    self._expect_key = True
+            elif ch == ':':
+                if depth == 1:
+                    self._expect_key = False
+            else:
+                self._start_value(i, depth)
+        self._pos = len(buffer)
+        return events
+
+    def _in_item_array(self, depth):
+        return depth == 2 and self._stack[-1] == '[' and self._key in self.item_keys
+
+    def _start_value(self, i, depth):
+        if depth == 1 and not self._expect_key and self._value_start is None:
+            self._value_start = i
+        elif self._in_item_array(depth) and self._item_start is None:
+            self._item_start = i
+
+    def _end_value(self, i, depth, events):
+        if depth == 1 and self._value_start is not None:
+            raw = self.buffer[self._value_start:i].strip()
+            # Arrays and objects were reported item by item (or not at all)
+            if raw[0] not in '[{':
+                value = _loads(raw)
+                if value is not None:
+                    events.append(("field", self._key, value))
+            self._value_start = None
+        elif self._in_item_array(depth) and self._item_start is not None:
+            value = _loads(self.buffer[self._item_start:i])
+            if value is not None:
+                events.append(("item", self._key, value))
+            self._item_start = None
+
+
+def _loads(raw):
+    try:
+        return json.loads(raw, strict=False)
+    except ValueError:
+        return None
@@ -0,0 +1,280 @@
+# llm_backends.py - The model provider behind ai.py: Gemini, or a local stub for offline load tests
+#
+# ai.py and model_router.py get their models from get_backend(). A backend has
+#   name, needs_api_key, api_key(), get_model(model_name, generation_config, system_instruction), warm_up()
+# and its models answer generate_content(contents, stream=False, request_options=None)
+# and generate_content_async(contents, request_options=None) like
+# google.generativeai.GenerativeModel. The Gemini backend is gemini_client.registry.
+#
+# LLM_BACKEND=stub swaps in StubBackend: schema-valid analyses built locally,
+# with a configurable latency distribution, error rates and truncated replies,
+# so worker counts, pools and caches can be benchmarked without quota or network.
+
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import threading
+import time
+
+from google.api_core import exceptions as google_exceptions
+
+import gemini_client
+import prompt_builder
+
+# "gemini" (default) or "stub"
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini").strip().lower()
+
+# Stub settings. Latency: "fixed:S", "uniform:MIN,MAX", "lognormal:MEDIAN,SIGMA" or "exponential:MEAN" (seconds)
+STUB_LATENCY = os.getenv("STUB_LATENCY", "lognormal:1.5,0.35")
+# Share of calls failing with 503 (overloaded, retried) and 429 (quota, falls back to the next model)
+STUB_ERROR_RATE = float(os.getenv("STUB_ERROR_RATE", "0"))
+STUB_QUOTA_ERROR_RATE = float(os.getenv("STUB_QUOTA_ERROR_RATE", "0"))
+# Share of replies cut off mid-JSON, as when a reply runs into max_output_tokens
+STUB_TRUNCATION_RATE = float(os.getenv("STUB_TRUNCATION_RATE", "0"))
+# Seed of the latency/error draws; the reply itself depends only on the prompt
+STUB_SEED = int(os.getenv("STUB_SEED", "0"))
+
+# Share of a streamed call's latency spent before the first chunk
+STUB_FIRST_CHUNK_SHARE = 0.3
+STUB_CHUNK_CHARS = 80
+
+_ISSUES = [
+    ("Non-refundable deposit", "The deposit is kept in full whatever the reason for leaving."),
+    ("Entry without notice", "The other party may enter the premises at any time without notice."),
+    ("Unlimited repair costs", "All repairs, including structural ones, are charged to you."),
+    ("Steep late fees", "Late payment attracts a daily penalty far above the actual cost of the delay."),
+    ("Automatic renewal", "The agreement renews itself unless cancelled well in advance."),
+    ("One-sided price changes", "Charges can be increased at any time at the other party's discretion."),
+    ("Broad indemnity", "You must cover all claims against the other party, even ones you did not cause."),
+    ("Data sharing", "Your personal data may be sold or shared with third parties."),
+]
+_FAIR = [
+    ("Written receipts", "Ask for a receipt for every payment."),
+    ("Mutual notice period", "Keep proof of delivery when you give notice."),
+    ("Deposit refund timeline", "Note the refund deadline and follow up in writing."),
+    ("Governing law", "Check that the named courts are convenient for you."),
+    ("Wear and tear excluded", "Photograph the premises when you move in."),
+]
+_RECOMMENDATIONS = [
+    "Negotiate a refundable deposit before signing.",
+    "Ask for at least 24 hours written notice before any entry.",
+    "Cap late fees at a reasonable monthly percentage.",
+    "Limit your repair obligations to damage you cause.",
+    "Get every change to the agreement in writing.",
+]
+
+
+def parse_latency(spec):
+    """A sampler rng -> seconds for a latency spec such as "lognormal:1.5,0.35"."""
+    kind, _, args = spec.strip().partition(":")
+    values = [float(value) for value in args.split(",") if value.strip()]
+    if kind == "fixed":
+        return lambda rng: values[0]
+    if kind == "uniform":
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == "lognormal":
+        return lambda rng: rng.lognormvariate(math.log(values[0]), values[1])
+    if kind == "exponential":
+        return lambda rng: rng.expovariate(1 / values[0])
+    raise ValueError(f"Unknown stub latency distribution: {spec}")
+
+
+def stub_analysis(contents, max_items=8):
+    """A schema-valid analysis (RESPONSE_SCHEMA) that depends only on `contents`."""
+    # ai imports this module, so the rating bands are looked up at call time
+    import ai
+
+    rng = random.Random(hashlib.sha256(contents.encode("utf-8", "replace")).digest())
+    score = rng.randint(15, 95)
+    color_label = ai.get_rating_band(score)[0]
+    red_flags = rng.sample(_ISSUES, rng.randint(2, min(max_items, len(_ISSUES))))
+    fair_clauses = rng.sample(_FAIR, rng.randint(1, len(_FAIR)))
+    return {
+        "overallScore": score,
+        "colorLabel": color_label,
+        "summary": f"Stub analysis of a {len(contents)}-character prompt: {len(red_flags)} clauses need attention.",
+        "redFlags": [{"title": title, "issue": issue} for title, issue in red_flags],
+        "fairClauses": [{"title": title, "recommendation": advice} for title, advice in fair_clauses],
+        "recommendations": rng.sample(_RECOMMENDATIONS, 3),
+    }
+
+
+class _Usage:
+    def __init__(self, prompt_token_count, candidates_token_count):
+        self.prompt_token_count = prompt_token_count
+        self.candidates_token_count = candidates_token_count
+        self.total_token_count = prompt_token_count + candidates_token_count
+
+
+class _Candidate:
+    def __init__(self, finish_reason):
+        self.finish_reason = finish_reason
+
+
+class StubResponse:
+    """The parts of a GenerateContentResponse that ai.py reads."""
+
+    def __init__(self, text, usage, finish_reason):
+        self.text = text
+        self.usage_metadata = usage
+        self.candidates = [_Candidate(finish_reason)]
+
+
+class StubStream:
+    """A streamed reply: iterating yields chunks with .text, spread over the remaining latency."""
+
+    def __init__(self, text, usage, finish_reason, seconds):
+        self._pieces = [text[i:i + STUB_CHUNK_CHARS] for i in range(0, len(text), STUB_CHUNK_CHARS)] or [""]
+        self._seconds = seconds
+        self.usage_metadata = usage
+        self.candidates = [_Candidate(finish_reason)]
+
+    def __iter__(self):
+        pause = self._seconds / len(self._pieces)
+        for number, piece in enumerate(self._pieces):
+            if number:
+                time.sleep(pause)
+            yield StubResponse(piece, None, None)
+
+
+class StubModel:
+    def __init__(self, backend, model_name, generation_config, system_instruction):
+        self.backend = backend
+        self.model_name = model_name
+        self.generation_config = generation_config or {}
+        self.system_instruction = system_instruction or ""
+
+    def generate_content(self, contents, stream=False, request_options=None):
+        latency, error = self.backend.draw()
+        timeout = (request_options or {}).get("timeout")
+        first_chunk = latency * STUB_FIRST_CHUNK_SHARE if stream else latency
+        if timeout is not None and first_chunk > timeout:
+            time.sleep(timeout)
+            raise google_exceptions.DeadlineExceeded("504 Deadline Exceeded (stub)")
+        time.sleep(first_chunk)
+        if error is not None:
+            raise error
+        text, usage, finish_reason = self._reply(contents)
+        if stream:
+            return StubStream(text, usage, finish_reason, latency - first_chunk)
+        return StubResponse(text, usage, finish_reason)
+
+    async def generate_content_async(self, contents, request_options=None):
+        latency, error = self.backend.draw()
+        timeout = (request_options or {}).get("timeout")
+        if timeout is not None and latency > timeout:
+            await asyncio.sleep(timeout)
+            raise google_exceptions.DeadlineExceeded("504 Deadline Exceeded (stub)")
+        await asyncio.sleep(latency)
+        if error is not None:
+            raise error
+        return StubResponse(*self._reply(contents))
+
+    def count_tokens(self, contents):
+        return type("CountTokensResponse", (), {"total_tokens": prompt_builder.estimate_tokens(str(contents))})()
+
+    def _reply(self, contents):
+        """(reply text, usage, finish reason) for a prompt: an analysis, or prose for an explanation."""
+        if self.system_instruction == prompt_builder.EXPLANATION_SYSTEM_INSTRUCTION:
+            analysis = stub_analysis(contents)
+            text = " ".join(f"{flag['title']}: {flag['issue']}" for flag in analysis["redFlags"])
+        else:
+            text = json.dumps(stub_analysis(contents), indent=2)
+            if self.generation_config.get("response_mime_type") != "application/json":
+                text = f"```json\n{text}\n```"
+
+        finish_reason = "STOP"
+        max_chars = self.generation_config.get("max_output_tokens", math.inf) * prompt_builder.CHARS_PER_TOKEN
+        if len(text) > max_chars or self.backend.truncate():
+            text = text[:int(min(max_chars, len(text) * self.backend.cut_point()))]
+            finish_reason = "MAX_TOKENS"
+        prompt_tokens = prompt_builder.estimate_tokens(self.system_instruction) + prompt_builder.estimate_tokens(contents)
+        return text, _Usage(prompt_tokens, prompt_builder.estimate_tokens(text)), finish_reason
+
+
+class StubBackend:
+    """
+    Answers like Gemini without calling it. Replies are deterministic per
+    prompt (so caches behave as with the real model); latency, errors and
+    truncation are drawn from a seeded generator.
+    """
+
+    name = "stub"
+    needs_api_key = False
+
+    def __init__(self, latency=STUB_LATENCY, error_rate=STUB_ERROR_RATE, quota_error_rate=STUB_QUOTA_ERROR_RATE,
+                 truncation_rate=STUB_TRUNCATION_RATE, seed=STUB_SEED):
+        self.latency = latency
+        self._sample_latency = parse_latency(latency)
+        self.error_rate = error_rate
+        self.quota_error_rate = quota_error_rate
+        self.truncation_rate = truncation_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def api_key(self):
+        return ""
+
+    def get_model(self, model_name=None, generation_config=None, system_instruction=None):
+        return StubModel(self, model_name or gemini_client.GEMINI_MODEL, generation_config, system_instruction)
+
+    def warm_up(self, model_name=None, generation_config=None):
+        print(f"--- LLM stub backend (latency {self.latency}, errors {self.error_rate:.0%}/"
+              f"{self.quota_error_rate:.0%}, truncation {self.truncation_rate:.0%}) ---")
+        return True
+
+    def draw(self):
+        """(latency in seconds, error to raise or None) for one call."""
+        with self._lock:
+            latency = max(0.0, self._sample_latency(self._rng))
+            roll = self._rng.random()
+        if roll < self.error_rate:
+            return latency, google_exceptions.ServiceUnavailable("503 The model is overloaded (stub)")
+        if roll < self.error_rate + self.quota_error_rate:
+            return latency, google_exceptions.ResourceExhausted("429 Resource exhausted (stub)")
+        return latency, None
+
+    def truncate(self):
+        with self._lock:
+            return self._rng.random() < self.truncation_rate
+
+    def cut_point(self):
+        """Share of a truncated reply that is kept."""
+        with self._lock:
+            return self._rng.uniform(0.3, 0.9)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """The process's backend: LLM_BACKEND, or the one given to set_backend()."""
+    global _backend
+    if _backend is not None:
+        return _backend
+    if LLM_BACKEND == "gemini":
+        # Looked up on every call, so a replaced registry (or its methods) takes effect at once
+        return gemini_client.registry
+    if LLM_BACKEND != "stub":
+        raise ValueError(f"Unknown LLM_BACKEND: {LLM_BACKEND} (use gemini or stub)")
+    with _backend_lock:
+        if _backend is None:
+            _backend = StubBackend()
+    return _backend
+
+
+def backend_name():
+    """Name of the current backend, part of every cache key so stub replies never answer for Gemini."""
+    backend = get_backend()
+    return getattr(backend, "name", type(backend).__name__)
+
+
+def set_backend(backend):
+    """Replaces the backend of this process (benchmarks); None goes back to LLM_BACKEND."""
+    global _backend
+    with _backend_lock:
+        _backend = backend
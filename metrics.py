@@ -0,0 +1,66 @@
+# metrics.py - In-process counters and histograms, exposed at /api/metrics
+
+import bisect
+import threading
+
+# Histogram bucket bounds (upper, inclusive) for seconds and token counts
+SECONDS_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30)
+TOKEN_BUCKETS = (128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+
+
+class Metrics:
+    """
+    Thread-safe named counters and histograms. Each worker process keeps its
+    own; scrape every worker (or sum them) for node-wide numbers.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def get(self, name):
+        return self._counters.get(name, 0)
+
+    def observe(self, name, value, buckets=SECONDS_BUCKETS):
+        """Adds `value` to histogram `name` (the bucket bounds are fixed by its first observation)."""
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = {"buckets": buckets, "counts": [0] * (len(buckets) + 1),
+                                                      "count": 0, "sum": 0}
+            histogram["counts"][bisect.bisect_left(histogram["buckets"], value)] += 1
+            histogram["count"] += 1
+            histogram["sum"] += value
+
+    def snapshot(self):
+        with self._lock:
+            return dict(sorted(self._counters.items()))
+
+    def histograms(self):
+        """Each histogram as its count, sum and cumulative count per bucket bound ("le")."""
+        with self._lock:
+            histograms = {name: (histogram["buckets"], list(histogram["counts"]), histogram["count"], histogram["sum"])
+                          for name, histogram in sorted(self._histograms.items())}
+        snapshot = {}
+        for name, (buckets, counts, count, total) in histograms.items():
+            cumulative = [sum(counts[:index + 1]) for index in range(len(counts))]
+            snapshot[name] = {
+                "count": count,
+                "sum": round(total, 3),
+                "le": dict(zip([str(bound) for bound in buckets] + ["+Inf"], cumulative)),
+            }
+        return snapshot
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+
+# Process-wide metrics
+metrics = Metrics()
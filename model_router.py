@@ -0,0 +1,295 @@
+# model_router.py - Picks the Gemini model and output budget per analysis, with a fallback chain
+#
+# Short, low-risk documents go to a cheaper "lite" model, risky high-stakes
+# documents to a "pro" model when one is configured, everything else to the
+# standard model (GEMINI_MODEL). When a model answers with a quota or
+# overload error (or its circuit is open), the next model of the chain is
+# tried instead of failing the analysis.
+
+import math
+import os
+import re
+import threading
+import time
+
+from google.api_core import exceptions as google_exceptions
+
+import deadlines
+import gemini_client
+import llm_backends
+import prompt_builder
+import rate_limiter
+import resilience
+import rule_packs
+from metrics import metrics
+
+# Set GEMINI_ROUTING=0 to send every analysis to GEMINI_MODEL (the fallback chain still applies)
+ROUTING_ENABLED = os.getenv("GEMINI_ROUTING", "1") != "0"
+
+LITE_MODEL = os.getenv("GEMINI_LITE_MODEL", "gemini-2.5-flash-lite")
+# No pro tier unless a model is named: it is several times slower and dearer
+PRO_MODEL = os.getenv("GEMINI_PRO_MODEL", "")
+
+# Reply budget per tier. 2.5 flash and pro spend part of it on thinking
+TIERS = {
+    "lite": {"model": LITE_MODEL, "max_output_tokens": 1024},
+    "standard": {"model": gemini_client.GEMINI_MODEL, "max_output_tokens": 2048},
+    "pro": {"model": PRO_MODEL, "max_output_tokens": 4096},
+}
+
+# lite: documents up to this many estimated tokens whose rule-based score is at least LITE_MIN_RULE_SCORE
+LITE_MAX_TOKENS = int(os.getenv("GEMINI_ROUTE_LITE_MAX_TOKENS", "1500"))
+LITE_MIN_RULE_SCORE = 71
+# pro: high-stakes documents whose rule-based score is at most this (DANGEROUS or CRITICAL)
+PRO_MAX_RULE_SCORE = 45
+HIGH_STAKES_TYPES = ("lease", "employment")
+
+# Single prompts longer than this get extra reply budget: more clauses, more findings
+LONG_DOCUMENT_TOKENS = 8000
+LONG_DOCUMENT_EXTRA_OUTPUT_TOKENS = 1024
+
+# Models tried, in order, after the routed one fails with a quota/overload error
+# (comma-separated; empty disables fallback). Default: the other tiers, largest first.
+FALLBACK_MODELS = [name.strip() for name in os.getenv("GEMINI_FALLBACK_MODELS",
+                                                      f"{gemini_client.GEMINI_MODEL},{LITE_MODEL}").split(",")
+                   if name.strip()]
+
+# USD per million (input, output) tokens, for the cost estimate in the routing log
+PRICES = {
+    "gemini-2.5-pro": (1.25, 10.00),
+    "gemini-2.5-flash": (0.30, 2.50),
+    "gemini-2.5-flash-lite": (0.10, 0.40),
+}
+
+# Errors after which the next model is tried: quota, overload, open circuit, unknown model
+FALLBACK_ERRORS = (
+    resilience.CircuitOpenError,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.TooManyRequests,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.NotFound,
+)
+FALLBACK_MESSAGES = ("429", "503", "quota", "overloaded", "resource exhausted", "unavailable")
+
+# Keywords that identify a document type in its first pages
+_DOCUMENT_TYPE_PATTERNS = {
+    "lease": re.compile(r"\b(?:lease|leave and licen[cs]e|landlord|tenant|licensor|licensee|rent agreement)\b", re.I),
+    "employment": re.compile(r"\b(?:employment|employer|employee|salary|probation)\b", re.I),
+    "privacy_policy": re.compile(r"\b(?:privacy policy|personal data|data protection|cookies)\b", re.I),
+    "terms": re.compile(r"\b(?:terms of (?:service|use)|terms and conditions|subscription)\b", re.I),
+}
+DETECTION_CHARS = 20_000
+
+
+def detect_document_type(text):
+    """The document type whose keywords appear most often near the start, or "general"."""
+    head = text[:DETECTION_CHARS]
+    counts = {name: len(pattern.findall(head)) for name, pattern in _DOCUMENT_TYPE_PATTERNS.items()}
+    best = max(counts, key=counts.get)
+    return best if counts[best] >= 2 else "general"
+
+
+def is_fallback_error(error):
+    # The local quota queue and the request deadline are the same for every model
+    if isinstance(error, (rate_limiter.RateLimitExceeded, deadlines.BudgetExceeded)):
+        return False
+    if isinstance(error, FALLBACK_ERRORS):
+        return True
+    message = str(error).lower()
+    return any(marker in message for marker in FALLBACK_MESSAGES)
+
+
+def estimate_cost(model_name, input_tokens, output_tokens):
+    """Estimated USD cost of one call, or None for a model without a known price."""
+    prices = PRICES.get(model_name)
+    if prices is None:
+        return None
+    return (input_tokens * prices[0] + output_tokens * prices[1]) / 1_000_000
+
+
+_callers = {}
+_callers_lock = threading.Lock()
+
+
+def caller_for(model_name):
+    """
+    The ResilientCaller of a model: each model has its own circuit, so an
+    overloaded model is skipped while the others still serve. The standard
+    model keeps resilience.gemini.
+    """
+    if model_name == gemini_client.GEMINI_MODEL:
+        return resilience.gemini
+    with _callers_lock:
+        caller = _callers.get(model_name)
+        if caller is None:
+            caller = _callers[model_name] = resilience.ResilientCaller(f"gemini.{model_name}")
+        return caller
+
+
+class Route:
+    """
+    The models to try, in order, for one analysis, with the generation config
+    they share and the request's deadline (deadlines.py), if any.
+    """
+
+    def __init__(self, tier, models, generation_config, reason, deadline=None):
+        self.tier = tier
+        self.models = models
+        self.generation_config = generation_config
+        self.reason = reason
+        self.deadline = deadline
+
+    @property
+    def model(self):
+        """The routed model, which the analysis cache keys results by."""
+        return self.models[0]
+
+    def time_left(self):
+        """Seconds Gemini may still use before the request deadline (unlimited without one)."""
+        return math.inf if self.deadline is None else self.deadline.budget("gemini")
+
+    def request_options(self):
+        """generate_content keyword arguments: a timeout that ends the call before the request deadline."""
+        if self.deadline is None or not self.deadline.limited:
+            return {}
+        return {"request_options": {"timeout": max(self.time_left(), deadlines.MIN_CALL_SECONDS)}}
+
+    def _retry_time_left(self):
+        return self.time_left() - deadlines.MIN_CALL_SECONDS
+
+    def _check_time(self, model_name, error=None):
+        """BudgetExceeded when too little time is left for another call."""
+        if self.time_left() < deadlines.MIN_CALL_SECONDS:
+            metrics.increment("deadline.gemini.exhausted")
+            raise deadlines.BudgetExceeded(f"no time left for {model_name} before the request deadline") from error
+
+    def call(self, prompt, fn, hedge=True, record=None):
+        """
+        fn(model) on each model of the route in turn, until one does not fail
+        with a quota/overload error. Returns (response, model name). Every
+        attempt is noted on `record` (a flight_recorder.CallRecord), if given.
+        """
+        for position, model_name in enumerate(self.models):
+            self._check_time(model_name)
+            model = llm_backends.get_backend().get_model(model_name, generation_config=self.generation_config,
+                                                         system_instruction=prompt.system_instruction)
+            start = time.perf_counter()
+            try:
+                response = caller_for(model_name).call(_noting_attempts(record, model_name, fn, model),
+                                                       hedge=hedge, time_left=self._retry_time_left)
+            except Exception as e:
+                # A call that ran into the request deadline is out of time, not a failed model
+                self._check_time(model_name, e)
+                if position + 1 == len(self.models) or not is_fallback_error(e):
+                    raise
+                self._fell_back(model_name, e)
+                continue
+            self._record(model_name, position, prompt, response, time.perf_counter() - start)
+            return response, model_name
+
+    async def call_async(self, prompt, make_call, record=None):
+        """call() for coroutines: make_call(model) must return a new awaitable on each call."""
+        for position, model_name in enumerate(self.models):
+            self._check_time(model_name)
+            model = llm_backends.get_backend().get_model(model_name, generation_config=self.generation_config,
+                                                         system_instruction=prompt.system_instruction)
+            start = time.perf_counter()
+            try:
+                attempt = _noting_attempts(record, model_name, make_call, model)
+                response = await caller_for(model_name).call_async(attempt, time_left=self._retry_time_left)
+            except Exception as e:
+                self._check_time(model_name, e)
+                if position + 1 == len(self.models) or not is_fallback_error(e):
+                    raise
+                self._fell_back(model_name, e)
+                continue
+            self._record(model_name, position, prompt, response, time.perf_counter() - start)
+            return response, model_name
+
+    def _fell_back(self, model_name, error):
+        print(f"--- {model_name} unavailable ({error}); falling back to the next model ---")
+        metrics.increment("routing.fallbacks")
+        metrics.increment(f"routing.fallbacks.{model_name}")
+
+    def _record(self, model_name, position, prompt, response, seconds):
+        """Logs the routing decision with the call's latency, tokens and estimated cost."""
+        metrics.increment(f"routing.{self.tier}")
+        metrics.increment(f"model.{model_name}.calls")
+        metrics.increment(f"model.{model_name}.seconds", seconds)
+        # A streamed response reports its usage only once it has been read
+        usage = getattr(response, "usage_metadata", None)
+        input_tokens = getattr(usage, "prompt_token_count", None) or prompt.input_tokens
+        output_tokens = getattr(usage, "candidates_token_count", None)
+        cost = estimate_cost(model_name, input_tokens, output_tokens or 0)
+        if cost is not None and output_tokens is not None:
+            metrics.increment(f"model.{model_name}.cost_usd", cost)
+        served = model_name if position == 0 else f"{model_name} (fallback {position})"
+        usage_note = f", {input_tokens} in / {output_tokens} out tokens" if output_tokens is not None else ""
+        cost_note = f", ~${cost:.5f}" if cost is not None and output_tokens is not None else ""
+        print(f"--- Route {self.tier} ({self.reason}) -> {served}: {seconds:.2f}s{usage_note}{cost_note} ---")
+
+
+def _noting_attempts(record, model_name, fn, model):
+    """fn(model) as a no-argument call for the resilient caller, counting each attempt on `record`."""
+    def attempt():
+        if record is not None:
+            record.attempt(model_name)
+        return fn(model)
+    return attempt
+
+
+def _chain(primary):
+    return [primary] + [name for name in FALLBACK_MODELS if name != primary]
+
+
+def choose_route(text, generation_config, rule_score=None, deadline=None, document_type=None):
+    """
+    Route for analyzing `text`: a model tier from the document's size, its
+    type (the one the client gave, else detected from keywords) and the
+    rule-based score (higher is safer), and the reply budget for that tier and size.
+    """
+    if not ROUTING_ENABLED:
+        return default_route(generation_config, "routing off", deadline)
+
+    tokens = prompt_builder.estimate_tokens(text)
+    document_type = rule_packs.normalize_name(document_type) or detect_document_type(text)
+    risky = rule_score is not None and rule_score <= PRO_MAX_RULE_SCORE
+    safe = rule_score is not None and rule_score >= LITE_MIN_RULE_SCORE
+    if PRO_MODEL and document_type in HIGH_STAKES_TYPES and risky:
+        tier = "pro"
+    elif tokens <= LITE_MAX_TOKENS and document_type not in HIGH_STAKES_TYPES and safe:
+        tier = "lite"
+    else:
+        tier = "standard"
+
+    max_output_tokens = TIERS[tier]["max_output_tokens"]
+    # Longer documents are split into chunks (map-reduce), each with its own reply
+    if LONG_DOCUMENT_TOKENS < tokens <= prompt_builder.MAP_REDUCE_MIN_TOKENS:
+        max_output_tokens += LONG_DOCUMENT_EXTRA_OUTPUT_TOKENS
+    reason = f"~{tokens} tokens, {document_type}, rule score {rule_score}"
+    return Route(tier, _chain(TIERS[tier]["model"]), dict(generation_config, max_output_tokens=max_output_tokens),
+                 reason, deadline)
+
+
+def default_route(generation_config, reason="default", deadline=None):
+    """The standard model with its fallback chain, for requests that are not routed (e.g. explanations)."""
+    return Route("standard", _chain(gemini_client.GEMINI_MODEL), generation_config, reason, deadline)
+
+
+def stats():
+    """Circuit state of each model that has been called, and the routing settings."""
+    models = {gemini_client.GEMINI_MODEL: resilience.gemini.stats()}
+    with _callers_lock:
+        models.update((name, caller.stats()) for name, caller in _callers.items())
+    return {
+        "enabled": ROUTING_ENABLED,
+        "tiers": {tier: settings["model"] for tier, settings in TIERS.items() if settings["model"]},
+        "fallbackModels": FALLBACK_MODELS,
+        "models": models,
+    }
+
+
+def reset():
+    with _callers_lock:
+        for caller in _callers.values():
+            caller.reset()
@@ -0,0 +1,638 @@
+# prompt_builder.py - Assembles the Gemini analysis prompt within a token budget
+
+import bisect
+import math
+import os
+import re
+
+from metrics import metrics
+from rule_engine import clause_bounds
+
+# Ask for the reply in Gemini's JSON mode, constrained by RESPONSE_SCHEMA, instead
+# of describing the format in the prompt and repairing whatever comes back
+JSON_MODE = os.getenv("GEMINI_JSON_MODE", "1") != "0"
+
+# The template used for new requests. Bump it (and add a new entry to
+# PROMPT_TEMPLATES) whenever the wording changes; cached results are keyed by it.
+PROMPT_VERSION = "6" if JSON_MODE else "2"
+
+# Hard cap on estimated input tokens per request (system instruction + document).
+# Longer documents are trimmed to the parts that matter most.
+MAX_INPUT_TOKENS = int(os.getenv("PROMPT_MAX_INPUT_TOKENS", "32000"))
+
+# Gemini tokenizes English at roughly 4 characters per token; other scripts
+# (e.g. Devanagari) come closer to one token per character.
+CHARS_PER_TOKEN = 4
+
+# Share of a trimmed document's budget kept from its start and its end; the
+# rest goes to the clauses around rule hits, highest risk first.
+TRIM_HEAD_SHARE = 0.5
+TRIM_TAIL_SHARE = 0.2
+
+# Documents estimated above this many tokens are analyzed map-reduce style: split
+# into clause-aligned chunks of about MAP_REDUCE_CHUNK_TOKENS, analyzed in
+# parallel and merged (see ai.py). At most MAP_REDUCE_MAX_CHUNKS chunks are made;
+# longer documents get proportionally bigger chunks, trimmed to the budget.
+MAP_REDUCE_MIN_TOKENS = int(os.getenv("MAP_REDUCE_MIN_TOKENS", "12000"))
+MAP_REDUCE_CHUNK_TOKENS = int(os.getenv("MAP_REDUCE_CHUNK_TOKENS", "6000"))
+MAP_REDUCE_MAX_CHUNKS = int(os.getenv("MAP_REDUCE_MAX_CHUNKS", "12"))
+
+# Preferred cut points for chunks, best first: page, paragraph, line, sentence, word
+_CHUNK_BREAKS = ("\f", "\n\n", "\n", ". ", "; ", " ")
+
+_NON_ASCII = re.compile(r"[^\x00-\x7f]")
+
+# At most this many rules are marked in a prompt's document, highest risk first
+MAX_FLAGGED_CLAUSES = 15
+
+# Page headers and footers: short lines among the first or last PAGE_EDGE_LINES
+# non-blank lines of a page, repeated on other pages or only a page number
+PAGE_EDGE_LINES = 2
+FURNITURE_MAX_CHARS = 120
+
+# From prompt version 6, documents estimated above this many tokens are sent
+# with the clauses no rule flagged shortened to their first SUMMARY_CLAUSE_WORDS
+# words; the first SUMMARY_KEEP_HEAD_CHARS (parties, definitions) and the last
+# SUMMARY_KEEP_TAIL_CHARS (governing law, signatures) stay whole
+SUMMARIZE_MIN_TOKENS = int(os.getenv("PROMPT_SUMMARIZE_MIN_TOKENS", "750"))
+SUMMARY_CLAUSE_WORDS = 8
+SUMMARY_KEEP_HEAD_CHARS = 1000
+SUMMARY_KEEP_TAIL_CHARS = 600
+SHORTENED_MARK = " [...]"
+
+# Lines that are only a page number ("3", "- 3 -", "Page 3 of 12")
+_PAGE_NUMBER_LINE = re.compile(r"^\s*(?:page\s+)?[-\u2013(\[]?\s*\d{1,4}\s*[-\u2013)\]]?(?:\s+of\s+\d{1,4})?\s*$", re.IGNORECASE)
+
+SYSTEM_INSTRUCTION_V2 = """You are Kiro, a Legal Document Auditor and Risk Analyst. Analyze the document you are given thoroughly.
+
+This could be any type of public document: lease agreement, terms & conditions, service agreement, employment contract, privacy policy, NDA, or general contract.
+
+RATING: 0-20=CRITICAL, 21-45=DANGEROUS, 46-70=RISKY, 71-85=CAUTION, 86-100=STABLE
+
+Analyze for:
+- Unfair or one-sided terms
+- Hidden fees or charges
+- Liability limitations
+- Data privacy concerns
+- Cancellation/termination terms
+- Missing protections
+- Legal compliance issues
+- Ambiguous language
+
+If parts of the document are marked as omitted, base the analysis on the parts shown.
+
+Return ONLY this JSON format (no markdown):
+{"overallScore":75,"ratingScore":75,"colorLabel":"YELLOW","ratingText":"CAUTION","summary":"Comprehensive 15-20 line summary covering all key aspects including main terms, obligations, rights, fees, termination, liability, data usage (if applicable), and overall fairness assessment with specific concerns and positive aspects identified","shortSummary":"Brief one-sentence summary","aiSummary":"Detailed 15-20 line analysis explaining key findings, risk factors, legal compliance issues, missing protections, unfair clauses, balanced terms, and overall assessment with specific recommendations","redFlags":[{"title":"Unfair Termination Clause","issue":"Can terminate with only 7 days notice which may be below legal minimum"},{"title":"Excessive Fees","issue":"Hidden fees not clearly disclosed upfront"},{"title":"Liability Limitation","issue":"Company not responsible for any damages or losses"},{"title":"No Privacy Protection","issue":"Can share personal data with third parties without consent"},{"title":"Automatic Renewal","issue":"Auto-renews without clear notification or easy cancellation"}],"fairClauses":[{"title":"Clear Payment Terms","recommendation":"Payment amount and schedule are clearly specified"},{"title":"Defined Service Period","recommendation":"Service duration is clearly stated with start and end dates"},{"title":"Refund Policy","recommendation":"Refund terms are clearly outlined"},{"title":"Contact Information","recommendation":"Support and contact details are provided"}],"recommendations":["Review all terms carefully before accepting","Negotiate unfavorable terms if possible","Clarify any ambiguous language","Verify compliance with applicable laws","Document all communications","Consider legal review for high-value agreements","Understand your rights and obligations","Keep copies of all documents"],"redFlagsCount":5,"fairClausesCount":4}"""
+
+# Version 3 leaves the reply format to RESPONSE_SCHEMA (JSON mode)
+SYSTEM_INSTRUCTION_V3 = """You are Kiro, a Legal Document Auditor and Risk Analyst. Analyze the document you are given thoroughly.
+
+This could be any type of public document: lease agreement, terms & conditions, service agreement, employment contract, privacy policy, NDA, or general contract.
+
+RATING: 0-20=CRITICAL, 21-45=DANGEROUS, 46-70=RISKY, 71-85=CAUTION, 86-100=STABLE
+
+Analyze for:
+- Unfair or one-sided terms
+- Hidden fees or charges
+- Liability limitations
+- Data privacy concerns
+- Cancellation/termination terms
+- Missing protections
+- Legal compliance issues
+- Ambiguous language
+
+If parts of the document are marked as omitted, base the analysis on the parts shown.
+
+overallScore is the 0-100 rating above and colorLabel its band (DARK_RED, RED, ORANGE, YELLOW, GREEN). The summary is a comprehensive 15-20 line summary covering the main terms, obligations, rights, fees, termination, liability, data usage (if applicable) and overall fairness, with the specific concerns and positive aspects identified. List each risky clause as a red flag with a short title and the issue, each balanced clause as a fair clause with a short title and why it is fair, and practical recommendations for the reader."""
+
+# Version 4 adds the rule engine's findings, so the model checks the flagged
+# clauses instead of searching for them, and keeps the rest of its answer short
+SYSTEM_INSTRUCTION_V4 = """You are Kiro, a Legal Document Auditor and Risk Analyst. Analyze the document you are given: a lease, terms & conditions, service or employment agreement, privacy policy, NDA or other contract.
+
+RATING: 0-20=CRITICAL, 21-45=DANGEROUS, 46-70=RISKY, 71-85=CAUTION, 86-100=STABLE. overallScore is this rating and colorLabel its band (DARK_RED, RED, ORANGE, YELLOW, GREEN).
+
+Look for unfair or one-sided terms, hidden fees, liability limits, data privacy concerns, cancellation/termination terms, missing protections, legal compliance issues and ambiguous language. If parts of the document are marked as omitted, base the analysis on the parts shown.
+
+Lines marked [flag: rule, risk 0-100] contain wording a keyword rule scan flagged (higher is worse). Confirm or dismiss each flag and look for risks the rules cannot recognise.
+
+Write a 10-15 line summary of the main terms, obligations, rights, fees, termination, liability, data usage (if applicable) and overall fairness. Give each red flag a short title and the issue in one or two sentences, without quoting the clause back. Give each fair clause a short title and why it is fair; skip standard boilerplate (definitions, notices, signatures) unless it is unusual. At most 8 fair clauses and 8 practical recommendations."""
+
+# Version 5 asks for a compact first pass; the long-form explanation of the
+# document or of one red flag is written on demand (build_explanation_prompt)
+SYSTEM_INSTRUCTION_V5 = """You are Kiro, a Legal Document Auditor and Risk Analyst. Analyze the document you are given: a lease, terms & conditions, service or employment agreement, privacy policy, NDA or other contract.
+
+RATING: 0-20=CRITICAL, 21-45=DANGEROUS, 46-70=RISKY, 71-85=CAUTION, 86-100=STABLE. overallScore is this rating and colorLabel its band (DARK_RED, RED, ORANGE, YELLOW, GREEN).
+
+Look for unfair or one-sided terms, hidden fees, liability limits, data privacy concerns, cancellation/termination terms, missing protections, legal compliance issues and ambiguous language. If parts of the document are marked as omitted, base the analysis on the parts shown.
+
+Lines marked [flag: rule, risk 0-100] contain wording a keyword rule scan flagged (higher is worse). Confirm or dismiss each flag and look for risks the rules cannot recognise.
+
+Keep the reply short: the reader can ask for a detailed explanation later. Write a 3-5 sentence summary of the document and its overall fairness. Give each red flag a short title and the issue in one sentence, without quoting the clause back. Give each fair clause a short title and one sentence on why it is fair; skip standard boilerplate (definitions, notices, signatures) unless it is unusual. At most 8 fair clauses and 6 one-sentence recommendations."""
+
+# Version 6 sends the clauses no rule flagged shortened (see SUMMARIZE_MIN_TOKENS)
+SYSTEM_INSTRUCTION_V6 = SYSTEM_INSTRUCTION_V5.replace(
+    "Confirm or dismiss each flag and look for risks the rules cannot recognise.",
+    "Confirm or dismiss each flag and look for risks the rules cannot recognise. Lines ending in [...] are "
+    "unflagged clauses cut to their opening words; judge them by what is shown.")
+
+# The analysis result contract for JSON mode (Gemini's OpenAPI schema subset).
+# ai.py derives ratingScore, ratingText, the summaries and the counts from these.
+RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "overallScore": {"type": "INTEGER", "description": "0-100, higher is safer"},
+        "colorLabel": {"type": "STRING", "enum": ["DARK_RED", "RED", "ORANGE", "YELLOW", "GREEN"]},
+        "summary": {"type": "STRING"},
+        "redFlags": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {"title": {"type": "STRING"}, "issue": {"type": "STRING"}},
+                "required": ["title", "issue"],
+            },
+        },
+        "fairClauses": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {"title": {"type": "STRING"}, "recommendation": {"type": "STRING"}},
+                "required": ["title", "recommendation"],
+            },
+            "max_items": 8,
+        },
+        "recommendations": {"type": "ARRAY", "items": {"type": "STRING"}, "max_items": 6},
+    },
+    "required": ["overallScore", "colorLabel", "summary", "redFlags", "fairClauses", "recommendations"],
+}
+
+PROMPT_TEMPLATES = {
+    "2": {
+        # Static, so the model (and any server-side prefix cache) sees the same instruction every time
+        "system_instruction": SYSTEM_INSTRUCTION_V2,
+        # Per-request part: the document appears exactly once
+        "user": "{location_context}\n\nDocument:\n{document}",
+        # One chunk of a long document (map step of map-reduce analysis)
+        "chunk": ("{location_context}\n\nThis is part {part} of {parts} of a longer document. "
+                  "Analyze only this part; the other parts are analyzed separately.\n\n"
+                  "Document part:\n{document}"),
+    },
+    "3": {
+        "system_instruction": SYSTEM_INSTRUCTION_V3,
+        "user": "{location_context}\n\nDocument:\n{document}",
+        "chunk": ("{location_context}\n\nThis is part {part} of {parts} of a longer document. "
+                  "Analyze only this part; the other parts are analyzed separately.\n\n"
+                  "Document part:\n{document}"),
+    },
+    "4": {
+        "system_instruction": SYSTEM_INSTRUCTION_V4,
+        "user": "{location_context}\n\nDocument:\n{document}",
+        "chunk": ("{location_context}\n\nThis is part {part} of {parts} of a longer document. "
+                  "Analyze only this part; the other parts are analyzed separately.\n\n"
+                  "Document part:\n{document}"),
+        # Condense the document and mark the rule hits in it (see _build_prompt)
+        "focus": True,
+    },
+    "5": {
+        "system_instruction": SYSTEM_INSTRUCTION_V5,
+        "user": "{location_context}\n\nDocument:\n{document}",
+        "chunk": ("{location_context}\n\nThis is part {part} of {parts} of a longer document. "
+                  "Analyze only this part; the other parts are analyzed separately.\n\n"
+                  "Document part:\n{document}"),
+        "focus": True,
+    },
+    "6": {
+        "system_instruction": SYSTEM_INSTRUCTION_V6,
+        "user": "{location_context}\n\nDocument:\n{document}",
+        "chunk": ("{location_context}\n\nThis is part {part} of {parts} of a longer document. "
+                  "Analyze only this part; the other parts are analyzed separately.\n\n"
+                  "Document part:\n{document}"),
+        "focus": True,
+        # Past SUMMARIZE_MIN_TOKENS, shorten the clauses without rule hits
+        "summarize": True,
+    },
+}
+
+
+# On-demand long-form explanations (/api/analysis/<id>/explain), answered in plain text
+EXPLANATION_VERSION = "1"
+
+EXPLANATION_SYSTEM_INSTRUCTION = """You are Kiro, a Legal Document Auditor and Risk Analyst. A reader has the short analysis of a document and asks for more detail. Answer in plain language for someone who is not a lawyer, as plain text without markdown or JSON."""
+
+EXPLANATION_TEMPLATES = {
+    "document": ("{location_context}\n\nShort analysis:\n{analysis}\n\n"
+                 "Write a detailed 15-20 line explanation of this analysis: the key findings, risk factors, legal "
+                 "compliance issues, missing protections, unfair and balanced terms, and specific recommendations."
+                 "\n\nDocument:\n{document}"),
+    "redFlag": ("{location_context}\n\nRed flag: {flag}\n\n"
+                "Explain this red flag in 6-10 lines: what the clause says, why it is risky for the reader, what "
+                "the law usually expects here and what to ask the other party to change."
+                "\n\nDocument:\n{document}"),
+}
+
+
+def response_format():
+    """generation_config entries that put Gemini in JSON mode, or {} when JSON_MODE is off."""
+    if not JSON_MODE:
+        return {}
+    return {"response_mime_type": "application/json", "response_schema": RESPONSE_SCHEMA}
+
+
+class Prompt:
+    """An assembled prompt plus its estimated size."""
+
+    def __init__(self, version, system_instruction, contents, document_tokens, trimmed_chars, part=1, parts=1,
+                 condensed_chars=0):
+        self.version = version
+        self.system_instruction = system_instruction
+        self.contents = contents
+        self.document_tokens = document_tokens
+        self.trimmed_chars = trimmed_chars
+        self.part = part
+        self.parts = parts
+        self.condensed_chars = condensed_chars
+
+    @property
+    def input_tokens(self):
+        return estimate_tokens(self.system_instruction) + estimate_tokens(self.contents)
+
+    @property
+    def trimmed(self):
+        return self.trimmed_chars > 0
+
+
+def estimate_tokens(text):
+    """Cheap local token estimate (no API call); errs on the high side."""
+    non_ascii = len(_NON_ASCII.findall(text))
+    return math.ceil((len(text) - non_ascii) / CHARS_PER_TOKEN) + non_ascii
+
+
+def build_analysis_prompt(text, state="", preliminary_findings=None, max_input_tokens=None, version=PROMPT_VERSION):
+    """
+    Returns the Prompt for analyzing `text`. When the whole prompt would exceed
+    max_input_tokens the document is trimmed (see trim_document), keeping the
+    clauses the rule engine flagged.
+    """
+    hits = _titled_hits(preliminary_findings)
+    prompt = _build_prompt(version, "user", text, hits, state, max_input_tokens)
+    _record(prompt)
+    return prompt
+
+
+def build_analysis_prompts(text, state="", preliminary_findings=None, max_input_tokens=None, version=PROMPT_VERSION):
+    """
+    Returns the prompts for analyzing `text`: one prompt, or one per chunk when
+    the document is long enough for map-reduce analysis.
+    """
+    tokens = estimate_tokens(text)
+    if tokens <= MAP_REDUCE_MIN_TOKENS:
+        return [build_analysis_prompt(text, state, preliminary_findings, max_input_tokens, version)]
+
+    chunk_tokens = max(MAP_REDUCE_CHUNK_TOKENS, math.ceil(tokens / MAP_REDUCE_MAX_CHUNKS))
+    prompts = build_section_prompts(text, split_document(text, chunk_tokens), state, preliminary_findings,
+                                    max_input_tokens, version)
+    metrics.increment("prompt.chunked_documents")
+    print(f"--- Long document (~{tokens} tokens) split into {len(prompts)} chunks ---")
+    return prompts
+
+
+def build_section_prompts(text, spans, state="", preliminary_findings=None, max_input_tokens=None,
+                          version=PROMPT_VERSION):
+    """One "part i of n" prompt per (start, end) span of `text`."""
+    hits = _titled_hits(preliminary_findings)
+    prompts = []
+    for part, (start, end) in enumerate(spans, 1):
+        # Hit offsets relative to the chunk, for trimming an oversized chunk
+        chunk_hits = [dict(hit, start=hit["start"] - start, end=hit["end"] - start)
+                      for hit in hits if start <= hit["start"] and hit["end"] <= end]
+        prompt = _build_prompt(version, "chunk", text[start:end], chunk_hits, state, max_input_tokens,
+                               part=part, parts=len(spans))
+        _record(prompt)
+        prompts.append(prompt)
+    return prompts
+
+
+def build_explanation_prompt(text, analysis, state="", flag=None, max_input_tokens=None):
+    """
+    The Prompt asking for a long-form explanation of `analysis` (a compact
+    result), or of its red flag `flag` only. The document is condensed and
+    trimmed like an analysis prompt.
+    """
+    location_context = f"Location: {state}, India." if state else "Location: General."
+    if flag is None:
+        kind = "document"
+        flags = "\n".join(f"- {_flag_line(item)}" for item in analysis.get("redFlags", [])) or "- none"
+        fields = {"analysis": (f"Score {analysis.get('ratingScore')}/100 ({analysis.get('ratingText')}). "
+                               f"{analysis.get('summary', '')}\nRed flags:\n{flags}")}
+    else:
+        kind = "redFlag"
+        fields = {"flag": _flag_line(flag)}
+
+    document, _, condensed_chars = condense_document(text)
+    overhead = estimate_tokens(EXPLANATION_SYSTEM_INSTRUCTION) + estimate_tokens(
+        EXPLANATION_TEMPLATES[kind].format(document="", location_context=location_context, **fields))
+    document, trimmed_chars = trim_document(document, max(0, (max_input_tokens or MAX_INPUT_TOKENS) - overhead))
+    return Prompt(
+        EXPLANATION_VERSION,
+        EXPLANATION_SYSTEM_INSTRUCTION,
+        EXPLANATION_TEMPLATES[kind].format(document=document, location_context=location_context, **fields),
+        estimate_tokens(document),
+        trimmed_chars,
+        condensed_chars=condensed_chars,
+    )
+
+
+def _flag_line(flag):
+    # Red flags are {"title", "issue"} objects; some older results hold plain strings
+    if isinstance(flag, dict):
+        return f"{flag.get('title', '')}: {flag.get('issue', '')}".strip(": ")
+    return str(flag)
+
+
+def split_document(text, max_tokens):
+    """
+    Splits `text` into consecutive (start, end) spans of at most about
+    max_tokens each, cutting at the best break available: a page break, then a
+    blank line, a line break, a sentence end and finally a space.
+    """
+    tokens = estimate_tokens(text)
+    if tokens <= max_tokens:
+        return [(0, len(text))]
+
+    limit = max(1, int(max_tokens * len(text) / tokens))
+    spans = []
+    position = 0
+    while position < len(text):
+        end = position + limit
+        if end >= len(text):
+            spans.append((position, len(text)))
+            break
+        # Never cut in the first half of a chunk, so chunks stay close to the target size
+        floor = position + limit // 2
+        for separator in _CHUNK_BREAKS:
+            index = text.rfind(separator, floor, end)
+            if index != -1:
+                end = index + len(separator)
+                break
+        spans.append((position, end))
+        position = end
+    return spans
+
+
+def _titled_hits(preliminary_findings):
+    """The rule hits, each with the title of its rule."""
+    findings = preliminary_findings or {}
+    titles = {issue["phrase"]: issue.get("title", issue["phrase"]) for issue in findings.get("found_issues", [])}
+    return [dict(hit, title=titles.get(hit["phrase"], hit["phrase"])) for hit in findings.get("hits", [])]
+
+
+def _build_prompt(version, kind, document, hits, state, max_input_tokens, part=1, parts=1):
+    template = PROMPT_TEMPLATES[version]
+    max_input_tokens = max_input_tokens or MAX_INPUT_TOKENS
+    location_context = f"Location: {state}, India." if state else "Location: General."
+    fields = {"location_context": location_context, "part": part, "parts": parts}
+    condensed_chars = 0
+    if template.get("focus"):
+        summarize = template.get("summarize", False) and estimate_tokens(document) > SUMMARIZE_MIN_TOKENS
+        document, hits, condensed_chars = condense_document(document, hits, flag_markers(hits), summarize)
+
+    overhead = estimate_tokens(template["system_instruction"]) + estimate_tokens(
+        template[kind].format(document="", **fields))
+    document, trimmed_chars = trim_document(document, max(0, max_input_tokens - overhead), hits)
+    return Prompt(
+        version,
+        template["system_instruction"],
+        template[kind].format(document=document, **fields),
+        estimate_tokens(document),
+        trimmed_chars,
+        part,
+        parts,
+        condensed_chars,
+    )
+
+
+def _record(prompt):
+    """Per-request prompt size metrics."""
+    metrics.increment("prompt.requests")
+    metrics.increment("prompt.input_tokens", prompt.input_tokens)
+    if prompt.trimmed:
+        metrics.increment("prompt.trimmed")
+        metrics.increment("prompt.trimmed_chars", prompt.trimmed_chars)
+    metrics.increment("prompt.condensed_chars", prompt.condensed_chars)
+    part = f" (part {prompt.part}/{prompt.parts})" if prompt.parts > 1 else ""
+    print(f"--- Prompt v{prompt.version}{part}: ~{prompt.input_tokens} input tokens"
+          f"{f', trimmed {prompt.trimmed_chars} characters' if prompt.trimmed else ''} ---")
+
+
+def flag_markers(hits, limit=MAX_FLAGGED_CLAUSES):
+    """
+    {hit start: "[flag: title, risk N] "} for the `limit` highest-risk rules
+    (first occurrence of each); condense_document puts each marker in front of
+    the line holding the hit.
+    """
+    markers = {}
+    seen = set()
+    for hit in sorted(hits, key=lambda hit: (-hit["score"], hit["start"])):
+        if hit["phrase"] in seen:
+            continue
+        seen.add(hit["phrase"])
+        markers[hit["start"]] = f'{hit.get("title", hit["phrase"])}, risk {hit["score"]}'
+        if len(markers) == limit:
+            break
+    return markers
+
+
+def condense_document(text, hits=(), markers=None, summarize=False):
+    """
+    Drops lines that carry nothing for the analysis: page furniture (see
+    _page_furniture) after its first copy, page-number lines at page edges and
+    extra blank lines; page breaks are kept. Lines holding a hit listed in
+    `markers` ({start: label}) get a "[flag: label] " prefix. With `summarize`,
+    lines holding no hit are cut to their first SUMMARY_CLAUSE_WORDS words,
+    outside the head and tail of the document.
+
+    Returns the condensed text, the hits with their offsets moved to it (hits
+    on a dropped header or footer go with it; the first copy keeps its own)
+    and the number of characters dropped.
+    """
+    markers = markers or {}
+    marker_starts = sorted(markers)
+    lines = text.splitlines(keepends=True)
+    furniture, page_numbers = _page_furniture(lines)
+    hit_lines = _lines_with_hits(lines, hits) if summarize else set()
+    pieces = []      # (start, end, prefix) of the kept stretches of text
+    seen = set()
+    previous_blank = False
+    position = 0
+    changed = False
+    for number, line in enumerate(lines):
+        start, end = position, position + len(line)
+        position = end
+        content = line.strip()
+        page_break = line.startswith("\f")
+        if not content:
+            drop = previous_blank and not page_break
+            previous_blank = True
+        else:
+            drop = number in page_numbers or (number in furniture and content in seen)
+            if number in furniture:
+                seen.add(content)
+            previous_blank = False
+
+        if drop:
+            changed = True
+            if page_break:
+                pieces.append((start, start + 1, ""))
+            continue
+        first = bisect.bisect_left(marker_starts, start)
+        labels = []
+        while first < len(marker_starts) and marker_starts[first] < end:
+            labels.append(markers[marker_starts[first]])
+            first += 1
+        prefix = ""
+        if labels:
+            changed = True
+            prefix = f"[flag: {'; '.join(labels)}] "
+            if page_break:
+                # Keep the page break first on its line
+                pieces.append((start, start + 1, ""))
+                start += 1
+        cut = None
+        if summarize and number not in hit_lines and SUMMARY_KEEP_HEAD_CHARS <= start \
+                and end <= len(text) - SUMMARY_KEEP_TAIL_CHARS:
+            cut = _SUMMARY_OPENING.match(line)
+        if cut is not None and cut.end() < len(line.rstrip()):
+            changed = True
+            # The mark goes before the line break, which is kept
+            newline = end - (len(line) - len(line.rstrip("\r\n")))
+            pieces.append((start, start + cut.end(), prefix))
+            pieces.append((newline, end, SHORTENED_MARK))
+        else:
+            pieces.append((start, end, prefix))
+
+    if not changed:
+        return text, list(hits), 0
+
+    new_starts = []
+    length = 0
+    for start, end, prefix in pieces:
+        new_starts.append(length + len(prefix))
+        length += len(prefix) + end - start
+    piece_starts = [start for start, _, _ in pieces]
+
+    def move(offset):
+        index = bisect.bisect_right(piece_starts, offset) - 1
+        if index < 0 or offset >= pieces[index][1]:
+            return None
+        return new_starts[index] + offset - pieces[index][0]
+
+    moved = []
+    for hit in hits:
+        start, last = move(hit["start"]), move(hit["end"] - 1)
+        if start is not None and last is not None:
+            moved.append(dict(hit, start=start, end=last + 1))
+    dropped = len(text) - sum(end - start for start, end, _ in pieces)
+    return "".join(prefix + text[start:end] for start, end, prefix in pieces), moved, dropped
+
+
+_SUMMARY_OPENING = re.compile(r"\s*(?:\S+[ \t]+){%d}" % (SUMMARY_CLAUSE_WORDS - 1) + r"\S+")
+
+
+def _lines_with_hits(lines, hits):
+    """Indexes of the lines of `lines` that hold (part of) a hit."""
+    line_starts = []
+    position = 0
+    for line in lines:
+        line_starts.append(position)
+        position += len(line)
+    numbers = set()
+    for hit in hits:
+        first = bisect.bisect_right(line_starts, hit["start"]) - 1
+        last = bisect.bisect_right(line_starts, hit["end"] - 1) - 1
+        numbers.update(range(first, last + 1))
+    return numbers
+
+
+def _page_furniture(lines):
+    """
+    (indexes of header/footer lines, indexes of page-number lines) of a
+    document with page breaks: short lines among the first or last
+    PAGE_EDGE_LINES non-blank lines of a page that recur at the edges of
+    other pages, or are only a page number. The body of a page is never
+    touched, so repeated clauses and number-only lines in it are kept.
+    """
+    pages = [[]]   # indexes of the non-blank lines of each page
+    for number, line in enumerate(lines):
+        pages.extend([] for _ in range(line.count("\f")))
+        if line.strip():
+            pages[-1].append(number)
+    if len(pages) < 2:
+        return set(), set()
+
+    edges = set()
+    for page in pages:
+        edges.update(page[:PAGE_EDGE_LINES] + page[-PAGE_EDGE_LINES:])
+    page_numbers = {number for number in edges if _PAGE_NUMBER_LINE.match(lines[number].strip())}
+    pages_with = {}
+    for page_index, page in enumerate(pages):
+        for number in set(page[:PAGE_EDGE_LINES] + page[-PAGE_EDGE_LINES:]) - page_numbers:
+            content = lines[number].strip()
+            if len(content) <= FURNITURE_MAX_CHARS:
+                pages_with.setdefault(content, set()).add(page_index)
+    furniture = {number for number in edges - page_numbers if len(pages_with.get(lines[number].strip(), ())) > 1}
+    return furniture, page_numbers
+
+
+def trim_document(text, max_tokens, hits=()):
+    """
+    Fits `text` into max_tokens. Keeps the start of the document (parties,
+    definitions), its end (signatures, governing law) and, in between, the
+    clauses around rule hits from highest to lowest score. Omitted stretches
+    are replaced by a marker. Returns (document, number of characters dropped).
+    """
+    tokens = estimate_tokens(text)
+    if tokens <= max_tokens:
+        return text, 0
+
+    limit = int(max_tokens * len(text) / max(1, tokens))
+    head_end = _snap_to_line(text, int(limit * TRIM_HEAD_SHARE))
+    tail_start = _snap_to_next_line(text, len(text) - int(limit * TRIM_TAIL_SHARE))
+    spans = [(0, head_end), (tail_start, len(text))]
+    used = head_end + (len(text) - tail_start)
+
+    for hit in sorted(hits, key=lambda hit: (-hit["score"], hit["start"])):
+        if head_end <= hit["start"] and hit["end"] <= tail_start:
+            start, end = clause_bounds(text, hit["start"], hit["end"])
+            if used + (end - start) > limit:
+                continue
+            spans.append((start, end))
+            used += end - start
+
+    parts = []
+    position = 0
+    kept = 0
+    for start, end in sorted(spans):
+        start = max(start, position)
+        if end <= start:
+            continue
+        if start > position:
+            parts.append(f"\n[... {start - position} characters omitted ...]\n")
+        parts.append(text[start:end])
+        kept += end - start
+        position = end
+    if position < len(text):
+        parts.append(f"\n[... {len(text) - position} characters omitted ...]\n")
+    return "".join(parts), len(text) - kept
+
+
+def _snap_to_line(text, position):
+    """Moves a cut back to the previous line break, unless that loses most of the span."""
+    line_start = text.rfind("\n", 0, position)
+    return line_start + 1 if line_start > position // 2 else position
+
+
+def _snap_to_next_line(text, position):
+    """Moves a cut forward to the next line start, unless that loses most of the span."""
+    line_end = text.find("\n", position)
+    if line_end == -1 or line_end - position > (len(text) - position) // 2:
+        return position
+    return line_end + 1
@@ -0,0 +1,180 @@
+# rate_limiter.py - Client-side admission control for the Gemini RPM/TPM quota, shared by the workers on a node
+
+import os
+import struct
+import tempfile
+import threading
+import time
+
+from metrics import metrics
+
+# Cross-process locking needs fcntl (Unix); elsewhere each process limits on its own
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:
+    FCNTL_AVAILABLE = False
+
+# Quota of the Gemini project (0 disables that limit). Defaults: gemini-2.5-flash, paid tier 1
+RPM_LIMIT = int(os.getenv("GEMINI_RPM_LIMIT", "1000"))
+TPM_LIMIT = int(os.getenv("GEMINI_TPM_LIMIT", "1000000"))
+
+# Requests wait up to this long (seconds) for quota; beyond it they are turned away with the predicted wait
+MAX_QUEUE_WAIT = float(os.getenv("GEMINI_RATE_LIMIT_MAX_WAIT", "10"))
+
+# Output tokens charged per call on top of the prompt estimate
+OUTPUT_TOKEN_ALLOWANCE = int(os.getenv("GEMINI_RATE_LIMIT_OUTPUT_TOKENS", "2000"))
+
+# Bucket state shared by the gunicorn workers of this node
+STATE_PATH = os.getenv("GEMINI_RATE_LIMIT_PATH", os.path.join(tempfile.gettempdir(), 'lekha_gemini_rate_limit'))
+
+# requests available, tokens available, time of the last update (epoch seconds)
+_STATE = struct.Struct('<ddd')
+
+
+class RateLimitExceeded(Exception):
+    """The quota queue is longer than MAX_QUEUE_WAIT; `retry_after` is the predicted wait in seconds."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"Gemini quota queue is full, predicted wait {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+class TokenBucketLimiter:
+    """
+    Two token buckets, requests/min and tokens/min, each holding up to one
+    minute of quota and refilling continuously.
+
+    A caller reserves quota before calling Gemini. When a bucket is short the
+    reservation still succeeds (the bucket goes negative) and the caller is
+    told how long to sleep first, so callers queue in arrival order across all
+    workers. Reservations that would wait longer than `max_wait` are refused.
+
+    The bucket state lives in a small file locked with flock, so all worker
+    processes on the node draw from the same buckets.
+    """
+
+    def __init__(self, rpm=RPM_LIMIT, tpm=TPM_LIMIT, path=STATE_PATH, max_wait=MAX_QUEUE_WAIT):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.path = path
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self._fd = None
+        self._fd_pid = None
+        self._local_state = None
+        self.shared = FCNTL_AVAILABLE
+        if self.shared:
+            try:
+                self._open()
+            except OSError as e:
+                # A read-only filesystem (e.g. serverless) just means per-process limits
+                print(f"--- WARNING: Gemini rate limit not shared between workers ({path}): {e} ---")
+                self.shared = False
+
+    @property
+    def enabled(self):
+        return self.rpm > 0 or self.tpm > 0
+
+    def _open(self):
+        # flock belongs to the open file, which a forked worker would share with
+        # its parent, so every process opens the file itself
+        if self._fd is None or self._fd_pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            self._fd_pid = os.getpid()
+        return self._fd
+
+    def _update(self, change):
+        """Runs change(requests, tokens, now) -> (requests, tokens, value) on the refilled buckets."""
+        with self._lock:
+            now = time.time()
+            if not self.shared:
+                state = self._local_state
+                requests, tokens, value = change(*self._refill(state, now), now)
+                self._local_state = (requests, tokens, now)
+                return value
+
+            fd = self._open()
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                raw = os.pread(fd, _STATE.size, 0)
+                state = _STATE.unpack(raw) if len(raw) == _STATE.size else None
+                requests, tokens, value = change(*self._refill(state, now), now)
+                os.pwrite(fd, _STATE.pack(requests, tokens, now), 0)
+                return value
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def _refill(self, state, now):
+        if state is None:
+            return float(self.rpm), float(self.tpm)
+        requests, tokens, updated_at = state
+        elapsed = max(0.0, now - updated_at)
+        return (min(float(self.rpm), requests + elapsed * self.rpm / 60),
+                min(float(self.tpm), tokens + elapsed * self.tpm / 60))
+
+    def _wait_for(self, requests, tokens, needed_tokens):
+        wait = 0.0
+        if self.rpm > 0 and requests < 1:
+            wait = max(wait, (1 - requests) * 60 / self.rpm)
+        if self.tpm > 0 and tokens < needed_tokens:
+            wait = max(wait, (needed_tokens - tokens) * 60 / self.tpm)
+        return wait
+
+    def reserve(self, estimated_tokens, max_wait=None):
+        """
+        Reserves quota for one call and returns how long (seconds) to wait
+        before making it. Raises RateLimitExceeded when that is over max_wait
+        (the limiter's own, or the caller's when that is shorter).
+        """
+        if not self.enabled:
+            return 0.0
+        max_wait = self.max_wait if max_wait is None else min(self.max_wait, max_wait)
+        # A single call larger than a minute of quota still has to be able to go through
+        needed_tokens = min(estimated_tokens, self.tpm) if self.tpm > 0 else 0
+
+        def change(requests, tokens, now):
+            wait = self._wait_for(requests, tokens, needed_tokens)
+            if wait > max_wait:
+                return requests, tokens, RateLimitExceeded(wait)
+            return requests - 1, tokens - needed_tokens, wait
+
+        outcome = self._update(change)
+        if isinstance(outcome, RateLimitExceeded):
+            metrics.increment("rate_limit.rejected")
+            raise outcome
+        if outcome > 0:
+            metrics.increment("rate_limit.queued")
+            metrics.increment("rate_limit.wait_seconds", outcome)
+        return outcome
+
+    def acquire(self, estimated_tokens):
+        """reserve(), then sleep until the reserved quota is available."""
+        wait = self.reserve(estimated_tokens)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def stats(self):
+        requests, tokens = self._update(lambda requests, tokens, now: (requests, tokens, (requests, tokens)))
+        return {
+            "rpmLimit": self.rpm,
+            "tpmLimit": self.tpm,
+            "requestsAvailable": round(requests, 2),
+            "tokensAvailable": int(tokens),
+            "predictedWait": round(self._wait_for(requests, tokens, OUTPUT_TOKEN_ALLOWANCE), 2),
+            "shared": self.shared,
+        }
+
+    def reset(self):
+        with self._lock:
+            self._local_state = None
+            if self.shared:
+                os.ftruncate(self._open(), 0)
+
+
+# Process-wide limiter used by ai.py before every Gemini call
+limiter = TokenBucketLimiter()
@@ -0,0 +1,331 @@
+# resilience.py - Retries, hedged requests and a circuit breaker around Gemini calls
+
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FutureTimeout
+
+from google.api_core import exceptions as google_exceptions
+
+from metrics import metrics
+
+# Attempts per call (1 = no retries) and the exponential backoff between them
+RETRY_ATTEMPTS = int(os.getenv("GEMINI_RETRY_ATTEMPTS", "3"))
+RETRY_BASE_DELAY = float(os.getenv("GEMINI_RETRY_BASE_DELAY", "0.5"))
+RETRY_MAX_DELAY = float(os.getenv("GEMINI_RETRY_MAX_DELAY", "4"))
+
+# Hedging: when a call has run longer than the recent p95 latency, send a second
+# identical request and use whichever answers first. Costs up to ~5% extra calls.
+HEDGE_ENABLED = os.getenv("GEMINI_HEDGE", "0") == "1"
+HEDGE_MIN_DELAY = float(os.getenv("GEMINI_HEDGE_MIN_DELAY", "2"))
+HEDGE_MIN_SAMPLES = 20
+HEDGE_WORKERS = int(os.getenv("GEMINI_HEDGE_WORKERS", "32"))
+
+# Circuit breaker: this many retryable failures in a row open the circuit, and
+# calls fail immediately until a probe call is let through after the timeout
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("GEMINI_BREAKER_FAILURES", "5"))
+BREAKER_RESET_TIMEOUT = float(os.getenv("GEMINI_BREAKER_RESET_SECONDS", "30"))
+
+# While the circuit is open: "rules" answers with the rule-based result, "fail" returns an error
+CIRCUIT_OPEN_FALLBACK = os.getenv("GEMINI_CIRCUIT_OPEN_FALLBACK", "rules")
+
+# Transient provider errors worth another attempt (503, 504, 500, 429 quota bursts)
+RETRYABLE_ERRORS = (
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.InternalServerError,
+    google_exceptions.TooManyRequests,
+    google_exceptions.ResourceExhausted,
+    ConnectionError,
+    TimeoutError,
+)
+RETRYABLE_MESSAGES = ("503", "504", "429", "unavailable", "deadline exceeded", "timed out", "timeout")
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the provider while the circuit is open."""
+
+
+def is_retryable(error):
+    if isinstance(error, RETRYABLE_ERRORS):
+        return True
+    message = str(error).lower()
+    return any(marker in message for marker in RETRYABLE_MESSAGES)
+
+
+def backoff_delay(attempt):
+    """Full-jitter exponential backoff before retry number `attempt` (1-based)."""
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempt - 1)))
+
+
+class CircuitBreaker:
+    """
+    closed -> open after `failure_threshold` consecutive failures; open ->
+    half_open after `reset_timeout` seconds, letting one probe call through;
+    the probe closes the circuit again or re-opens it.
+    """
+
+    def __init__(self, name, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_timeout=BREAKER_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = "closed"
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == "open" and time.monotonic() - self._opened_at >= self.reset_timeout:
+                return "half_open"
+            return self._state
+
+    def allow(self):
+        """True when a call may go ahead."""
+        with self._lock:
+            if self._state == "closed":
+                return True
+            if self._state == "open":
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    return False
+                self._state = "half_open"
+            # half_open: exactly one probe at a time
+            if self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self._state != "closed":
+                print(f"--- Circuit '{self.name}' closed again ---")
+            self._state = "closed"
+            self._failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self._state == "half_open" or (self._state == "closed" and self._failures >= self.failure_threshold):
+                print(f"--- Circuit '{self.name}' opened after {self._failures} failures ---")
+                self._state = "open"
+                self._opened_at = time.monotonic()
+                metrics.increment(f"{self.name}.circuit.opened")
+
+    def release_probe(self):
+        """Frees the half-open probe slot when a call ended without an outcome."""
+        with self._lock:
+            self._probing = False
+
+    def reset(self):
+        with self._lock:
+            self._state = "closed"
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def stats(self):
+        state = self.state
+        with self._lock:
+            return {"state": state, "consecutiveFailures": self._failures}
+
+
+class LatencyTracker:
+    """Latencies (seconds) of the most recent successful calls."""
+
+    def __init__(self, size=200):
+        self._lock = threading.Lock()
+        self._samples = deque(maxlen=size)
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, fraction):
+        with self._lock:
+            samples = sorted(self._samples)
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+
+
+# Hedged sync calls run here so the caller can take whichever finishes first.
+# A losing call cannot be cancelled mid-request; it finishes in the background.
+_hedge_pool = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix="gemini-hedge")
+
+
+class ResilientCaller:
+    """
+    Wraps provider calls with the circuit breaker, retries with backoff and
+    (when enabled) hedging. Counters go to metrics under `name`.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.breaker = CircuitBreaker(name)
+        self.latency = LatencyTracker()
+
+    def hedge_delay(self):
+        """Seconds before a hedged second request is sent, or None for no hedging."""
+        if not HEDGE_ENABLED:
+            return None
+        p95 = self.latency.percentile(0.95)
+        return None if p95 is None else max(HEDGE_MIN_DELAY, p95)
+
+    def call(self, fn, hedge=True, time_left=None):
+        """
+        Returns fn(), retrying transient errors; raises CircuitOpenError while
+        the circuit is open. With `time_left`, a retry is only made when
+        time_left() (seconds a retry may still wait before it starts) covers its backoff.
+        """
+        self._check_circuit()
+        try:
+            for attempt in range(1, RETRY_ATTEMPTS + 1):
+                try:
+                    result = self._hedged(fn) if hedge else self._timed(fn)
+                except Exception as e:
+                    delay = backoff_delay(attempt)
+                    if not self._should_retry(e, attempt, delay, time_left):
+                        raise
+                    time.sleep(delay)
+                else:
+                    self.breaker.record_success()
+                    return result
+        except Exception:
+            raise
+        except BaseException:
+            self.breaker.release_probe()
+            raise
+
+    async def call_async(self, make_call, hedge=True, time_left=None):
+        """call() for coroutines; make_call() must return a new awaitable on each call."""
+        self._check_circuit()
+        try:
+            for attempt in range(1, RETRY_ATTEMPTS + 1):
+                try:
+                    result = await (self._hedged_async(make_call) if hedge else self._timed_async(make_call))
+                except Exception as e:
+                    delay = backoff_delay(attempt)
+                    if not self._should_retry(e, attempt, delay, time_left):
+                        raise
+                    await asyncio.sleep(delay)
+                else:
+                    self.breaker.record_success()
+                    return result
+        except Exception:
+            raise
+        except BaseException:
+            # Cancelled mid-call (client gone, deadline): no outcome to record,
+            # but a half-open probe must not keep the circuit shut for good
+            self.breaker.release_probe()
+            raise
+
+    def _check_circuit(self):
+        if not self.breaker.allow():
+            metrics.increment(f"{self.name}.circuit.rejected")
+            raise CircuitOpenError(f"{self.name} is temporarily unavailable (circuit open)")
+
+    def _should_retry(self, error, attempt, delay=0.0, time_left=None):
+        if not is_retryable(error):
+            # The provider answered (bad request, invalid key, ...): it is up
+            self.breaker.record_success()
+            return False
+        self.breaker.record_failure()
+        metrics.increment(f"{self.name}.failures")
+        if attempt >= RETRY_ATTEMPTS or not self.breaker.allow():
+            return False
+        if time_left is not None and time_left() < delay:
+            print(f"--- {self.name} call failed ({error}); no time left for a retry before the request deadline ---")
+            metrics.increment(f"{self.name}.retries_skipped")
+            return False
+        print(f"--- {self.name} call failed ({error}); retry {attempt} of {RETRY_ATTEMPTS - 1} ---")
+        metrics.increment(f"{self.name}.retries")
+        return True
+
+    def _timed(self, fn):
+        start = time.monotonic()
+        result = fn()
+        self.latency.record(time.monotonic() - start)
+        return result
+
+    async def _timed_async(self, make_call):
+        start = time.monotonic()
+        result = await make_call()
+        self.latency.record(time.monotonic() - start)
+        return result
+
+    def _hedged(self, fn):
+        delay = self.hedge_delay()
+        if delay is None:
+            return self._timed(fn)
+
+        first = _hedge_pool.submit(self._timed, fn)
+        try:
+            return first.result(timeout=delay)
+        except FutureTimeout:
+            pass
+        metrics.increment(f"{self.name}.hedged")
+        second = _hedge_pool.submit(self._timed, fn)
+
+        error = None
+        for future in as_completed([first, second]):
+            try:
+                result = future.result()
+            except Exception as e:
+                error = e
+                continue
+            if future is second:
+                metrics.increment(f"{self.name}.hedge_won")
+            return result
+        raise error
+
+    async def _hedged_async(self, make_call):
+        delay = self.hedge_delay()
+        if delay is None:
+            return await self._timed_async(make_call)
+
+        first = asyncio.ensure_future(self._timed_async(make_call))
+        done, _ = await asyncio.wait({first}, timeout=delay)
+        if done:
+            return first.result()
+        metrics.increment(f"{self.name}.hedged")
+        second = asyncio.ensure_future(self._timed_async(make_call))
+
+        pending = {first, second}
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    if task is second:
+                        metrics.increment(f"{self.name}.hedge_won")
+                    return task.result()
+                error = task.exception()
+        raise error
+
+    def stats(self):
+        p95 = self.latency.percentile(0.95)
+        return dict(self.breaker.stats(),
+                    latencyP95=None if p95 is None else round(p95, 3),
+                    hedgeDelay=self.hedge_delay())
+
+    def reset(self):
+        self.breaker.reset()
+        self.latency.reset()
+
+
+# Process-wide wrapper for all Gemini generate_content calls
+gemini = ResilientCaller("gemini")
@@ -0,0 +1,206 @@
+# revisions.py - Recognizes revised uploads of a document and splits documents into reusable sections
+
+import difflib
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import analysis_cache
+import prompt_builder
+
+# Set INCREMENTAL_ANALYSIS=0 to always analyze signed-in users' documents whole
+INCREMENTAL_ANALYSIS = os.getenv("INCREMENTAL_ANALYSIS", "1") != "0"
+
+# Shorter documents are cheap to analyze whole and are never split into sections
+INCREMENTAL_MIN_TOKENS = int(os.getenv("INCREMENTAL_MIN_TOKENS", "2000"))
+
+# Section sizes in estimated tokens: boundaries fall after ~TARGET on average,
+# never before MIN, always before MAX
+SECTION_TARGET_TOKENS = int(os.getenv("INCREMENTAL_SECTION_TOKENS", "1200"))
+SECTION_MIN_TOKENS = SECTION_TARGET_TOKENS // 3
+SECTION_MAX_TOKENS = SECTION_TARGET_TOKENS * 3
+
+# An upload is a revision of an earlier one when they share at least this share of clauses
+REVISION_MIN_SHARED = 0.5
+
+# Earlier documents per user compared against a new upload
+REVISION_HISTORY = 5
+
+# A line ending like this ends a clause; other lines are wrapped text that continues
+_CLAUSE_END = re.compile(r"[.;:!?)\]]\s*$")
+# A line starting like this begins a new clause ("12.", "(b)", "iv)", "Clause 4", "- ")
+_CLAUSE_START = re.compile(r"^\s*(?:\(?\d{1,3}[.)]|\(?[a-z]{1,4}\)|clause\s+\d|article\s+\d|[-*•]\s)", re.IGNORECASE)
+
+
+def split_clauses(text):
+    """
+    (start, end) spans of the clauses of `text`: lines, with wrapped lines (no
+    closing punctuation, next line not numbered) joined to the line they
+    continue. Blank lines and page breaks always end a clause.
+    """
+    spans = []
+    clause_start = None
+    position = 0
+    lines = text.splitlines(keepends=True)
+    for index, line in enumerate(lines):
+        start, end = position, position + len(line)
+        position = end
+        content = line.strip()
+        if not content:
+            if clause_start is not None:
+                spans.append((clause_start, start))
+                clause_start = None
+            continue
+        if clause_start is not None and (line.startswith("\f") or _CLAUSE_START.match(line)):
+            spans.append((clause_start, start))
+            clause_start = None
+        if clause_start is None:
+            clause_start = start
+        following = lines[index + 1] if index + 1 < len(lines) else ""
+        if _CLAUSE_END.search(content) or not following.strip() or _CLAUSE_START.match(following):
+            spans.append((clause_start, end))
+            clause_start = None
+    if clause_start is not None:
+        spans.append((clause_start, len(text)))
+    return spans
+
+
+def clause_fingerprint(clause):
+    """64-bit hash of a clause, insensitive to case, whitespace and line wrapping."""
+    normalized = analysis_cache.normalize_text(clause).lower()
+    return int.from_bytes(hashlib.blake2b(normalized.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def split_sections(text, clauses=None):
+    """
+    Groups the clauses into sections of about SECTION_TARGET_TOKENS. Whether a
+    section ends after a clause depends on that clause's fingerprint (and its
+    size), not on its position, the way rsync and backup tools cut content-
+    defined chunks: inserting or editing a clause only changes the section it
+    lands in, and the sections around it keep their exact text.
+    Returns (start, end) spans covering the whole text.
+    """
+    clauses = split_clauses(text) if clauses is None else clauses
+    if not clauses:
+        return [(0, len(text))]
+
+    sections = []
+    section_start = 0
+    section_tokens = 0
+    for index, (start, end) in enumerate(clauses):
+        tokens = prompt_builder.estimate_tokens(text[start:end])
+        section_tokens += tokens
+        is_last = index == len(clauses) - 1
+        if is_last:
+            break
+        next_tokens = prompt_builder.estimate_tokens(text[clauses[index + 1][0]:clauses[index + 1][1]])
+        # Cut here with probability ~ tokens / target, decided by the clause's content
+        content_cut = clause_fingerprint(text[start:end]) % 10_000 < 10_000 * tokens / SECTION_TARGET_TOKENS
+        if (content_cut and section_tokens >= SECTION_MIN_TOKENS) or section_tokens + next_tokens > SECTION_MAX_TOKENS:
+            cut = clauses[index + 1][0]
+            sections.append((section_start, cut))
+            section_start = cut
+            section_tokens = 0
+    sections.append((section_start, len(text)))
+    return sections
+
+
+def diff_clauses(old_fingerprints, new_fingerprints):
+    """Aligns two clause lists by fingerprint; returns counts of unchanged, changed, added and removed clauses."""
+    counts = {"unchanged": 0, "changed": 0, "added": 0, "removed": 0}
+    matcher = difflib.SequenceMatcher(None, old_fingerprints, new_fingerprints, autojunk=False)
+    for tag, old_start, old_end, new_start, new_end in matcher.get_opcodes():
+        if tag == "equal":
+            counts["unchanged"] += new_end - new_start
+        elif tag == "replace":
+            changed = min(old_end - old_start, new_end - new_start)
+            counts["changed"] += changed
+            counts["added"] += (new_end - new_start) - changed
+            counts["removed"] += (old_end - old_start) - changed
+        elif tag == "insert":
+            counts["added"] += new_end - new_start
+        else:
+            counts["removed"] += old_end - old_start
+    return counts
+
+
+def owner_key(email):
+    """Pseudonymous per-user key, so neither store keeps the e-mail address itself."""
+    return hashlib.sha256((email or "").strip().lower().encode("utf-8")).hexdigest()[:32]
+
+
+def applies(text, owner):
+    """Whether `text` uploaded by `owner` is analyzed in reusable sections."""
+    return (INCREMENTAL_ANALYSIS and analysis_cache.CACHE_ENABLED and bool(owner)
+            and prompt_builder.estimate_tokens(text) >= INCREMENTAL_MIN_TOKENS)
+
+
+class RevisionStore:
+    """
+    The clause fingerprints of each user's recent documents, in the analysis
+    cache's SQLite file, to recognize a new upload as a revision of one of them.
+    """
+
+    def __init__(self, path=analysis_cache.CACHE_DB_PATH, history=REVISION_HISTORY):
+        self.path = path
+        self.history = history
+        self._local = threading.local()
+        self.available = True
+        try:
+            self._connect().execute(
+                "CREATE TABLE IF NOT EXISTS document_revisions ("
+                "owner TEXT NOT NULL, document_key TEXT NOT NULL, fingerprints TEXT NOT NULL, "
+                "stored_at REAL NOT NULL, PRIMARY KEY (owner, document_key))")
+        except (sqlite3.Error, OSError) as e:
+            print(f"--- WARNING: Revision tracking disabled at {path}: {e} ---")
+            self.available = False
+
+    def _connect(self):
+        return analysis_cache.connect(self._local, self.path)
+
+    def find_previous(self, owner, document_key, fingerprints):
+        """The closest earlier document of `owner`: (document key, shared clause share, diff) or None."""
+        if not self.available:
+            return None
+        try:
+            rows = self._connect().execute(
+                "SELECT document_key, fingerprints FROM document_revisions WHERE owner = ? AND document_key != ? "
+                "ORDER BY stored_at DESC LIMIT ?", (owner, document_key, self.history)).fetchall()
+        except sqlite3.Error as e:
+            print(f"--- WARNING: Revision lookup failed: {e} ---")
+            return None
+
+        best = None
+        for previous_key, encoded in rows:
+            previous = json.loads(encoded)
+            diff = diff_clauses(previous, fingerprints)
+            shared = diff["unchanged"] / max(1, len(fingerprints))
+            if shared >= REVISION_MIN_SHARED and (best is None or shared > best[1]):
+                best = (previous_key, round(shared, 3), diff)
+        return best
+
+    def record(self, owner, document_key, fingerprints):
+        if not self.available:
+            return
+        try:
+            db = self._connect()
+            db.execute("INSERT OR REPLACE INTO document_revisions VALUES (?, ?, ?, ?)",
+                       (owner, document_key, json.dumps(fingerprints), time.time()))
+            # Keep only the most recent documents per user
+            db.execute("DELETE FROM document_revisions WHERE owner = ? AND document_key NOT IN ("
+                       "SELECT document_key FROM document_revisions WHERE owner = ? ORDER BY stored_at DESC LIMIT ?)",
+                       (owner, owner, self.history))
+        except sqlite3.Error as e:
+            print(f"--- WARNING: Could not record document revision: {e} ---")
+
+
+_store = None
+
+
+def get_store():
+    """The process-wide revision store, created on first use."""
+    return analysis_cache.process_singleton(globals(), "_store", RevisionStore)
@@ -0,0 +1,156 @@
+# rule_batch.py - Rule-based scoring for many documents at once (archive rescoring)
+
+import bisect
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import rule_packs
+
+# NumPy is optional; without it the same scores are computed with plain Python
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+# Below this many documents a process pool costs more than it saves
+PROCESS_POOL_MIN_DOCS = 2000
+
+# Documents sent to a worker process per task
+BATCH_CHUNK_SIZE = 1000
+
+# Joins documents for scanning. A page break ends clauses, phrases and proximity
+# windows, and stops negation look-back, so no rule can join two documents.
+DOCUMENT_SEPARATOR = "\n\f\n"
+
+
+def build_hit_matrix(texts, ruleset, rule_columns):
+    """
+    Scans the texts and returns a sparse document x rule hit matrix in CSR form:
+    row i's hits are indices[indptr[i]:indptr[i + 1]] (rule columns) with the
+    matching occurrence counts.
+
+    The texts are joined with a separator and scanned as one string, so the
+    per-call overhead of the matchers is paid once per batch instead of once
+    per (usually short) document. Hits are mapped back to rows by offset.
+    """
+    starts = []
+    position = 0
+    for text in texts:
+        starts.append(position)
+        position += len(text) + len(DOCUMENT_SEPARATOR)
+    joined = DOCUMENT_SEPARATOR.join(texts)
+
+    rows = [{} for _ in texts]
+    row = 0
+    for start, end, rule in ruleset.finditer(joined):
+        if row + 1 < len(starts) and start >= starts[row + 1]:
+            row = bisect.bisect_right(starts, start) - 1
+        if end > starts[row] + len(texts[row]):
+            # A loose user regex (e.g. \s+) ran across the separator into the next document
+            continue
+        column = rule_columns[rule]
+        rows[row][column] = rows[row].get(column, 0) + 1
+
+    indptr = [0]
+    indices = []
+    counts = []
+    for hits in rows:
+        for column in sorted(hits):
+            indices.append(column)
+            counts.append(hits[column])
+        indptr.append(len(indices))
+    return indptr, indices, counts
+
+
+def score_hit_matrix(indptr, indices, rule_scores):
+    """
+    Preliminary score per document: the mean score of the distinct rules it hit
+    (0 when nothing matched), truncated to int like analyze_text_with_rules.
+    """
+    document_count = len(indptr) - 1
+    if NUMPY_AVAILABLE:
+        indptr = np.asarray(indptr, dtype=np.int64)
+        row_lengths = np.diff(indptr)
+        rows = np.repeat(np.arange(document_count), row_lengths)
+        hit_scores = np.asarray(rule_scores, dtype=np.float64)[np.asarray(indices, dtype=np.int64)]
+        totals = np.bincount(rows, weights=hit_scores, minlength=document_count)
+        means = np.divide(totals, row_lengths, out=np.zeros(document_count), where=row_lengths > 0)
+        return means.astype(np.int64).tolist()
+
+    scores = []
+    for row in range(document_count):
+        columns = indices[indptr[row]:indptr[row + 1]]
+        scores.append(int(sum(rule_scores[c] for c in columns) / len(columns)) if columns else 0)
+    return scores
+
+
+def _scan_chunk(args):
+    """Process-pool task: scan one chunk of texts with the worker's own rule set."""
+    texts, state, document_type = args
+    ruleset = rule_packs.registry.get(state, document_type)
+    rule_columns = {rule: column for column, rule in enumerate(ruleset.scores)}
+    return ruleset.fingerprint, build_hit_matrix(texts, ruleset, rule_columns)
+
+
+def analyze_texts_with_rules_batch(texts, state="", document_type=None, processes=None):
+    """
+    Rule-based analysis of many documents at once.
+
+    Returns the sparse hit matrix, the rule that each matrix column stands for,
+    a preliminary score per document and a per-document found_issues list in
+    the same shape as analyze_text_with_rules (without the per-hit clause index).
+    Large batches are split across a process pool; pass processes=1 to stay in
+    this process.
+    """
+    texts = list(texts)
+    ruleset = rule_packs.registry.get(state, document_type)
+    rule_ids = list(ruleset.scores)
+    rule_scores = [ruleset.scores[rule] for rule in rule_ids]
+    rule_columns = {rule: column for column, rule in enumerate(rule_ids)}
+
+    if processes is None:
+        processes = os.cpu_count() or 1
+    if processes > 1 and len(texts) >= PROCESS_POOL_MIN_DOCS:
+        chunks = [(texts[i:i + BATCH_CHUNK_SIZE], state, document_type)
+                  for i in range(0, len(texts), BATCH_CHUNK_SIZE)]
+        indptr, indices, counts = [0], [], []
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            for fingerprint, (chunk_indptr, chunk_indices, chunk_counts) in pool.map(_scan_chunk, chunks):
+                if fingerprint != ruleset.fingerprint:
+                    # A pack was edited mid-batch; never mix columns from two rule sets
+                    raise RuntimeError("Rule packs changed during batch scoring; please retry")
+                offset = len(indices)
+                indptr.extend(offset + position for position in chunk_indptr[1:])
+                indices.extend(chunk_indices)
+                counts.extend(chunk_counts)
+    else:
+        indptr, indices, counts = [0], [], []
+        for i in range(0, len(texts), BATCH_CHUNK_SIZE):
+            chunk_indptr, chunk_indices, chunk_counts = build_hit_matrix(
+                texts[i:i + BATCH_CHUNK_SIZE], ruleset, rule_columns)
+            offset = len(indices)
+            indptr.extend(offset + position for position in chunk_indptr[1:])
+            indices.extend(chunk_indices)
+            counts.extend(chunk_counts)
+
+    scores = score_hit_matrix(indptr, indices, rule_scores)
+
+    results = []
+    for row, score in enumerate(scores):
+        start, end = indptr[row], indptr[row + 1]
+        # Columns follow pack order, so found_issues keep analyze_text_with_rules' order
+        found_issues = []
+        for column, count in zip(indices[start:end], counts[start:end]):
+            issue = {"phrase": rule_ids[column], "score": rule_scores[column], "count": count}
+            if rule_ids[column] in ruleset.patterns:
+                issue["title"] = ruleset.patterns[rule_ids[column]].get("title", rule_ids[column])
+            found_issues.append(issue)
+        results.append({"found_issues": found_issues, "preliminary_score": score})
+
+    return {
+        "results": results,
+        "rule_ids": rule_ids,
+        "hit_matrix": {"indptr": indptr, "indices": indices, "counts": counts},
+        "rule_pack_versions": ruleset.versions,
+    }
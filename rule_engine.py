@@ -0,0 +1,439 @@
+# rule_engine.py - Compiled matcher for the rule-based pre-analysis in ai.py
+
+import heapq
+import re
+
+# Text is lower-cased and scanned one block at a time, so we never hold a second
+# lower-cased copy of a whole (possibly 100 MB OCR) document in memory.
+SCAN_BLOCK_SIZE = 256 * 1024
+
+# Below this many phrases, one C-level str.find() pass per phrase beats walking the
+# trie regex (measured with benchmarks/bench_rule_matcher.py on 1 MB documents).
+TRIE_MIN_PHRASES = 256
+
+
+class PhraseMatcher:
+    """
+    Finds every occurrence of a fixed set of phrases in a single pass over the text.
+
+    The phrases are compiled once into a trie, and the trie is rendered as one
+    regular expression (shared prefixes are merged, longer continuations are tried
+    first). Scanning is then done by the C regex engine instead of one Python
+    substring search per phrase, so the cost grows with the size of the document
+    rather than with rules x document size. Small tables such as
+    rules/universal.json (33 phrases) are cheaper to scan with str.find(), so
+    they skip the trie.
+    """
+
+    def __init__(self, phrases):
+        # Phrases are matched case-insensitively, so they are stored lower-cased
+        self.phrases = sorted({phrase.lower() for phrase in phrases if phrase})
+        self.max_phrase_length = max((len(p) for p in self.phrases), default=0)
+        self.use_trie = len(self.phrases) >= TRIE_MIN_PHRASES
+
+        trie = {}
+        for phrase in self.phrases:
+            node = trie
+            for char in phrase:
+                node = node.setdefault(char, {})
+            node[''] = True
+
+        # The regex returns the longest phrase starting at a position. Every other
+        # phrase starting at the same position is a prefix of it, so we precompute
+        # those "prefix outputs" once instead of rescanning.
+        self._outputs = {}
+        for phrase in self.phrases:
+            node = trie
+            found = []
+            for i, char in enumerate(phrase):
+                node = node[char]
+                if '' in node:
+                    found.append(phrase[:i + 1])
+            self._outputs[phrase] = found
+
+        self._regex = _trie_to_regex(trie) if self.phrases else None
+        self._pattern = re.compile('(' + self._regex + ')') if self._regex else None
+        self._ignorecase_pattern = None
+
+    def finditer(self, text, pos=0, endpos=None):
+        """
+        Yields (start, end, phrase) for every phrase occurrence in text[pos:endpos],
+        including overlapping ones, in order of start offset.
+        """
+        if not self.phrases:
+            return
+        if endpos is None:
+            endpos = len(text)
+        overlap = self.max_phrase_length - 1
+
+        for block_start in range(pos, endpos, SCAN_BLOCK_SIZE):
+            block_end = min(block_start + SCAN_BLOCK_SIZE, endpos)
+            # Read past the block so phrases crossing the boundary are still seen;
+            # only matches *starting* inside the block are reported here.
+            window = text[block_start:min(block_end + overlap, endpos)]
+            for start, end, phrase in self._scan_window(window, block_end - block_start):
+                yield block_start + start, block_start + end, phrase
+
+    def find_all(self, text):
+        """Returns the set of distinct phrases that occur in the text."""
+        return {phrase for _, _, phrase in self.finditer(text)}
+
+    def _scan_window(self, window, limit):
+        """Scans one window, reporting matches that start before `limit`."""
+        lowered = window.lower()
+        if len(lowered) != len(window):
+            # A few Unicode characters change length when lower-cased, which would
+            # shift every offset after them; match case-insensitively instead.
+            yield from self._scan_trie(self._get_ignorecase_pattern(), window, limit)
+        elif self.use_trie:
+            yield from self._scan_trie(self._pattern, lowered, limit)
+        else:
+            hits = []
+            for phrase in self.phrases:
+                index = lowered.find(phrase)
+                while index != -1 and index < limit:
+                    hits.append((index, index + len(phrase), phrase))
+                    index = lowered.find(phrase, index + 1)
+            hits.sort()
+            yield from hits
+
+    def _scan_trie(self, pattern, window, limit):
+        outputs = self._outputs
+        match = pattern.search(window)
+        while match and match.start() < limit:
+            start = match.start()
+            for phrase in outputs.get(match.group(1).lower(), ()):
+                yield start, start + len(phrase), phrase
+            # Phrases may start inside the one we just matched, so resume at start + 1
+            match = pattern.search(window, start + 1)
+
+    def _get_ignorecase_pattern(self):
+        if self._ignorecase_pattern is None:
+            self._ignorecase_pattern = re.compile('(' + self._regex + ')', re.IGNORECASE)
+        return self._ignorecase_pattern
+
+
+def _trie_to_regex(node):
+    """Renders a trie node as a regex, preferring the longest continuation."""
+    branches = [re.escape(char) + _trie_to_regex(child)
+                for char, child in sorted(node.items()) if char]
+    if not branches:
+        return ''
+
+    body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+    if '' in node:
+        # This node already completes a phrase; the continuation is optional (greedy)
+        body = '(?:' + body + ')?'
+    return body
+
+
+# --- Pattern rules (regex, word proximity) ---
+
+# Longest stretch of text a single pattern rule is expected to span
+MAX_PATTERN_SPAN = 200
+
+
+class PatternMatcher:
+    """
+    Scans for many pattern rules at once.
+
+    Each rule is a dict with an "id" and either a "regex", or a "near" list of
+    word regexes that must appear in order within "within" words of each other.
+
+    Python's regex engine has no DFA, so a plain alternation of every rule is
+    retried rule by rule at every character. Instead each rule's leading literal
+    (or its explicit "anchors" list) is put into one PhraseMatcher, the text is
+    scanned once for anchors, and a rule's regex only runs where its anchor
+    occurs. Rules without an anchor share one combined fallback regex.
+    """
+
+    def __init__(self, rules):
+        self.rules = list(rules)
+        self._compiled = {}
+        self._anchor_rules = {}
+        fallback = []
+        for rule in self.rules:
+            regex = pattern_rule_regex(rule)
+            self._compiled[rule['id']] = re.compile(regex, re.IGNORECASE)
+            anchors = rule.get('anchors') or _literal_anchors(rule)
+            if anchors:
+                for anchor in anchors:
+                    self._anchor_rules.setdefault(anchor.lower(), []).append(rule['id'])
+            else:
+                fallback.append((rule['id'], regex))
+
+        self._anchors = PhraseMatcher(self._anchor_rules)
+
+        # Wrapped in a lookahead so rules that start inside another rule's match
+        # are still found when the scan resumes at the next character.
+        self._group_to_id = {f"r{number}": rule_id for number, (rule_id, _) in enumerate(fallback)}
+        alternatives = [f"(?P<r{number}>{regex})" for number, (_, regex) in enumerate(fallback)]
+        self._fallback = re.compile('(?=' + '|'.join(alternatives) + ')', re.IGNORECASE) if alternatives else None
+
+    def finditer(self, text, pos=0, endpos=None):
+        """Yields (start, end, rule_id) for each pattern rule match, in start order."""
+        if endpos is None:
+            endpos = len(text)
+        last_end = {}
+        matches = heapq.merge(self._anchored_matches(text, pos, endpos),
+                              self._fallback_matches(text, pos, endpos))
+        for start, end, rule_id in matches:
+            # A rule can match again one word later inside its own match; keep the first
+            if start >= last_end.get(rule_id, -1):
+                last_end[rule_id] = end
+                yield start, end, rule_id
+
+    def _anchored_matches(self, text, pos, endpos):
+        for start, _, anchor in self._anchors.finditer(text, pos, endpos):
+            found = []
+            for rule_id in self._anchor_rules[anchor]:
+                match = self._compiled[rule_id].match(text, start, endpos)
+                if match:
+                    found.append((start, match.end(), rule_id))
+            yield from sorted(found)
+
+    def _fallback_matches(self, text, pos, endpos):
+        if self._fallback is None:
+            return
+        search = self._fallback.search
+        match = search(text, pos, endpos)
+        while match:
+            group = match.lastgroup
+            start, end = match.span(group)
+            yield start, end, self._group_to_id[group]
+            match = search(text, start + 1, endpos)
+
+
+def _literal_anchors(rule):
+    r"""
+    Works out the literal text a rule must start with, e.g. "waive" for
+    r"\bwaive[sd]?\s+..." or "deposit" for {"near": ["deposit", ...]}.
+    Returns [] when the rule does not start with a usable literal.
+    """
+    if 'near' in rule:
+        source = rule['near'][0]
+        if re.fullmatch(r"[\w' -]+", source):
+            return [source]
+        return []
+
+    source = rule.get('regex', '')
+    if _has_top_level_alternation(source):
+        # "late fee|penalty charge": no literal starts every match
+        return []
+    if source.startswith(r'\b'):
+        source = source[2:]
+    literal = re.match(r"[A-Za-z0-9' -]*", source).group(0)
+    rest = source[len(literal):]
+    if rest[:1] in ('?', '*', '{') and literal:
+        # The last character is optional ("waives?"), so it is not part of the anchor
+        literal = literal[:-1]
+    literal = literal.rstrip()
+    return [literal] if len(literal) >= 3 else []
+
+
+def _has_top_level_alternation(source):
+    """True when `source` has a "|" outside any group or character class."""
+    depth = 0
+    in_class = False
+    index = 0
+    while index < len(source):
+        char = source[index]
+        if char == '\\':
+            index += 2
+            continue
+        if in_class:
+            in_class = char != ']'
+        elif char == '[':
+            in_class = True
+            # A "]" right after "[" or "[^" is a literal member of the class
+            if source[index + 1:index + 2] == '^':
+                index += 1
+            if source[index + 1:index + 2] == ']':
+                index += 1
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == '|' and depth == 0:
+            return True
+        index += 1
+    return False
+
+
+def pattern_rule_regex(rule):
+    """Turns one pattern rule into a regex string."""
+    if 'regex' in rule:
+        return rule['regex']
+    if 'near' in rule:
+        within = int(rule.get('within', 5))
+        # Words in between may be separated by anything except sentence punctuation,
+        # so a proximity rule never joins two different clauses
+        separator = r"[^\w.;!?\n\f]+"
+        gap = rf"{separator}(?:\w+{separator}){{0,{within}}}?"
+        return r'\b' + gap.join(f"(?:{term})" for term in rule['near']) + r'\b'
+    raise ValueError(f"Pattern rule {rule.get('id')!r} needs a 'regex' or 'near' list")
+
+
+# --- Negation windows ---
+
+# How far back (per word of the negation window) to look for a negation term
+NEGATION_CHARS_PER_WORD = 20
+
+# Words that end the scope of a negation ("no pets, but late fees apply")
+_NEGATION_SCOPE_BREAKS = {'but', 'however', 'except', 'although', 'unless', 'otherwise'}
+_CLAUSE_PUNCTUATION = re.compile(r"[.;:!?,\n\f]")
+_WORD = re.compile(r"[\w'’]+")
+
+
+def is_negated(text, start, terms, window=3, end=None, own_terms=()):
+    """
+    True when one of the negation terms appears within `window` words before
+    `start`, in the same clause (e.g. "no late fees", "we do not sell your data").
+    When `end` is given, negation inside the match itself also counts
+    ("rent will not be increased at any time"), except for `own_terms`: the
+    rule's own words, such as "without" in "increased without notice".
+    """
+    if end is not None and any(word.lower() in terms and word.lower() not in own_terms
+                               for word in _WORD.findall(text, start, end)):
+        return True
+
+    preceding = text[max(0, start - NEGATION_CHARS_PER_WORD * window):start]
+    breaks = list(_CLAUSE_PUNCTUATION.finditer(preceding))
+    if breaks:
+        preceding = preceding[breaks[-1].end():]
+
+    words = [word.lower() for word in _WORD.findall(preceding)]
+    for index in range(len(words) - 1, -1, -1):
+        if words[index] in _NEGATION_SCOPE_BREAKS:
+            words = words[index + 1:]
+            break
+    return any(word in terms for word in words[-window:])
+
+
+def own_negation_terms(source, terms):
+    r"""The negation terms that are words of a rule's own phrase or regex ("without" in r"without\s+notice")."""
+    words = _WORD.findall(re.sub(r"\\[A-Za-z]", " ", source.lower()))
+    return frozenset(word for word in words if word in terms)
+
+
+# --- Hit index (offsets, line/page numbers and the surrounding clause) ---
+
+# PDF extraction separates pages with a form feed so hits can be mapped to pages
+PAGE_BREAK = '\f'
+
+# How far to look either side of a hit for the edges of its clause
+MAX_CLAUSE_CHARS = 300
+
+# Only the first few occurrences of a phrase are indexed; the count covers all of them
+MAX_HITS_PER_PHRASE = 25
+
+_CLAUSE_BREAKS = ('\n', PAGE_BREAK, '. ', '; ', '? ', '! ')
+
+
+def clause_bounds(text, start, end):
+    """Returns the (start, end) offsets of the sentence/line containing text[start:end]."""
+    window_start = max(0, start - MAX_CLAUSE_CHARS)
+    clause_start = window_start
+    for separator in _CLAUSE_BREAKS:
+        index = text.rfind(separator, window_start, start)
+        if index != -1:
+            clause_start = max(clause_start, index + len(separator))
+
+    window_end = min(len(text), end + MAX_CLAUSE_CHARS)
+    clause_end = window_end
+    for separator in _CLAUSE_BREAKS:
+        index = text.find(separator, end, window_end)
+        if index != -1:
+            # Keep the sentence's own punctuation, drop the whitespace after it
+            clause_end = min(clause_end, index + len(separator.rstrip()))
+
+    return clause_start, clause_end
+
+
+class HitIndexer:
+    """
+    Builds {phrase: {"count": n, "hits": [...]}} from matches fed in start order.
+
+    Line and page numbers are counted incrementally between consecutive hits, so
+    the work is proportional to the distance already scanned, not a second pass.
+    Matches can come from a sliding window over a stream: `offset` is where the
+    window starts in the whole document, and hits are reported in document offsets.
+    """
+
+    def __init__(self, max_per_phrase=MAX_HITS_PER_PHRASE):
+        self.index = {}
+        self.max_per_phrase = max_per_phrase
+        self.line = 1
+        self.page = 1
+        self._counted_to = 0
+
+    def advance(self, window, offset, position):
+        """Counts line and page breaks up to window-relative `position`."""
+        counted_from = self._counted_to - offset
+        if position > counted_from:
+            self.line += window.count('\n', counted_from, position)
+            self.page += window.count(PAGE_BREAK, counted_from, position)
+            self._counted_to = offset + position
+
+    def add(self, window, offset, start, end, phrase):
+        self.advance(window, offset, start)
+        entry = self.index.setdefault(phrase, {"count": 0, "hits": []})
+        entry["count"] += 1
+        if len(entry["hits"]) < self.max_per_phrase:
+            clause_start, clause_end = clause_bounds(window, start, end)
+            entry["hits"].append({
+                "start": offset + start,
+                "end": offset + end,
+                "line": self.line,
+                "page": self.page,
+                "text": window[start:end],
+                "clause": window[clause_start:clause_end].strip(),
+            })
+
+
+def index_hits(text, matches, max_per_phrase=MAX_HITS_PER_PHRASE):
+    """
+    Consumes (start, end, phrase) matches in start order and returns
+    {phrase: {"count": n, "hits": [...]}} with the location of each hit.
+    """
+    indexer = HitIndexer(max_per_phrase)
+    for start, end, phrase in matches:
+        indexer.add(text, 0, start, end, phrase)
+    return indexer.index
+
+
+# --- Streaming over chunked text ---
+
+def scan_chunks(chunks, finditer, overlap, lookback):
+    """
+    Runs `finditer(window, pos)` over a stream of text chunks without ever
+    joining them. Yields (window, offset, matches, done) per chunk, where
+    `offset` is the window's position in the whole document and `matches` are
+    window-relative (start, end, rule) tuples starting before `done`.
+
+    Each window is the tail of the previous one plus the next chunk:
+    - `overlap` characters at the end of a window are not reported yet, so a
+      match (and its clause) crossing the chunk boundary is seen whole next time;
+    - `lookback` characters before that are carried as context for negation
+      and clause detection.
+    Memory is bounded by chunk size + overlap + lookback, not document size.
+    """
+    window = ''
+    offset = 0
+    scan_from = 0
+    for chunk in chunks:
+        if not chunk:
+            continue
+        window += chunk
+        done = len(window) - overlap
+        if done <= scan_from:
+            # Not enough new text past the overlap yet; keep accumulating
+            continue
+        yield window, offset, [m for m in finditer(window, scan_from) if m[0] < done], done
+
+        keep_from = max(0, done - lookback)
+        window = window[keep_from:]
+        offset += keep_from
+        scan_from = done - keep_from
+
+    yield window, offset, list(finditer(window, scan_from)), len(window)
@@ -0,0 +1,277 @@
+# rule_packs.py - Loads versioned rule packs from disk for the rule-based pre-analysis
+
+import hashlib
+import heapq
+import json
+import os
+import pickle
+import re
+import tempfile
+import threading
+import time
+
+import analysis_cache
+import rule_engine
+from rule_engine import (MAX_CLAUSE_CHARS, MAX_PATTERN_SPAN, NEGATION_CHARS_PER_WORD,
+                         PatternMatcher, PhraseMatcher, is_negated, own_negation_terms, pattern_rule_regex)
+
+# YAML rule packs are optional; JSON packs always work
+try:
+    import yaml
+    YAML_AVAILABLE = True
+except ImportError:
+    YAML_AVAILABLE = False
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Layout:  rules/universal.json
+#          rules/document_types/<type>.json   (e.g. lease, privacy_policy)
+#          rules/states/<state>.json          (e.g. maharashtra, tamil_nadu)
+RULES_DIR = os.getenv("RULE_PACKS_DIR", os.path.join(BASE_DIR, 'rules'))
+
+# Compiled matchers are pickled here, keyed by a hash of the pack contents, so a
+# cold worker loads the artifact instead of rebuilding the matcher. Unpickling
+# runs code, so the directory must be private to this user (analysis_cache.private_dir).
+RULE_CACHE_DIR = os.getenv("RULE_CACHE_DIR", os.path.join(analysis_cache.DATA_DIR, 'rule_cache'))
+
+# How often (seconds) a worker checks the pack files for changes
+RELOAD_CHECK_INTERVAL = float(os.getenv("RULE_RELOAD_INTERVAL", "2"))
+
+# Bump when the pickled matcher format changes so old artifacts are ignored
+ARTIFACT_FORMAT = 2
+
+
+def _compiler_hash():
+    """Hash of the matcher code, so artifacts built by an older rule_engine are ignored."""
+    with open(rule_engine.__file__, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+COMPILER_HASH = _compiler_hash()
+
+PACK_EXTENSIONS = ('.json', '.yaml', '.yml')
+
+# State and document type names come from the request, so only these characters reach a file path
+_PACK_NAME = re.compile(r"[a-z0-9_]+")
+
+
+class RuleSet:
+    """The merged rules of one or more packs, plus the compiled matchers for them."""
+
+    def __init__(self, phrases, patterns, negation, matcher, pattern_matcher, versions, fingerprint):
+        self.phrases = phrases
+        self.patterns = patterns
+        self.negation = negation
+        self.matcher = matcher
+        self.pattern_matcher = pattern_matcher
+        self.versions = versions
+        self.fingerprint = fingerprint
+
+    @property
+    def scores(self):
+        """Score of every rule (phrases first, then pattern rules), in pack order."""
+        scores = dict(self.phrases)
+        for rule_id, rule in self.patterns.items():
+            scores[rule_id] = int(rule['score'])
+        return scores
+
+    @property
+    def max_match_length(self):
+        """Longest text a single rule match can span."""
+        return max(self.matcher.max_phrase_length, MAX_PATTERN_SPAN if self.patterns else 0)
+
+    @property
+    def context_chars(self):
+        """Text needed before a match to check negation and find its clause."""
+        return max(MAX_CLAUSE_CHARS, NEGATION_CHARS_PER_WORD * self.negation['window']) + 1
+
+    def finditer(self, text, pos=0):
+        """
+        Yields (start, end, rule) for phrase and pattern rule matches starting at
+        or after `pos`, in start order, skipping hits that are negated ("no late fees").
+        """
+        matches = heapq.merge(self.matcher.finditer(text, pos), self.pattern_matcher.finditer(text, pos))
+        negation = self.negation
+        for match in matches:
+            if match[2] in negation['rules'] and is_negated(text, match[0], negation['terms'], negation['window'],
+                                                            match[1], negation['own_terms'][match[2]]):
+                continue
+            yield match
+
+
+def normalize_name(name):
+    """'Tamil Nadu' -> 'tamil_nadu', matching the pack file names; '' for a name no pack can have ('../x')."""
+    normalized = '_'.join((name or '').strip().lower().replace('-', ' ').split())
+    return normalized if _PACK_NAME.fullmatch(normalized) else ''
+
+
+def find_pack_files(state="", document_type=None):
+    """Returns the pack files that apply, in merge order (later packs win)."""
+    candidates = [os.path.join(RULES_DIR, 'universal')]
+    if normalize_name(document_type):
+        candidates.append(os.path.join(RULES_DIR, 'document_types', normalize_name(document_type)))
+    if normalize_name(state):
+        candidates.append(os.path.join(RULES_DIR, 'states', normalize_name(state)))
+
+    files = []
+    for stem in candidates:
+        for extension in PACK_EXTENSIONS:
+            path = stem + extension
+            if os.path.exists(path):
+                files.append(path)
+                break
+    return files
+
+
+def load_pack(path, raw=None):
+    """Reads one pack file and validates its shape."""
+    if raw is None:
+        with open(path, 'rb') as f:
+            raw = f.read()
+
+    if path.endswith('.json'):
+        pack = json.loads(raw.decode('utf-8'))
+    elif YAML_AVAILABLE:
+        pack = yaml.safe_load(raw.decode('utf-8'))
+    else:
+        raise ValueError(f"Cannot load {path}: PyYAML is not installed")
+
+    if not isinstance(pack, dict) or not isinstance(pack.get('phrases', {}), dict):
+        raise ValueError(f"Rule pack {path} must be a mapping with a 'phrases' table")
+    for rule in pack.get('patterns', []):
+        if 'id' not in rule or 'score' not in rule:
+            raise ValueError(f"Pattern rules in {path} need an 'id' and a 'score'")
+
+    relative = os.path.relpath(path, RULES_DIR)
+    pack.setdefault('name', os.path.splitext(relative)[0].replace(os.sep, '/'))
+    # Packs without an explicit version are identified by their content hash
+    pack.setdefault('version', hashlib.sha256(raw).hexdigest()[:12])
+    return pack
+
+
+def build_ruleset(paths):
+    """Loads and merges the packs, reusing a cached compiled matcher when possible."""
+    raws = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            raws.append(f.read())
+
+    digest = hashlib.sha256(f"format:{ARTIFACT_FORMAT}:{COMPILER_HASH}".encode())
+    for path, raw in zip(paths, raws):
+        digest.update(os.path.relpath(path, RULES_DIR).encode() + b'\0' + raw + b'\0')
+    fingerprint = digest.hexdigest()
+
+    phrases = {}
+    patterns = {}
+    negation = {'terms': set(), 'rules': set(), 'window': 3, 'own_terms': {}}
+    versions = {}
+    for path, raw in zip(paths, raws):
+        pack = load_pack(path, raw)
+        versions[pack['name']] = str(pack['version'])
+        for phrase, score in pack.get('phrases', {}).items():
+            phrases[phrase.lower()] = int(score)
+        for rule in pack.get('patterns', []):
+            patterns[rule['id']] = rule
+            if rule.get('negatable'):
+                negation['rules'].add(rule['id'])
+        pack_negation = pack.get('negation', {})
+        negation['terms'].update(term.lower() for term in pack_negation.get('terms', []))
+        negation['rules'].update(phrase.lower() for phrase in pack_negation.get('phrases', []))
+        negation['window'] = int(pack_negation.get('window', negation['window']))
+    for rule_id in negation['rules']:
+        source = pattern_rule_regex(patterns[rule_id]) if rule_id in patterns else rule_id
+        negation['own_terms'][rule_id] = own_negation_terms(source, negation['terms'])
+
+    artifact = _load_artifact(fingerprint)
+    if artifact is None:
+        artifact = (PhraseMatcher(phrases), PatternMatcher(patterns.values()))
+        _save_artifact(fingerprint, artifact)
+    matcher, pattern_matcher = artifact
+
+    return RuleSet(phrases, patterns, negation, matcher, pattern_matcher, versions, fingerprint)
+
+
+def _artifact_path(fingerprint):
+    return os.path.join(RULE_CACHE_DIR, f"{fingerprint}.pickle")
+
+
+def _load_artifact(fingerprint):
+    try:
+        analysis_cache.private_dir(RULE_CACHE_DIR)
+        with open(_artifact_path(fingerprint), 'rb') as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"--- WARNING: Ignoring unreadable rule artifact {fingerprint[:12]}: {e} ---")
+        return None
+
+
+def _save_artifact(fingerprint, artifact):
+    try:
+        analysis_cache.private_dir(RULE_CACHE_DIR)
+        # Write to a temp file and rename so other workers never read half an artifact
+        fd, temp_path = tempfile.mkstemp(dir=RULE_CACHE_DIR, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(artifact, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, _artifact_path(fingerprint))
+    except OSError as e:
+        # A read-only filesystem (e.g. serverless) just means no artifact cache
+        print(f"--- WARNING: Could not cache compiled rules: {e} ---")
+
+
+class RulePackRegistry:
+    """
+    Keeps one compiled RuleSet per combination of pack files (so unknown
+    states share the universal one) and hot-reloads it when any of them
+    changes. A changed pack that fails to load is logged and the last good
+    rules stay in use.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def get(self, state="", document_type=None):
+        paths = tuple(find_pack_files(state, document_type))
+        now = time.monotonic()
+
+        entry = self._entries.get(paths)
+        if entry and now - entry['checked_at'] < RELOAD_CHECK_INTERVAL:
+            return entry['ruleset']
+
+        with self._lock:
+            entry = self._entries.get(paths)
+            stamps = _file_stamps(paths)
+            if entry is None or entry['stamps'] != stamps:
+                if entry is not None:
+                    print(f"--- Rule packs changed, reloading {', '.join(map(os.path.basename, paths))} ---")
+                try:
+                    ruleset = build_ruleset(paths)
+                except Exception as e:
+                    if entry is None:
+                        raise
+                    print(f"--- ERROR: Rule packs failed to load ({e}); keeping the previous rules ---")
+                    # Not retried until the files change again
+                    entry['stamps'] = stamps
+                else:
+                    entry = {'ruleset': ruleset, 'stamps': stamps}
+                    self._entries[paths] = entry
+            entry['checked_at'] = now
+            return entry['ruleset']
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def _file_stamps(paths):
+    stamps = []
+    for path in paths:
+        stat = os.stat(path)
+        stamps.append((path, stat.st_mtime_ns, stat.st_size))
+    return stamps
+
+
+# Process-wide registry used by ai.analyze_text_with_rules
+registry = RulePackRegistry()
@@ -0,0 +1,122 @@
+"""
+Content-addressed caching of Gemini results (memory LRU + shared SQLite tier).
+
+Run with:  python -m pytest test_analysis_cache.py -q
+"""
+
+import json
+import os
+import stat
+import time
+
+import pytest
+
+import ai
+import analysis_cache
+import gemini_client
+from analysis_cache import AnalysisCache, DiskCache, MemoryCache, cache_key
+from metrics import metrics
+
+REPLY = json.dumps({"overallScore": 62, "colorLabel": "ORANGE", "summary": "ok", "redFlags": [], "fairClauses": []})
+
+
+def test_key_ignores_layout_but_not_content():
+    key = cache_key("Rent  is due\non the 5th.\f", "Maharashtra", "1", "m")
+    assert key == cache_key("  Rent is due on the 5th. ", " maharashtra", "1", "m")
+    assert key != cache_key("Rent is due on the 6th.", "Maharashtra", "1", "m")
+    assert key != cache_key("Rent is due on the 5th.", "Maharashtra", "2", "m")
+    assert key != cache_key("Rent is due on the 5th.", "Maharashtra", "1", "other-model")
+
+
+def test_memory_tier_evicts_by_count_size_and_age():
+    cache = MemoryCache(max_entries=2, max_bytes=10, ttl=60)
+    cache.put("a", "1234")
+    cache.put("b", "1234")
+    cache.get("a")
+    cache.put("c", "1234")
+    assert cache.get("b") is None and cache.get("a") and cache.get("c")
+
+    cache.put("d", "12345678")
+    assert len(cache) == 1 and cache.total_bytes == 8
+
+    cache.put("old", "1", stored_at=time.time() - 120)
+    assert cache.get("old") is None
+
+
+def test_disk_tier_is_shared_between_workers(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    first = AnalysisCache(MemoryCache(), DiskCache(path))
+    second = AnalysisCache(MemoryCache(), DiskCache(path))
+
+    first.put("key", {"overallScore": 1})
+    assert second.get("key") == {"overallScore": 1}
+    # Promoted to the second worker's memory tier
+    assert second.memory.get("key") is not None
+
+
+def test_cache_file_is_private_and_stores_are_singletons(tmp_path, monkeypatch):
+    path = str(tmp_path / "data" / "cache.sqlite3")
+    DiskCache(path).put("key", "{}")
+    # The file also holds documents kept for explanations
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+    assert stat.S_IMODE(os.stat(os.path.dirname(path)).st_mode) == 0o700
+
+    namespace = {"_store": None}
+    store = analysis_cache.process_singleton(namespace, "_store", object)
+    assert namespace["_store"] is store and analysis_cache.process_singleton(namespace, "_store", object) is store
+
+
+@pytest.fixture
+def gemini(monkeypatch, tmp_path):
+    replies = []
+
+    class FakeModel:
+        def generate_content(self, prompt, request_options=None):
+            replies.append(prompt)
+            return type("Response", (), {"text": FakeModel.reply})()
+
+    FakeModel.reply = REPLY
+    monkeypatch.setattr(analysis_cache, "_cache", AnalysisCache(MemoryCache(), DiskCache(str(tmp_path / "c.db"))))
+    monkeypatch.setattr(analysis_cache, "CACHE_ENABLED", True)
+    monkeypatch.setattr(gemini_client.registry, "api_key", lambda: "k" * 39)
+    monkeypatch.setattr(gemini_client.registry, "get_model", lambda *args, **kwargs: FakeModel())
+    metrics.reset()
+    FakeModel.calls = replies
+    return FakeModel
+
+
+def test_repeat_uploads_hit_the_cache(gemini):
+    findings = ai.analyze_text_with_rules("Rent is due monthly.")
+    first = ai.analyze_with_gemini("Rent is due monthly.", findings, "Goa")
+    second = ai.analyze_with_gemini("Rent  is due\nmonthly.", findings, "Goa")
+
+    assert len(gemini.calls) == 1
+    assert first['cached'] is False and second['cached'] is True
+    assert second['ratingScore'] == first['ratingScore'] == 62
+    assert metrics.get("analysis_cache.memory_hits") == 1
+    assert metrics.get("analysis_cache.misses") == 1
+
+
+def test_bypass_always_calls_gemini(gemini):
+    findings = ai.analyze_text_with_rules("x")
+    ai.analyze_with_gemini("x", findings)
+    ai.analyze_with_gemini("x", findings, bypass_cache=True)
+    assert len(gemini.calls) == 2
+    assert metrics.get("analysis_cache.bypassed") == 1
+
+
+def test_unparseable_replies_are_not_cached(gemini):
+    gemini.reply = "not json at all"
+    findings = ai.analyze_text_with_rules("x")
+    result = ai.analyze_with_gemini("x", findings)
+    ai.analyze_with_gemini("x", findings)
+    assert len(gemini.calls) == 2
+    assert "isFallback" not in result
+
+
+def test_cache_key_covers_the_rule_packs_behind_the_prompt(monkeypatch):
+    monkeypatch.setattr(analysis_cache, "CACHE_ENABLED", True)
+    findings = {"found_issues": [], "hits": [], "rule_pack_versions": {"universal": "1.1.0"}}
+    _, key, _ = ai._plan_cache("Rent is due.", "Goa", False, findings)
+    _, other, _ = ai._plan_cache("Rent is due.", "Goa", False, dict(findings, rule_pack_versions={"universal": "1.2.0"}))
+    assert key != other
@@ -0,0 +1,88 @@
+"""
+The async /api/analyze (asgi.py) and ai.analyze_with_gemini_async.
+
+Run with:  python -m pytest test_asgi.py -q
+"""
+
+import asyncio
+import json
+import time
+
+import pytest
+
+pytest.importorskip("starlette")
+pytest.importorskip("a2wsgi")
+
+import ai
+import analysis_cache
+import gemini_client
+
+REPLY = json.dumps({"overallScore": 70, "colorLabel": "ORANGE", "summary": "s", "redFlags": [], "fairClauses": []})
+LATENCY = 0.2
+
+
+@pytest.fixture
+def gemini(monkeypatch):
+    calls = []
+
+    class FakeModel:
+        def generate_content(self, contents, request_options=None):
+            calls.append(contents)
+            return type("Response", (), {"text": REPLY})()
+
+        async def generate_content_async(self, contents, request_options=None):
+            calls.append(contents)
+            await asyncio.sleep(LATENCY)
+            return type("Response", (), {"text": REPLY})()
+
+    monkeypatch.setattr(analysis_cache, "CACHE_ENABLED", False)
+    monkeypatch.setattr(gemini_client.registry, "api_key", lambda: "k" * 39)
+    monkeypatch.setattr(gemini_client.registry, "get_model", lambda *args, **kwargs: FakeModel())
+    return calls
+
+
+def test_many_analyses_share_one_event_loop(gemini):
+    async def run():
+        findings = ai.analyze_text_with_rules("The deposit is non-refundable.")
+        return await asyncio.gather(*(ai.analyze_with_gemini_async(f"Lease {i}", findings) for i in range(200)))
+
+    start = time.perf_counter()
+    results = asyncio.run(run())
+    elapsed = time.perf_counter() - start
+
+    assert len(gemini) == 200
+    assert all(result['ratingScore'] == 70 for result in results)
+    assert elapsed < LATENCY * 10
+
+
+def test_async_view_matches_the_flask_view(gemini):
+    pytest.importorskip("httpx2")
+    from starlette.testclient import TestClient
+    import asgi
+    import app as flask_app
+
+    form = {'text': 'The deposit is non-refundable. Late fees apply.', 'state': 'Goa'}
+    with TestClient(asgi.app) as client:
+        async_result = client.post('/api/analyze', data=form).json()
+        assert client.post('/api/analyze', data={'text': 'x', 'mode': 'bogus'}).status_code == 400
+        assert client.post('/api/analyze', files={'file': ('a.txt', b'')}).status_code == 400
+        # Other routes still reach the Flask app
+        assert client.get('/api/metrics').status_code == 200
+
+    sync_result = flask_app.app.test_client().post('/api/analyze', data=form).get_json()
+    assert async_result.keys() == sync_result.keys()
+    assert async_result['ruleFindings'] == sync_result['ruleFindings']
+
+
+def test_history_insert_errors_never_fail_the_analysis(monkeypatch):
+    import asgi
+
+    class DroppedPool:
+        def acquire(self):
+            raise ConnectionError("Lost connection to MySQL server")
+
+    async def pool():
+        return DroppedPool()
+
+    monkeypatch.setattr(asgi, "get_db_pool", pool)
+    assert asyncio.run(asgi.save_analysis_history("a@b.c", {"ratingScore": 70})) is None
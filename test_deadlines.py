@@ -0,0 +1,151 @@
+"""
+Request deadline with per-stage budgets (deadlines.py) and the degraded results of /api/analyze.
+
+Run with:  python -m pytest test_deadlines.py -q
+"""
+
+import io
+import json
+import time
+
+import pytest
+from google.api_core import exceptions as google_exceptions
+
+import ai
+import analysis_cache
+import app as flask_app
+import deadlines
+import gemini_client
+import resilience
+from metrics import metrics
+
+REPLY = json.dumps({"overallScore": 70, "colorLabel": "ORANGE", "summary": "s", "redFlags": [], "fairClauses": []})
+TEXT = "The security deposit is non-refundable. The Landlord may enter without notice."
+
+
+@pytest.fixture(autouse=True)
+def short_budgets(monkeypatch):
+    """A one-second request: Gemini needs 0.2s, the history insert keeps 0.2s."""
+    monkeypatch.setattr(deadlines, "REQUEST_DEADLINE", 1.0)
+    monkeypatch.setattr(deadlines, "MIN_GEMINI_SECONDS", 0.2)
+    monkeypatch.setattr(deadlines, "MIN_CALL_SECONDS", 0.05)
+    monkeypatch.setitem(deadlines.STAGE_BUDGETS, "save", 0.2)
+    monkeypatch.setattr(resilience, "RETRY_BASE_DELAY", 0.001)
+    resilience.gemini.reset()
+    metrics.reset()
+    yield
+    resilience.gemini.reset()
+
+
+@pytest.fixture
+def gemini(monkeypatch):
+    """A fake model that answers after `delay` seconds, or times out at the request's timeout."""
+    calls = []
+
+    class FakeModel:
+        delay = 0.0
+
+        def generate_content(self, contents, request_options=None):
+            timeout = (request_options or {}).get("timeout")
+            calls.append(timeout)
+            if timeout is not None and FakeModel.delay > timeout:
+                time.sleep(timeout)
+                raise google_exceptions.DeadlineExceeded("504 Deadline Exceeded")
+            time.sleep(FakeModel.delay)
+            return type("Response", (), {"text": REPLY})()
+
+    monkeypatch.setattr(analysis_cache, "CACHE_ENABLED", False)
+    monkeypatch.setattr(gemini_client.registry, "api_key", lambda: "k" * 39)
+    monkeypatch.setattr(gemini_client.registry, "get_model", lambda *args, **kwargs: FakeModel())
+    FakeModel.calls = calls
+    return FakeModel
+
+
+def test_stage_budgets_leave_time_for_later_stages(monkeypatch):
+    monkeypatch.setattr(deadlines, "REQUEST_DEADLINE", 25)
+    monkeypatch.setattr(deadlines, "MIN_GEMINI_SECONDS", 4)
+    monkeypatch.setitem(deadlines.STAGE_BUDGETS, "save", 2)
+    deadline = deadlines.start()
+    assert deadline.budget("extract") == 10
+    assert 22.9 < deadline.budget("gemini") <= 23
+    assert deadline.budget("save") <= 2
+
+    deadline.expires_at = time.monotonic() + 5
+    assert deadline.budget("extract") <= 0 and deadline.budget("gemini") <= 3
+    with pytest.raises(deadlines.BudgetExceeded):
+        deadline.check("gemini", deadlines.MIN_GEMINI_SECONDS)
+
+    unlimited = deadlines.Deadline(None)
+    assert unlimited.budget("gemini") == unlimited.budget("extract") == float("inf")
+
+
+def test_gemini_call_ends_before_the_deadline_and_falls_back_to_rules(gemini):
+    gemini.delay = 5
+    start = time.monotonic()
+    response = flask_app.app.test_client().post('/api/analyze', data={'text': TEXT})
+    elapsed = time.monotonic() - start
+
+    result = response.get_json()
+    assert response.status_code == 200
+    assert elapsed < 1.0
+    # One call, with a timeout that leaves the save budget; no retry once the time was spent
+    assert len(gemini.calls) == 1 and gemini.calls[0] <= 0.8
+    assert metrics.get("gemini.retries") == 0
+    assert result['analysisMode'] == 'fast' and result['degraded'] is True
+    assert "rule-based analysis" in result['degradedReasons'][0]
+    assert result['ratingScore'] == ai.build_rule_based_result(ai.analyze_text_with_rules(TEXT))['ratingScore']
+
+
+def test_no_gemini_call_without_enough_time_left(gemini, monkeypatch):
+    monkeypatch.setattr(deadlines, "MIN_GEMINI_SECONDS", 0.9)
+    result = flask_app.app.test_client().post('/api/analyze', data={'text': TEXT}).get_json()
+    assert gemini.calls == []
+    assert result['degraded'] is True and result['analysisMode'] == 'fast'
+    assert metrics.get("deadline.gemini.exhausted") == 1
+
+    # Background jobs have no deadline
+    result = flask_app.run_analysis(TEXT, flask_app.parse_analysis_options({}))
+    assert 'degraded' not in result and gemini.calls == [None]
+
+
+def test_retries_stop_when_the_deadline_is_near():
+    caller = resilience.ResilientCaller("test")
+    calls = []
+
+    def unavailable():
+        calls.append(1)
+        raise google_exceptions.ServiceUnavailable("503")
+
+    with pytest.raises(google_exceptions.ServiceUnavailable):
+        caller.call(unavailable, time_left=lambda: 0.0)
+    assert len(calls) == 1
+    assert metrics.get("test.retries_skipped") == 1
+
+
+def test_scanned_pages_are_not_read_without_time_for_one(monkeypatch):
+    class BlankPage:
+        def extract_text(self):
+            return ""
+
+    class ScannedPdf:
+        is_encrypted = False
+        pages = [BlankPage(), BlankPage()]
+
+    class Upload:
+        stream = io.BytesIO(b"%PDF")
+
+    ocr_pages = []
+    monkeypatch.setattr(flask_app, "OCR_AVAILABLE", True)
+    monkeypatch.setattr(flask_app.PyPDF2, "PdfReader", lambda stream: ScannedPdf())
+    monkeypatch.setattr(flask_app, "convert_from_path", lambda path, **kwargs: ocr_pages.append(kwargs) or ["image"],
+                        raising=False)
+    monkeypatch.setattr(flask_app, "pytesseract", type("Tesseract", (), {"image_to_string": lambda image: "page"}),
+                        raising=False)
+
+    # An extract budget below one page's minimum estimate: not even the first page is started
+    deadline = deadlines.start()
+    deadline.expires_at = time.monotonic() + 0.5
+    assert list(flask_app.iter_pdf_text(Upload(), deadline)) == [] and ocr_pages == []
+    assert "first 0 of 2" in deadline.degraded_reasons[0]
+
+    assert list(flask_app.iter_pdf_text(Upload(), deadlines.Deadline(None))) == ["page", ai.PAGE_BREAK + "page"]
@@ -0,0 +1,82 @@
+"""
+Compact first-pass analyses and on-demand explanations (/api/analysis/<id>/explain).
+
+Run with:  python -m pytest test_explain.py -q
+"""
+
+import json
+
+import pytest
+
+import ai
+import analysis_cache
+import app as flask_app
+import explanations
+import gemini_client
+import prompt_builder
+
+REPLY = json.dumps({"overallScore": 40, "colorLabel": "RED", "summary": "Short.", "recommendations": [],
+                    "fairClauses": [], "redFlags": [{"title": "Deposit", "issue": "Non-refundable."},
+                                                    {"title": "Entry", "issue": "No notice."}]})
+TEXT = "1. The security deposit is non-refundable.\n2. The Landlord may enter without notice.\n"
+
+
+@pytest.fixture
+def gemini(monkeypatch, tmp_path):
+    calls = []
+
+    class FakeModel:
+        def __init__(self, generation_config, system_instruction):
+            self.explains = system_instruction == prompt_builder.EXPLANATION_SYSTEM_INSTRUCTION
+
+        def generate_content(self, contents, request_options=None):
+            calls.append(contents)
+            text = f"Explanation {len(calls)}" if self.explains else REPLY
+            return type("Response", (), {"text": text})()
+
+    monkeypatch.setattr(analysis_cache, "CACHE_ENABLED", False)
+    monkeypatch.setattr(explanations, "_store", explanations.ExplanationStore(path=str(tmp_path / "cache.sqlite3")))
+    monkeypatch.setattr(gemini_client.registry, "api_key", lambda: "k" * 39)
+    monkeypatch.setattr(gemini_client.registry, "get_model",
+                        lambda model_name=None, generation_config=None, system_instruction=None:
+                        FakeModel(generation_config, system_instruction))
+    return calls
+
+
+def test_first_pass_prompt_is_compact():
+    assert prompt_builder.PROMPT_TEMPLATES[prompt_builder.PROMPT_VERSION]["system_instruction"] in (
+        prompt_builder.SYSTEM_INSTRUCTION_V6, prompt_builder.SYSTEM_INSTRUCTION_V2)
+    assert "15-20 line" not in prompt_builder.SYSTEM_INSTRUCTION_V5
+    assert "aiSummary" not in prompt_builder.RESPONSE_SCHEMA["properties"]
+
+
+def test_explanations_are_generated_on_demand_and_cached(gemini):
+    client = flask_app.app.test_client()
+    result = client.post('/api/analyze', data={'text': TEXT}).get_json()
+    assert len(gemini) == 1
+    url = f"/api/analysis/{result['analysisId']}/explain"
+
+    document = client.get(url).get_json()
+    assert document == {"analysisId": result['analysisId'], "flag": None, "explanation": "Explanation 2",
+                        "cached": False}
+    assert "Deposit: Non-refundable." in gemini[-1] and "security deposit" in gemini[-1]
+
+    flag = client.get(url + "?flag=1").get_json()
+    assert flag['flag'] == {"title": "Entry", "issue": "No notice."}
+    assert flag['explanation'] == "Explanation 3"
+    assert "Red flag: Entry: No notice." in gemini[-1]
+
+    assert client.get(url).get_json()['cached'] is True
+    assert client.get(url + "?flag=1").get_json()['explanation'] == "Explanation 3"
+    assert len(gemini) == 3
+
+
+def test_unknown_analyses_and_flags_are_rejected(gemini):
+    client = flask_app.app.test_client()
+    result = client.post('/api/analyze', data={'text': TEXT}).get_json()
+    url = f"/api/analysis/{result['analysisId']}/explain"
+
+    assert client.get("/api/analysis/unknown/explain").status_code == 404
+    assert client.get(url + "?flag=2").status_code == 400
+    assert client.get(url + "?flag=-1").status_code == 400
+    assert len(gemini) == 1
@@ -0,0 +1,69 @@
+"""
+mode=fast / mode=auto on /api/analyze: rule-only results in the full response schema.
+
+Run with:  python -m pytest test_fast_mode.py -q
+"""
+
+import pytest
+
+import ai
+import app as app_module
+
+RISKY_TEXT = """RENTAL AGREEMENT
+1. The security deposit is non-refundable.
+2. The Landlord may access the premises without notice.
+3. All disputes go to binding arbitration with a class action waiver.
+"""
+
+FAIR_TEXT = "RENTAL AGREEMENT\n1. Rent is due on the 5th of each month.\n"
+
+
+@pytest.fixture
+def client(monkeypatch):
+    calls = []
+
+    def fake_gemini(text, findings, state="", bypass_cache=False, owner=None, deadline=None, document_type=None):
+        calls.append(text)
+        return ai.ensure_complete_response({"overallScore": 80, "summary": "Gemini"})
+
+    monkeypatch.setattr(ai, "analyze_with_gemini", fake_gemini)
+    test_client = app_module.app.test_client()
+    test_client.gemini_calls = calls
+    return test_client
+
+
+def test_fast_mode_skips_gemini_and_keeps_the_schema(client):
+    response = client.post('/api/analyze', data={'text': RISKY_TEXT, 'mode': 'fast'})
+    result = response.get_json()
+
+    assert response.status_code == 200
+    assert client.gemini_calls == []
+    assert result['analysisMode'] == 'fast'
+    for key in ('ratingScore', 'ratingText', 'colorLabel', 'summary', 'redFlags', 'fairClauses',
+                'recommendations', 'redFlagsCount', 'fairClausesCount'):
+        assert key in result
+    assert result['redFlagsCount'] == len(result['redFlags']) >= 3
+    assert result['ratingScore'] <= 45
+    assert (result['colorLabel'], result['ratingText']) == ai.get_rating_band(result['ratingScore'])
+    assert 'non-refundable' in result['redFlags'][0]['issue']
+
+
+def test_auto_mode_escalates_only_when_rules_are_unsure(client):
+    confident = client.post('/api/analyze', data={'text': RISKY_TEXT, 'mode': 'auto'}).get_json()
+    assert confident['analysisMode'] == 'fast'
+    assert confident['ruleConfidence'] >= ai.FAST_PATH_MIN_CONFIDENCE
+
+    unsure = client.post('/api/analyze', data={'text': FAIR_TEXT, 'mode': 'auto'}).get_json()
+    assert unsure['analysisMode'] == 'full'
+    assert client.gemini_calls == [FAIR_TEXT]
+
+
+def test_unknown_mode_is_rejected(client):
+    response = client.post('/api/analyze', data={'text': RISKY_TEXT, 'mode': 'instant'})
+    assert response.status_code == 400
+
+
+def test_rating_bands():
+    assert ai.get_rating_band(20) == ("DARK_RED", "CRITICAL")
+    assert ai.get_rating_band(45) == ("RED", "DANGEROUS")
+    assert ai.get_rating_band(86) == ("GREEN", "STABLE")
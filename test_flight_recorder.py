@@ -0,0 +1,99 @@
+"""
+Per-call Gemini telemetry (flight_recorder.py), the histograms of metrics.py and /api/admin/gemini-calls.
+
+Run with:  python -m pytest test_flight_recorder.py -q
+"""
+
+import pytest
+from google.api_core import exceptions as google_exceptions
+
+import ai
+import analysis_cache
+import app as flask_app
+import flight_recorder
+import gemini_client
+import llm_backends
+import model_router
+import resilience
+from metrics import Metrics, metrics
+
+TEXT = "The security deposit is non-refundable. The Landlord may enter without notice."
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch):
+    monkeypatch.setattr(analysis_cache, "CACHE_ENABLED", False)
+    monkeypatch.setattr(resilience, "RETRY_BASE_DELAY", 0.001)
+    monkeypatch.setattr(model_router, "ROUTING_ENABLED", False)
+    resilience.gemini.reset()
+    flight_recorder.recorder.reset()
+    metrics.reset()
+    yield
+    llm_backends.set_backend(None)
+    resilience.gemini.reset()
+
+
+def test_histograms_count_values_per_bucket():
+    histograms = Metrics()
+    for seconds in (0.05, 0.3, 0.3, 50):
+        histograms.observe("latency", seconds, buckets=(0.1, 0.5, 1))
+    snapshot = histograms.histograms()["latency"]
+    assert snapshot["count"] == 4 and snapshot["sum"] == 50.65
+    assert snapshot["le"] == {"0.1": 1, "0.5": 3, "1": 3, "+Inf": 4}
+    histograms.reset()
+    assert histograms.histograms() == {}
+
+
+def test_each_call_is_recorded_with_tokens_and_parse_outcome():
+    llm_backends.set_backend(llm_backends.StubBackend(latency="fixed:0.01"))
+    ai.analyze_with_gemini(TEXT, ai.analyze_text_with_rules(TEXT))
+
+    llm_backends.set_backend(llm_backends.StubBackend(latency="fixed:0", truncation_rate=1))
+    ai.analyze_with_gemini(TEXT + " Rent is due on the 5th.", ai.analyze_text_with_rules(TEXT))
+
+    truncated, complete = flight_recorder.recorder.recent()
+    assert complete["kind"] == "analysis" and complete["parse"] == "json_mode"
+    assert complete["finishReason"] == "STOP" and complete["latency"] >= 0.01
+    assert complete["promptTokens"] == complete["estimatedTokens"] and complete["outputTokens"] > 0
+    assert complete["promptChars"] > len(TEXT) and complete["retries"] == 0
+    assert truncated["finishReason"] == "MAX_TOKENS" and truncated["parse"] != "json_mode"
+
+    assert metrics.histograms()["gemini.latency_seconds"]["count"] == 2
+    assert metrics.get("gemini.finish_reason.MAX_TOKENS") == 1
+
+
+def test_retries_and_failures_are_recorded(monkeypatch):
+    calls = []
+
+    class FlakyModel:
+        def generate_content(self, contents, request_options=None):
+            calls.append(1)
+            if len(calls) == 1 or FlakyModel.down:
+                raise google_exceptions.ServiceUnavailable("503 overloaded")
+            return llm_backends.StubBackend(latency="fixed:0").get_model().generate_content(contents)
+
+    FlakyModel.down = False
+    monkeypatch.setattr(model_router, "FALLBACK_MODELS", [])
+    monkeypatch.setattr(gemini_client.registry, "api_key", lambda: "k" * 39)
+    monkeypatch.setattr(gemini_client.registry, "get_model", lambda *args, **kwargs: FlakyModel())
+
+    ai.analyze_with_gemini(TEXT, ai.analyze_text_with_rules(TEXT))
+    FlakyModel.down = True
+    assert "error" in ai.analyze_with_gemini(TEXT + " Pets are not allowed.", ai.analyze_text_with_rules(TEXT))
+
+    failed, retried = flight_recorder.recorder.recent()
+    assert retried["retries"] == 1 and retried["error"] is None
+    assert failed["error"] == "ServiceUnavailable" and failed["retries"] == resilience.RETRY_ATTEMPTS - 1
+
+    client = flask_app.app.test_client()
+    assert client.get('/api/metrics').get_json()["histograms"]["gemini.attempts"]["count"] == 2
+
+    # Without ADMIN_TOKEN the endpoint is closed, even to local requests
+    monkeypatch.setattr(flask_app, "ADMIN_TOKEN", "")
+    assert client.get('/api/admin/gemini-calls', environ_base={'REMOTE_ADDR': '127.0.0.1'}).status_code == 403
+
+    monkeypatch.setattr(flask_app, "ADMIN_TOKEN", "secret")
+    assert client.get('/api/admin/gemini-calls').status_code == 403
+    response = client.get('/api/admin/gemini-calls?limit=1', headers={'X-Admin-Token': 'secret'})
+    assert response.status_code == 200 and response.get_json()["recorded"] == 2
+    assert len(response.get_json()["calls"]) == 1
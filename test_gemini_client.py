@@ -0,0 +1,75 @@
+"""
+The Gemini client registry configures the library once and reuses its models.
+
+Run with:  python -m pytest test_gemini_client.py -q
+"""
+
+import threading
+
+import pytest
+
+import gemini_client
+
+
+@pytest.fixture
+def registry(monkeypatch, tmp_path):
+    calls = {"configure": 0, "model": 0}
+
+    def fake_configure(**kwargs):
+        calls["configure"] += 1
+
+    class FakeModel:
+        def __init__(self, name, generation_config=None, system_instruction=None):
+            calls["model"] += 1
+            self.name = name
+
+        def count_tokens(self, text):
+            return 1
+
+    monkeypatch.setattr(gemini_client.genai, "configure", fake_configure)
+    monkeypatch.setattr(gemini_client.genai, "GenerativeModel", FakeModel)
+    monkeypatch.setattr(gemini_client.genai_client, "get_default_generative_client", lambda: None)
+    monkeypatch.setattr(gemini_client, "ENV_FILE", str(tmp_path / ".env"))
+    monkeypatch.setenv("GEMINI_API_KEY", "k" * 39)
+    registry = gemini_client.GeminiClientRegistry()
+    registry.calls = calls
+    return registry
+
+
+def test_configures_once_and_reuses_models(registry):
+    config = {"temperature": 0.7}
+    first = registry.get_model(generation_config=config)
+    assert registry.get_model(generation_config=dict(config)) is first
+    assert registry.get_model("other-model") is not first
+    assert registry.calls == {"configure": 1, "model": 2}
+
+
+def test_reconfigures_when_the_key_changes(registry, monkeypatch):
+    first = registry.get_model()
+    monkeypatch.setenv("GEMINI_API_KEY", "n" * 39)
+    assert registry.get_model() is not first
+    assert registry.calls["configure"] == 2
+
+
+def test_env_file_edits_are_picked_up(registry, monkeypatch):
+    monkeypatch.setattr(gemini_client, "ENV_RELOAD_INTERVAL", 0)
+    with open(gemini_client.ENV_FILE, "w") as f:
+        f.write('GEMINI_API_KEY="' + "e" * 39 + '"\n')
+    assert registry.api_key() == "e" * 39
+
+
+def test_concurrent_first_calls_configure_once(registry):
+    models = []
+    threads = [threading.Thread(target=lambda: models.append(registry.get_model())) for _ in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len({id(model) for model in models}) == 1
+    assert registry.calls == {"configure": 1, "model": 1}
+
+
+def test_warm_up_never_raises(registry, monkeypatch):
+    assert registry.warm_up() is True
+    monkeypatch.delenv("GEMINI_API_KEY")
+    assert registry.warm_up() is False
@@ -0,0 +1,163 @@
+"""
+Background analyses: /api/analyze?async=1, /api/jobs/<id> and the SQLite job queue (jobs.py).
+
+Run with:  python -m pytest test_jobs.py -q
+"""
+
+import io
+import json
+import os
+import sqlite3
+import stat
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+import ai
+import analysis_cache
+import app as flask_app
+import gemini_client
+import jobs
+from metrics import metrics
+
+REPLY = json.dumps({"overallScore": 70, "colorLabel": "ORANGE", "summary": "s", "redFlags": [], "fairClauses": []})
+
+
+@pytest.fixture
+def gemini(monkeypatch):
+    calls = []
+
+    class FakeModel:
+        def generate_content(self, contents, request_options=None):
+            calls.append(contents)
+            return type("Response", (), {"text": REPLY})()
+
+    monkeypatch.setattr(analysis_cache, "CACHE_ENABLED", False)
+    monkeypatch.setattr(gemini_client.registry, "api_key", lambda: "k" * 39)
+    monkeypatch.setattr(gemini_client.registry, "get_model", lambda *args, **kwargs: FakeModel())
+    return calls
+
+
+@pytest.fixture
+def queue(monkeypatch, tmp_path):
+    job_queue = jobs.JobQueue(flask_app.run_analysis_job, path=str(tmp_path / "jobs.sqlite3"), poll_interval=0.01)
+    monkeypatch.setattr(flask_app, "job_queue", job_queue)
+    return job_queue
+
+
+def wait_until_finished(client, url, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = client.get(url).get_json()
+        if job['status'] not in (jobs.QUEUED, jobs.RUNNING):
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job did not finish: {job}")
+
+
+def test_async_analysis_returns_a_job_and_then_the_result(gemini, queue):
+    client = flask_app.app.test_client()
+    text = "The security deposit is non-refundable."
+    response = client.post('/api/analyze?async=1', data={'text': text})
+    assert response.status_code == 202
+    body = response.get_json()
+    assert response.headers['Location'] == body['statusUrl'] == f"/api/jobs/{body['jobId']}"
+
+    job = wait_until_finished(client, body['statusUrl'])
+    assert job['status'] == jobs.SUCCEEDED
+    assert job['progress'] == 100
+    expected = client.post('/api/analyze', data={'text': text}).get_json()
+    assert job['result'] == expected
+
+    # Uploads are stored with the job and extracted by the worker
+    response = client.post('/api/analyze', data={'async': '1', 'file': (io.BytesIO(text.encode()), 'lease.txt')})
+    job = wait_until_finished(client, response.get_json()['statusUrl'])
+    assert job['result']['ratingScore'] == expected['ratingScore']
+    assert queue.stats()[jobs.SUCCEEDED] == 2
+
+
+def test_bad_requests_are_rejected_before_queueing(queue):
+    client = flask_app.app.test_client()
+    assert client.post('/api/analyze?async=1', data={'text': 'x', 'mode': 'instant'}).status_code == 400
+    assert client.post('/api/analyze?async=1', data={}).status_code == 400
+    assert client.get('/api/jobs/unknown').status_code == 404
+    assert queue.stats()[jobs.QUEUED] == 0
+
+
+def test_cancel_queued_and_running_jobs(tmp_path):
+    started, release = threading.Event(), threading.Event()
+    finished = []
+
+    def handler(payload, upload, filename, progress):
+        progress("first", 10)
+        started.set()
+        release.wait(5)
+        progress("second", 50)
+        finished.append(payload)
+        return {"ok": True}
+
+    queue = jobs.JobQueue(handler, path=str(tmp_path / "jobs.sqlite3"), workers=1, poll_interval=0.01)
+    running = queue.submit({"n": 1})
+    assert started.wait(5)
+    queued = queue.submit({"n": 2})
+
+    assert queue.cancel(queued)['status'] == jobs.CANCELLED
+    assert queue.cancel(running)['status'] == jobs.RUNNING
+    release.set()
+    deadline = time.monotonic() + 5
+    while queue.get(running)['status'] == jobs.RUNNING and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    assert queue.get(running)['status'] == jobs.CANCELLED
+    assert queue.get(running)['progress'] == 10
+    assert finished == []
+    assert queue.cancel("unknown") is None
+
+
+def test_orphaned_jobs_are_requeued_and_old_jobs_pruned(tmp_path):
+    path = str(tmp_path / "jobs.sqlite3")
+    queue = jobs.JobQueue(lambda *args: {"ok": True}, path=path, workers=0, retention=60)
+    job_id = queue.submit({})
+    dead = subprocess.Popen([sys.executable, "-c", "pass"])
+    dead.wait()
+    db = queue._connect()
+    db.execute("UPDATE analysis_jobs SET status = ?, worker_pid = ? WHERE id = ?", (jobs.RUNNING, dead.pid, job_id))
+
+    restarted = jobs.JobQueue(lambda *args: {"ok": True}, path=path, workers=1, retention=60, poll_interval=0.01)
+    restarted.start()
+    deadline = time.monotonic() + 5
+    while restarted.get(job_id)['status'] != jobs.SUCCEEDED and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert restarted.get(job_id)['result'] == {"ok": True}
+
+    db.execute("UPDATE analysis_jobs SET finished_at = ? WHERE id = ?", (time.time() - 120, job_id))
+    restarted.prune()
+    assert restarted.get(job_id) is None
+
+
+def test_queue_file_is_private_and_workers_survive_database_errors(tmp_path):
+    metrics.reset()
+    path = str(tmp_path / "jobs.sqlite3")
+    queue = jobs.JobQueue(lambda *args: {"ok": True}, path=path, workers=1, poll_interval=0.01)
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+
+    runs = []
+    original_run = queue.run
+
+    def locked_once(*row):
+        runs.append(row[0])
+        if len(runs) == 1:
+            raise sqlite3.OperationalError("database is locked")
+        return original_run(*row)
+
+    queue.run = locked_once
+    queue.submit({"n": 1})
+    second = queue.submit({"n": 2})
+    deadline = time.monotonic() + 5
+    while queue.get(second)['status'] != jobs.SUCCEEDED and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert queue.get(second)['status'] == jobs.SUCCEEDED
+    assert metrics.get("jobs.store_failed") == 1
@@ -0,0 +1,76 @@
+"""
+JSON mode: the response schema and the direct parse path.
+
+Run with:  python -m pytest test_json_mode.py -q
+"""
+
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks'))
+
+import ai
+import prompt_builder
+from corpus import generate_model_response
+from metrics import metrics
+
+
+@pytest.fixture(autouse=True)
+def fresh_metrics(monkeypatch):
+    monkeypatch.setattr(prompt_builder, "JSON_MODE", True)
+    metrics.reset()
+
+
+def test_schema_is_accepted_by_the_gemini_library():
+    from google.generativeai.types import generation_types
+
+    config = generation_types.to_generation_config_dict(ai.DETERMINISTIC_GENERATION_CONFIG)
+    assert config["response_mime_type"] == "application/json"
+    assert set(config["response_schema"].required) == set(prompt_builder.RESPONSE_SCHEMA["required"])
+
+
+def test_json_mode_reply_is_parsed_without_repair():
+    reply = generate_model_response(seed=2, style="clean")
+    result = ai._parse_gemini_text(reply)
+    assert result['ratingScore'] == json.loads(reply)['overallScore']
+    assert result['redFlagsCount'] == 6
+    assert metrics.get("parse.json_mode") == 1
+    assert metrics.get("parse.repaired") == 0
+
+
+def test_rating_labels_follow_the_score():
+    result = ai._parse_gemini_text(json.dumps({"overallScore": 30, "colorLabel": "GREEN", "summary": "s",
+                                               "redFlags": [], "fairClauses": []}))
+    assert (result['colorLabel'], result['ratingText']) == ("RED", "DANGEROUS")
+
+
+@pytest.mark.parametrize("reply", [
+    generate_model_response(seed=2, style="clean"),
+    generate_model_response(seed=2, style="multiline"),
+    '{"overallScore": 40, "summary": "cut off',
+], ids=["json-mode", "repaired", "canned-fallback"])
+def test_every_parse_path_returns_a_complete_result(reply):
+    result = ai._parse_gemini_text(reply)
+    assert (result['colorLabel'], result['ratingText']) == ai.get_rating_band(result['ratingScore'])
+    assert result['redFlagsCount'] == len(result['redFlags'])
+    assert result['fairClausesCount'] == len(result['fairClauses'])
+    assert result['shortSummary'] == result['summary'] and result['aiSummary']
+
+
+def test_unparseable_reply_falls_back_to_repair_and_is_counted():
+    result = ai._parse_gemini_text(generate_model_response(seed=2, style="multiline"))
+    assert result['redFlagsCount'] == 6
+    assert metrics.get("parse.json_mode_failed") == 1
+    assert metrics.get("parse.repaired") == 1
+
+    ai._parse_gemini_text('{"overallScore": 40, "summary": "cut off')
+    assert metrics.get("parse.canned_fallback") == 1
+
+
+def test_json_mode_prompt_leaves_the_format_to_the_schema():
+    prompt = prompt_builder.build_analysis_prompt("Rent is due monthly.", version="3")
+    assert '"redFlags"' not in prompt.system_instruction
+    assert prompt.input_tokens < prompt_builder.build_analysis_prompt("Rent is due monthly.", version="2").input_tokens
@@ -0,0 +1,107 @@
+"""
+Pluggable model backend and the deterministic stub used for offline benchmarks (llm_backends.py).
+
+Run with:  python -m pytest test_llm_backends.py -q
+"""
+
+import json
+import random
+
+import pytest
+from google.api_core import exceptions as google_exceptions
+
+import ai
+import analysis_cache
+import gemini_client
+import llm_backends
+import model_router
+import prompt_builder
+import resilience
+
+TEXT = "The security deposit is non-refundable. The Landlord may enter without notice."
+
+
+@pytest.fixture(autouse=True)
+def stub_backend(monkeypatch):
+    monkeypatch.setattr(analysis_cache, "CACHE_ENABLED", False)
+    monkeypatch.setattr(resilience, "RETRY_BASE_DELAY", 0.001)
+    resilience.gemini.reset()
+    model_router.reset()
+    yield
+    llm_backends.set_backend(None)
+    resilience.gemini.reset()
+    model_router.reset()
+
+
+def test_default_backend_is_the_gemini_registry(monkeypatch):
+    assert llm_backends.get_backend() is gemini_client.registry
+    monkeypatch.setattr(llm_backends, "LLM_BACKEND", "stub")
+    backend = llm_backends.get_backend()
+    assert isinstance(backend, llm_backends.StubBackend) and llm_backends.get_backend() is backend
+    monkeypatch.setattr(llm_backends, "LLM_BACKEND", "other")
+    llm_backends.set_backend(None)
+    with pytest.raises(ValueError):
+        llm_backends.get_backend()
+
+
+def test_stub_answers_analyses_without_a_key(monkeypatch):
+    monkeypatch.setattr(gemini_client.registry, "api_key", lambda: "")
+    llm_backends.set_backend(llm_backends.StubBackend(latency="fixed:0"))
+
+    result = ai.analyze_with_gemini(TEXT, ai.analyze_text_with_rules(TEXT))
+    assert "error" not in result
+    assert result['overallScore'] in range(0, 101) and result['redFlags']
+
+    # Replies depend only on the prompt, so a second stub (another seed) answers the same
+    model = llm_backends.StubBackend(latency="fixed:0", seed=7).get_model(
+        generation_config={"response_mime_type": "application/json"})
+    response = model.generate_content(TEXT)
+    assert json.loads(response.text) == llm_backends.stub_analysis(TEXT)
+    assert response.candidates[0].finish_reason == "STOP"
+    assert response.usage_metadata.prompt_token_count == prompt_builder.estimate_tokens(TEXT)
+
+
+def test_latency_errors_and_truncation_are_configurable():
+    rng = random.Random(0)
+    assert llm_backends.parse_latency("fixed:0.5")(rng) == 0.5
+    assert 1 <= llm_backends.parse_latency("uniform:1,2")(rng) <= 2
+    samples = [llm_backends.parse_latency("lognormal:0.1,0.5")(rng) for _ in range(2000)]
+    assert 0.08 < sorted(samples)[1000] < 0.12
+    with pytest.raises(ValueError):
+        llm_backends.parse_latency("gamma:1")
+
+    failing = llm_backends.StubBackend(latency="fixed:0", error_rate=1).get_model()
+    with pytest.raises(google_exceptions.ServiceUnavailable):
+        failing.generate_content(TEXT)
+    quota = llm_backends.StubBackend(latency="fixed:0", quota_error_rate=1).get_model()
+    with pytest.raises(google_exceptions.ResourceExhausted):
+        quota.generate_content(TEXT)
+
+    # A reply past the request timeout fails like the real client does
+    slow = llm_backends.StubBackend(latency="fixed:0.2").get_model()
+    with pytest.raises(google_exceptions.DeadlineExceeded):
+        slow.generate_content(TEXT, request_options={"timeout": 0.01})
+
+    truncated = llm_backends.StubBackend(latency="fixed:0", truncation_rate=1).get_model()
+    response = truncated.generate_content(TEXT)
+    assert response.candidates[0].finish_reason == "MAX_TOKENS"
+    with pytest.raises(ValueError):
+        json.loads(response.text)
+
+    stream = llm_backends.StubBackend(latency="fixed:0").get_model().generate_content(TEXT, stream=True)
+    assert "".join(chunk.text for chunk in stream).startswith("```json")
+
+
+def test_stub_results_are_cached_apart_from_gemini(monkeypatch, tmp_path):
+    monkeypatch.setattr(analysis_cache, "CACHE_ENABLED", True)
+    monkeypatch.setattr(analysis_cache, "_cache", analysis_cache.AnalysisCache(
+        analysis_cache.MemoryCache(), analysis_cache.DiskCache(str(tmp_path / "cache.sqlite3"))))
+    findings = ai.analyze_text_with_rules(TEXT)
+    llm_backends.set_backend(llm_backends.StubBackend(latency="fixed:0"))
+    _, stub_key, _ = ai._plan_cache(TEXT, "", False, findings)
+    ai.analyze_with_gemini(TEXT, findings)
+    assert analysis_cache.get_cache().get(stub_key) is not None
+
+    llm_backends.set_backend(None)
+    _, gemini_key, _ = ai._plan_cache(TEXT, "", False, findings)
+    assert gemini_key != stub_key and analysis_cache.get_cache().get(gemini_key) is None
@@ -0,0 +1,93 @@
+"""
+Map-reduce analysis of long documents: clause-aligned chunks, parallel calls, merged verdict.
+
+Run with:  python -m pytest test_map_reduce.py -q
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks'))
+
+import ai
+import analysis_cache
+import gemini_client
+import prompt_builder
+from corpus import generate_agreement
+
+CALL_SECONDS = 0.2
+
+
+@pytest.fixture
+def gemini(monkeypatch):
+    calls = []
+    lock = threading.Lock()
+
+    class FakeModel:
+        def generate_content(self, contents, request_options=None):
+            with lock:
+                calls.append(contents)
+                part = len(calls)
+            time.sleep(CALL_SECONDS)
+            reply = {
+                "overallScore": 40 if "part 2 of" in contents else 80,
+                "colorLabel": "ORANGE",
+                "summary": f"Summary {part}.",
+                "redFlags": [{"title": "Late Fees", "issue": "x" * part}, {"title": f"Flag {part}", "issue": "y"}],
+                "fairClauses": [{"title": "Clear Payment Terms", "recommendation": "ok"}],
+                "recommendations": ["Negotiate late fees", "negotiate late fees."],
+            }
+            return type("Response", (), {"text": json.dumps(reply)})()
+
+    monkeypatch.setattr(analysis_cache, "CACHE_ENABLED", False)
+    monkeypatch.setattr(gemini_client.registry, "api_key", lambda: "k" * 39)
+    monkeypatch.setattr(gemini_client.registry, "get_model", lambda *args, **kwargs: FakeModel())
+    return calls
+
+
+def test_split_document_is_clause_aligned_and_lossless():
+    text = generate_agreement(seed=3, size=180_000, pages=60)
+    spans = prompt_builder.split_document(text, 6000)
+    assert len(spans) > 1
+    assert "".join(text[start:end] for start, end in spans) == text
+    for start, end in spans[:-1]:
+        assert text[end - 1] in "\f\n .;"
+
+
+def test_long_documents_run_in_parallel_and_merge(gemini):
+    text = generate_agreement(seed=4, size=180_000, pages=60)
+    findings = ai.analyze_text_with_rules(text)
+
+    start = time.perf_counter()
+    result = ai.analyze_with_gemini(text, findings)
+    elapsed = time.perf_counter() - start
+
+    chunks = len(gemini)
+    assert 1 < chunks <= ai.MAP_REDUCE_WORKERS
+    # Close to one chunk call, far from the sum of all of them
+    assert elapsed < CALL_SECONDS * 2.5 < CALL_SECONDS * chunks
+    assert all(f"of {chunks} of a longer document" in contents for contents in gemini)
+
+    assert result['chunkCount'] == chunks
+    titles = [flag['title'] for flag in result['redFlags']]
+    assert titles.count("Late Fees") == 1 and len(titles) == chunks + 1
+    assert len(result['recommendations']) == 1
+    # The one risky chunk (score 40) caps the merged score
+    assert result['overallScore'] == 40 + ai.MAX_SCORE_ABOVE_WORST_CHUNK
+    assert result['redFlagsCount'] == len(result['redFlags'])
+
+
+def test_short_documents_use_one_call(gemini):
+    ai.analyze_with_gemini("A short lease.", ai.analyze_text_with_rules("A short lease."))
+    assert len(gemini) == 1
+    assert "longer document" not in gemini[0]
+
+
+def test_merge_weights_by_chunk_size():
+    results = [{"overallScore": 90}, {"overallScore": 70}]
+    assert ai.merge_chunk_results(results, [3000, 1000])['overallScore'] == 85
@@ -0,0 +1,118 @@
+"""
+Model routing by document size and risk, and the fallback chain (model_router.py).
+
+Run with:  python -m pytest test_model_router.py -q
+"""
+
+import json
+
+import pytest
+from google.api_core import exceptions as google_exceptions
+
+import ai
+import analysis_cache
+import gemini_client
+import model_router
+import resilience
+from analysis_cache import AnalysisCache, DiskCache, MemoryCache
+from metrics import metrics
+
+REPLY = json.dumps({"overallScore": 80, "colorLabel": "GREEN", "summary": "s", "redFlags": [], "fairClauses": []})
+NOTICE = "Privacy policy. We keep your personal data for one year and do not sell personal data."
+LEASE = ("Leave and licence agreement. The Licensee shall pay rent to the Licensor by the 5th. "
+         "The Landlord may enter the premises without notice and the tenant forfeits the deposit.")
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch):
+    monkeypatch.setattr(resilience, "RETRY_BASE_DELAY", 0.001)
+    resilience.gemini.reset()
+    model_router.reset()
+    metrics.reset()
+    yield
+    resilience.gemini.reset()
+    model_router.reset()
+
+
+def test_routes_by_size_type_and_rule_score(monkeypatch):
+    lite = model_router.choose_route(NOTICE, {}, rule_score=90)
+    assert lite.tier == "lite" and lite.model == model_router.LITE_MODEL
+    assert lite.generation_config["max_output_tokens"] == 1024
+    assert model_router.detect_document_type(NOTICE) == "privacy_policy"
+
+    # Leases never go to the lite model; risky ones go to pro only when a pro model is configured
+    assert model_router.detect_document_type(LEASE) == "lease"
+    assert model_router.choose_route(LEASE, {}, rule_score=90).tier == "standard"
+    assert model_router.choose_route(LEASE, {}, rule_score=30).tier == "standard"
+    monkeypatch.setitem(model_router.TIERS, "pro", {"model": "gemini-2.5-pro", "max_output_tokens": 4096})
+    monkeypatch.setattr(model_router, "PRO_MODEL", "gemini-2.5-pro")
+    pro = model_router.choose_route(LEASE, {"temperature": 0}, rule_score=30)
+    assert pro.tier == "pro" and pro.models[0] == "gemini-2.5-pro"
+    assert pro.models[1:] == model_router.FALLBACK_MODELS
+    assert pro.generation_config == {"temperature": 0, "max_output_tokens": 4096}
+
+    # The type the client gave wins over keyword detection
+    assert model_router.choose_route(NOTICE, {}, rule_score=30, document_type="Lease").tier == "pro"
+    assert model_router.choose_route(LEASE, {}, rule_score=30, document_type="privacy_policy").tier == "standard"
+
+    # Without rule findings (or with routing off) there is no evidence for the lite model
+    assert model_router.choose_route(NOTICE, {}).tier == "standard"
+    monkeypatch.setattr(model_router, "ROUTING_ENABLED", False)
+    assert model_router.choose_route(NOTICE, {}, rule_score=90).model == gemini_client.GEMINI_MODEL
+
+
+@pytest.fixture
+def gemini(monkeypatch, tmp_path):
+    """Fake models by name; a name in `overloaded` answers every call with 429."""
+    calls = []
+    overloaded = set()
+
+    class FakeModel:
+        def __init__(self, name):
+            self.name = name
+
+        def generate_content(self, contents, request_options=None):
+            calls.append(self.name)
+            if self.name in overloaded:
+                raise google_exceptions.ResourceExhausted("429 quota exceeded")
+            return type("Response", (), {"text": REPLY})()
+
+    monkeypatch.setattr(analysis_cache, "_cache", AnalysisCache(MemoryCache(), DiskCache(str(tmp_path / "c.db"))))
+    monkeypatch.setattr(analysis_cache, "CACHE_ENABLED", True)
+    monkeypatch.setattr(gemini_client.registry, "api_key", lambda: "k" * 39)
+    monkeypatch.setattr(gemini_client.registry, "get_model",
+                        lambda model_name=None, **kwargs: FakeModel(model_name or gemini_client.GEMINI_MODEL))
+    return calls, overloaded
+
+
+def test_overloaded_model_falls_back_and_is_not_cached(gemini):
+    calls, overloaded = gemini
+    findings = ai.analyze_text_with_rules(NOTICE)
+    overloaded.add(model_router.LITE_MODEL)
+
+    result = ai.analyze_with_gemini(NOTICE, findings)
+    assert result['model'] == gemini_client.GEMINI_MODEL
+    assert result['modelFallback'] is True
+    assert calls[0] == model_router.LITE_MODEL and calls[-1] == gemini_client.GEMINI_MODEL
+    assert metrics.get("routing.fallbacks") == 1
+
+    # The fallback answer was not stored under the lite model's key: once it recovers, it is asked
+    overloaded.clear()
+    result = ai.analyze_with_gemini(NOTICE, findings)
+    assert result['model'] == model_router.LITE_MODEL and 'modelFallback' not in result
+    assert result['cached'] is False
+    assert ai.analyze_with_gemini(NOTICE, findings)['cached'] is True
+
+    stats = model_router.stats()
+    assert model_router.LITE_MODEL in stats['models']
+    assert stats['tiers']['lite'] == model_router.LITE_MODEL
+
+
+def test_last_model_error_is_returned(gemini, monkeypatch):
+    calls, overloaded = gemini
+    monkeypatch.setattr(model_router, "FALLBACK_MODELS", [])
+    overloaded.add(gemini_client.GEMINI_MODEL)
+
+    result = ai.analyze_with_gemini(LEASE, ai.analyze_text_with_rules(LEASE))
+    assert "error" in result
+    assert set(calls) == {gemini_client.GEMINI_MODEL}
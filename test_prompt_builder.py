@@ -0,0 +1,117 @@
+"""
+Prompt assembly: one copy of the document, static system instruction, token budget.
+
+Run with:  python -m pytest test_prompt_builder.py -q
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks'))
+
+import ai
+import prompt_builder
+from corpus import generate_agreement
+from prompt_builder import build_analysis_prompt, estimate_tokens, trim_document
+
+
+def test_document_is_sent_once():
+    # Below PROMPT_SUMMARIZE_MIN_TOKENS, so no clause is shortened
+    text = generate_agreement(seed=1, size=2500)
+    prompt = build_analysis_prompt(text, "Goa")
+    assert prompt.contents.count(text) == 1
+    assert text not in prompt.system_instruction
+    assert "Location: Goa, India." in prompt.contents
+    assert not prompt.trimmed
+
+
+def test_system_instruction_is_static():
+    first = build_analysis_prompt("one document", "Goa")
+    second = build_analysis_prompt("another document", "Kerala")
+    assert first.system_instruction == second.system_instruction
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("abcd" * 100) == 100
+    # Non-Latin scripts count about a token per character
+    assert estimate_tokens("किराया") == 6
+
+
+def test_long_documents_are_trimmed_to_the_budget_keeping_flagged_clauses():
+    text = generate_agreement(seed=2, size=200_000, risky_ratio=0.02)
+    findings = ai.analyze_text_with_rules(text)
+    prompt = build_analysis_prompt(text, "", findings, max_input_tokens=8000)
+
+    assert prompt.trimmed
+    assert prompt.input_tokens <= 8000
+    assert "characters omitted" in prompt.contents
+    assert prompt.contents.count("RENTAL") + prompt.contents.count("AGREEMENT") + prompt.contents.count("POLICY") >= 1
+    top_hit = max(findings['hits'], key=lambda hit: hit['score'])
+    assert top_hit['clause'] in prompt.contents
+
+
+def test_trim_reports_dropped_characters():
+    text = "\n".join(f"Line {i} of the agreement." for i in range(2000))
+    document, dropped = trim_document(text, 500)
+    assert dropped > 0
+    assert document.startswith("Line 0 ")
+    assert document.rstrip().endswith("Line 1999 of the agreement.")
+    assert trim_document("short", 500) == ("short", 0)
+
+
+def test_version_is_part_of_the_cache_key():
+    assert prompt_builder.PROMPT_VERSION in prompt_builder.PROMPT_TEMPLATES
+
+
+def test_condensed_document_drops_page_furniture_and_keeps_hits_aligned():
+    text = generate_agreement(seed=5, size=20000, pages=8, furniture=True, risky_ratio=0.3)
+    findings = ai.analyze_text_with_rules(text)
+    hits = prompt_builder._titled_hits(findings)
+    condensed, moved, dropped = prompt_builder.condense_document(text, hits, prompt_builder.flag_markers(hits))
+
+    header = text.split("\n", 1)[0]
+    assert condensed.count(header) == 1
+    assert "Page 3\n" not in condensed
+    assert condensed.count("\f") == text.count("\f")
+    assert dropped > 0
+    assert len(moved) == len(hits)
+    for original, hit in zip(hits, moved):
+        assert condensed[hit["start"]:hit["end"]] == text[original["start"]:original["end"]]
+
+
+def test_condensing_keeps_repeated_clauses_and_numbers_in_the_page_body():
+    text = ("Lease - Confidential\n1. Rent is payable monthly.\nAmount due:\n15000\n1. Rent is payable monthly.\n"
+            "Notes\n2\n\fLease - Confidential\nSchedule A\n1. Rent is payable monthly.\nDeposit\n15000\nEnd\n3")
+    condensed, _, _ = prompt_builder.condense_document(text)
+    assert condensed.count("Lease - Confidential") == 1
+    assert condensed.count("1. Rent is payable monthly.") == 3 and condensed.count("15000") == 2
+    assert "\n2\n" not in condensed and not condensed.endswith("3")
+    # Without page breaks there are no headers or footers to drop
+    assert prompt_builder.condense_document("Total\n42\nTotal\n42\n")[0] == "Total\n42\nTotal\n42\n"
+
+
+def test_long_documents_are_sent_with_unflagged_clauses_shortened():
+    text = generate_agreement(seed=5, size=20000, pages=8, furniture=True, risky_ratio=0.3)
+    findings = ai.analyze_text_with_rules(text)
+    full = build_analysis_prompt(text, "", findings, version="5")
+    short = build_analysis_prompt(text, "", findings, version="6")
+    assert short.input_tokens < full.input_tokens * 0.8
+    # Every flagged line, the head and the tail are sent whole
+    for hit in prompt_builder._titled_hits(findings):
+        line_start = text.rfind("\n", 0, hit["start"]) + 1
+        assert text[line_start:text.find("\n", hit["end"])].strip("\f") in short.contents
+    assert text[:prompt_builder.SUMMARY_KEEP_HEAD_CHARS].split("\n")[2] in short.contents
+    assert text[-prompt_builder.SUMMARY_KEEP_TAIL_CHARS:].split("\n")[-1] in short.contents
+    assert prompt_builder.SHORTENED_MARK + "\n" in short.contents
+
+    # Short documents are sent whole
+    small = "1. Rent is due on the 5th of every month by bank transfer to the Licensor.\n" * 5
+    assert prompt_builder.SHORTENED_MARK not in build_analysis_prompt(small, "", None, version="6").contents
+
+def test_focused_prompt_marks_flagged_lines():
+    text = "1. Rent is due monthly.\n2. The security deposit is non-refundable.\n"
+    prompt = build_analysis_prompt(text, "", ai.analyze_text_with_rules(text), version="4")
+    assert "[flag: non-refundable, risk" in prompt.contents
+    assert "1. Rent is due monthly." in prompt.contents
+    assert prompt.contents.count("[flag:") == 1
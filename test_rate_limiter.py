@@ -0,0 +1,106 @@
+"""
+The node-wide Gemini quota limiter (rate_limiter.py).
+
+Run with:  python -m pytest test_rate_limiter.py -q
+"""
+
+import json
+import multiprocessing
+
+import pytest
+
+import ai
+import analysis_cache
+import gemini_client
+import rate_limiter
+from rate_limiter import RateLimitExceeded, TokenBucketLimiter
+
+
+def test_requests_queue_then_get_a_predicted_wait(tmp_path):
+    limiter = TokenBucketLimiter(rpm=2, tpm=0, path=str(tmp_path / "state"), max_wait=40)
+    assert limiter.reserve(100) == 0
+    assert limiter.reserve(100) == 0
+    # Third request of the minute waits for the next refill (one every 30s)
+    assert 29 < limiter.reserve(100) <= 30
+    with pytest.raises(RateLimitExceeded) as error:
+        limiter.reserve(100)
+    assert 59 < error.value.retry_after <= 60
+
+
+def test_token_bucket_counts_estimated_tokens(tmp_path):
+    limiter = TokenBucketLimiter(rpm=0, tpm=1000, path=str(tmp_path / "state"), max_wait=60)
+    assert limiter.reserve(800) == 0
+    assert 35 < limiter.reserve(800) <= 36
+    assert limiter.stats()['tokensAvailable'] < 0
+
+
+def _reserve_in_child(path, results):
+    results.put(TokenBucketLimiter(rpm=4, tpm=0, path=path, max_wait=5).reserve(1))
+
+
+@pytest.mark.skipif(not rate_limiter.FCNTL_AVAILABLE, reason="needs fcntl")
+def test_workers_share_one_bucket(tmp_path):
+    path = str(tmp_path / "state")
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+    workers = [context.Process(target=_reserve_in_child, args=(path, results)) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert [results.get() for _ in workers] == [0, 0, 0, 0]
+
+    # The four worker processes used up this minute's requests
+    with pytest.raises(RateLimitExceeded):
+        TokenBucketLimiter(rpm=4, tpm=0, path=path, max_wait=5).reserve(1)
+
+
+def test_full_queue_returns_429_with_retry_after(monkeypatch, tmp_path):
+    import app as flask_app
+
+    class FakeModel:
+        def generate_content(self, contents, request_options=None):
+            return type("Response", (), {"text": json.dumps({"overallScore": 70, "redFlags": []})})()
+
+    monkeypatch.setattr(analysis_cache, "CACHE_ENABLED", False)
+    monkeypatch.setattr(gemini_client.registry, "api_key", lambda: "k" * 39)
+    monkeypatch.setattr(gemini_client.registry, "get_model", lambda *args, **kwargs: FakeModel())
+    monkeypatch.setattr(rate_limiter, "limiter", TokenBucketLimiter(rpm=1, tpm=0, path=str(tmp_path / "s"), max_wait=5))
+
+    client = flask_app.app.test_client()
+    assert client.post('/api/analyze', data={'text': 'Rent is due monthly.', 'mode': 'full'}).status_code == 200
+    response = client.post('/api/analyze', data={'text': 'Rent is due weekly.', 'mode': 'full'})
+    assert response.status_code == 429
+    assert 59 <= int(response.headers['Retry-After']) <= 60
+    assert response.get_json()['retryAfter'] == int(response.headers['Retry-After'])
+
+
+def test_retries_and_fallback_models_are_charged(monkeypatch, tmp_path):
+    import model_router
+    import resilience
+    from google.api_core import exceptions as google_exceptions
+
+    calls = []
+
+    class FlakyModel:
+        def generate_content(self, contents, request_options=None):
+            calls.append(1)
+            if len(calls) < 3:
+                raise google_exceptions.ServiceUnavailable("503 overloaded")
+            return type("Response", (), {"text": json.dumps({"overallScore": 70, "redFlags": []})})()
+
+    monkeypatch.setattr(analysis_cache, "CACHE_ENABLED", False)
+    monkeypatch.setattr(resilience, "RETRY_BASE_DELAY", 0.001)
+    monkeypatch.setattr(model_router, "FALLBACK_MODELS", [])
+    monkeypatch.setattr(gemini_client.registry, "api_key", lambda: "k" * 39)
+    monkeypatch.setattr(gemini_client.registry, "get_model", lambda *args, **kwargs: FlakyModel())
+    limiter = TokenBucketLimiter(rpm=10, tpm=0, path=str(tmp_path / "s"), max_wait=5)
+    monkeypatch.setattr(rate_limiter, "limiter", limiter)
+    resilience.gemini.reset()
+    model_router.reset()
+
+    assert "error" not in ai.analyze_with_gemini("Rent is due monthly.", None)
+    # Three attempts (two retries) took three requests' worth of quota
+    assert len(calls) == 3 and 6.9 < limiter.stats()['requestsAvailable'] <= 7.1
+    resilience.gemini.reset()
+    model_router.reset()
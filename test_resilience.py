@@ -0,0 +1,159 @@
+"""
+Retries, hedging and the circuit breaker around Gemini calls (resilience.py).
+
+Run with:  python -m pytest test_resilience.py -q
+"""
+
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+from google.api_core import exceptions as google_exceptions
+
+import ai
+import analysis_cache
+import gemini_client
+import model_router
+import resilience
+from metrics import metrics
+
+REPLY = json.dumps({"overallScore": 70, "colorLabel": "ORANGE", "summary": "s", "redFlags": [], "fairClauses": []})
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch):
+    monkeypatch.setattr(resilience, "RETRY_BASE_DELAY", 0.001)
+    # Every analysis goes to GEMINI_MODEL, whose caller is resilience.gemini
+    monkeypatch.setattr(model_router, "ROUTING_ENABLED", False)
+    resilience.gemini.reset()
+    metrics.reset()
+    yield
+    resilience.gemini.reset()
+
+
+@pytest.fixture
+def gemini(monkeypatch):
+    """A fake model whose replies (or raised errors) are taken from the returned list in order."""
+    outcomes = []
+
+    class FakeModel:
+        def generate_content(self, contents, request_options=None):
+            outcome = outcomes.pop(0) if outcomes else REPLY
+            if isinstance(outcome, Exception):
+                raise outcome
+            return type("Response", (), {"text": outcome})()
+
+    monkeypatch.setattr(analysis_cache, "CACHE_ENABLED", False)
+    monkeypatch.setattr(gemini_client.registry, "api_key", lambda: "k" * 39)
+    monkeypatch.setattr(gemini_client.registry, "get_model", lambda *args, **kwargs: FakeModel())
+    return outcomes
+
+
+def test_transient_errors_are_retried(gemini):
+    gemini.extend([google_exceptions.ServiceUnavailable("503"), google_exceptions.DeadlineExceeded("504")])
+    result = ai.analyze_with_gemini("The deposit is non-refundable.", {"found_issues": []})
+    assert result['ratingScore'] == 70
+    assert metrics.get("gemini.retries") == 2
+
+
+def test_permanent_errors_are_not_retried(gemini):
+    gemini.append(google_exceptions.InvalidArgument("API key not valid"))
+    result = ai.analyze_with_gemini("The deposit is non-refundable.", {"found_issues": []})
+    assert "error" in result
+    assert metrics.get("gemini.retries") == 0
+    assert resilience.gemini.breaker.state == "closed"
+
+
+def test_circuit_opens_fails_fast_and_recovers(monkeypatch):
+    breaker = resilience.CircuitBreaker("test", failure_threshold=2, reset_timeout=0.05)
+    caller = resilience.ResilientCaller("test")
+    caller.breaker = breaker
+    calls = []
+
+    def unavailable():
+        calls.append(1)
+        raise google_exceptions.ServiceUnavailable("503")
+
+    with pytest.raises(google_exceptions.ServiceUnavailable):
+        caller.call(unavailable)
+    assert breaker.state == "open"
+    assert len(calls) == 2
+
+    with pytest.raises(resilience.CircuitOpenError):
+        caller.call(unavailable)
+    assert len(calls) == 2
+
+    time.sleep(0.06)
+    assert breaker.state == "half_open"
+    assert caller.call(lambda: "ok") == "ok"
+    assert breaker.state == "closed"
+
+
+def test_cancelled_probe_does_not_keep_the_circuit_shut():
+    breaker = resilience.CircuitBreaker("test", failure_threshold=1, reset_timeout=0.01)
+    caller = resilience.ResilientCaller("test")
+    caller.breaker = breaker
+    breaker.record_failure()
+    time.sleep(0.02)
+
+    async def cancelled():
+        raise asyncio.CancelledError()
+
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(caller.call_async(cancelled))
+    assert caller.call(lambda: "ok") == "ok"
+    assert breaker.state == "closed"
+
+
+def test_open_circuit_degrades_to_rule_only_results(gemini, monkeypatch):
+    import app as flask_app
+
+    monkeypatch.setattr(model_router, "FALLBACK_MODELS", [])
+    resilience.gemini.breaker._state = "open"
+    resilience.gemini.breaker._opened_at = time.monotonic()
+
+    result = flask_app.app.test_client().post('/api/analyze', data={'text': 'The deposit is non-refundable.'}).get_json()
+    assert result['degraded'] is True
+    assert result['analysisMode'] == 'fast'
+    assert metrics.get("gemini.circuit.rejected") == 1
+
+    stats = flask_app.app.test_client().get('/api/metrics').get_json()
+    assert stats['gemini']['state'] == "open"
+    # The endpoint is unauthenticated: no file paths or process ids
+    assert "pid" not in stats and "/" not in json.dumps(stats)
+
+
+def test_hedged_request_wins_over_a_slow_call(monkeypatch):
+    monkeypatch.setattr(resilience, "HEDGE_ENABLED", True)
+    monkeypatch.setattr(resilience, "HEDGE_MIN_DELAY", 0.01)
+    caller = resilience.ResilientCaller("test")
+    for _ in range(resilience.HEDGE_MIN_SAMPLES):
+        caller.latency.record(0.01)
+
+    calls = []
+    lock = threading.Lock()
+
+    def sometimes_slow():
+        with lock:
+            calls.append(1)
+            first = len(calls) == 1
+        time.sleep(1 if first else 0.01)
+        return "slow" if first else "fast"
+
+    start = time.perf_counter()
+    assert caller.call(sometimes_slow) == "fast"
+    assert time.perf_counter() - start < 0.5
+    assert metrics.get("test.hedge_won") == 1
+
+    async def slow_then_fast():
+        with lock:
+            calls.append(1)
+            first = len(calls) == 3
+        await asyncio.sleep(1 if first else 0.01)
+        return "slow" if first else "fast"
+
+    start = time.perf_counter()
+    assert asyncio.run(caller.call_async(slow_then_fast)) == "fast"
+    assert time.perf_counter() - start < 0.5
@@ -0,0 +1,103 @@
+"""
+Incremental re-analysis of revised uploads (revisions.py).
+
+Run with:  python -m pytest test_revisions.py -q
+"""
+
+import json
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks'))
+
+import ai
+import analysis_cache
+import gemini_client
+import revisions
+from analysis_cache import AnalysisCache, DiskCache, MemoryCache
+from corpus import generate_agreement
+
+REPLY = json.dumps({"overallScore": 70, "colorLabel": "YELLOW", "summary": "s",
+                    "redFlags": [{"title": "Late Fees", "issue": "x"}], "fairClauses": [], "recommendations": []})
+
+
+def revise(text):
+    """Version 2: one clause reworded, one clause added."""
+    lines = text.split("\n")
+    lines[40] = "40. The Landlord may increase the rent by 20% every year at his sole discretion."
+    lines.insert(120, "120a. The Tenant shall not keep pets in the premises.")
+    return "\n".join(lines)
+
+
+@pytest.fixture
+def gemini(monkeypatch, tmp_path):
+    calls = []
+    lock = threading.Lock()
+
+    class FakeModel:
+        def generate_content(self, contents, request_options=None):
+            with lock:
+                calls.append(contents)
+            return type("Response", (), {"text": REPLY})()
+
+    monkeypatch.setattr(analysis_cache, "_cache", AnalysisCache(MemoryCache(), DiskCache(str(tmp_path / "c.db"))))
+    monkeypatch.setattr(analysis_cache, "CACHE_ENABLED", True)
+    monkeypatch.setattr(revisions, "_store", revisions.RevisionStore(str(tmp_path / "c.db")))
+    monkeypatch.setattr(gemini_client.registry, "api_key", lambda: "k" * 39)
+    monkeypatch.setattr(gemini_client.registry, "get_model", lambda *args, **kwargs: FakeModel())
+    return calls
+
+
+def test_sections_are_content_defined():
+    text = generate_agreement(seed=3, size=40000, pages=10)
+    revised = revise(text)
+    sections = {text[start:end] for start, end in revisions.split_sections(text)}
+    new_sections = [revised[start:end] for start, end in revisions.split_sections(revised)]
+
+    assert len(sections) > 4
+    assert "".join(new_sections) == revised
+    # The edit touches one or two sections; every other section is byte-identical
+    assert sum(1 for section in new_sections if section not in sections) <= 2
+
+
+def test_clause_diff():
+    text = generate_agreement(seed=3, size=20000)
+    old = [revisions.clause_fingerprint(text[s:e]) for s, e in revisions.split_clauses(text)]
+    revised = revise(text)
+    new = [revisions.clause_fingerprint(revised[s:e]) for s, e in revisions.split_clauses(revised)]
+    assert revisions.diff_clauses(old, new) == {"unchanged": len(old) - 1, "changed": 1, "added": 1, "removed": 0}
+
+
+def test_wrapped_lines_form_one_clause():
+    text = "1. The Tenant shall pay rent\non the fifth of every month.\n2. Deposit is refundable.\n"
+    clauses = [text[s:e].strip() for s, e in revisions.split_clauses(text)]
+    assert clauses == ["1. The Tenant shall pay rent\non the fifth of every month.", "2. Deposit is refundable."]
+
+
+def test_revision_only_reanalyzes_changed_sections(gemini):
+    text = generate_agreement(seed=3, size=40000, pages=10)
+    findings = ai.analyze_text_with_rules(text)
+
+    first = ai.analyze_with_gemini(text, findings, owner="tenant@example.com")
+    sections = first['incremental']['sections']
+    assert len(gemini) == sections
+    assert first['incremental']['revisionOf'] is None
+
+    revised = revise(text)
+    second = ai.analyze_with_gemini(revised, ai.analyze_text_with_rules(revised), owner="tenant@example.com")
+    assert len(gemini) - sections <= 2
+    assert second['incremental']['reusedSections'] >= second['incremental']['sections'] - 2
+    assert second['incremental']['revisionOf'] is not None
+    assert second['incremental']['clauseChanges']['changed'] == 1
+    assert second['ratingScore'] == first['ratingScore']
+
+
+def test_anonymous_and_short_documents_are_analyzed_whole(gemini):
+    text = generate_agreement(seed=3, size=40000, pages=10)
+    result = ai.analyze_with_gemini(text, ai.analyze_text_with_rules(text))
+    assert 'incremental' not in result
+    short = ai.analyze_with_gemini("Rent is due monthly.", {"found_issues": [], "hits": []}, owner="a@b.co")
+    assert 'incremental' not in short
@@ -0,0 +1,43 @@
+"""
+Batch rule scoring must agree with analyze_text_with_rules document by document.
+
+Run with:  python -m pytest test_rule_batch.py -q
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks'))
+
+import ai
+import rule_batch
+from corpus import generate_corpus
+
+TEXTS = list(generate_corpus(60, size=1500, risky_ratio=0.3)) + ["", "late fees", "24 hours", "notice apply"]
+
+
+@pytest.mark.parametrize("numpy_available", [True, False])
+def test_batch_matches_single_document_analysis(monkeypatch, numpy_available):
+    if numpy_available and not rule_batch.NUMPY_AVAILABLE:
+        pytest.skip("NumPy is not installed")
+    monkeypatch.setattr(rule_batch, "NUMPY_AVAILABLE", numpy_available)
+
+    batch = ai.analyze_texts_with_rules_batch(TEXTS, processes=1)
+
+    for text, result in zip(TEXTS, batch['results']):
+        single = ai.analyze_text_with_rules(text)
+        assert result['preliminary_score'] == single['preliminary_score']
+        assert result['found_issues'] == single['found_issues']
+
+
+def test_process_pool_gives_the_same_matrix(monkeypatch):
+    monkeypatch.setattr(rule_batch, "PROCESS_POOL_MIN_DOCS", 1)
+    monkeypatch.setattr(rule_batch, "BATCH_CHUNK_SIZE", 7)
+
+    in_process = ai.analyze_texts_with_rules_batch(TEXTS, processes=1)
+    pooled = ai.analyze_texts_with_rules_batch(TEXTS, processes=2)
+
+    assert pooled['hit_matrix'] == in_process['hit_matrix']
+    assert pooled['rule_ids'] == in_process['rule_ids']
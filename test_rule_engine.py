@@ -0,0 +1,140 @@
+"""
+Unit tests for the compiled rule matcher (no server or API key needed).
+
+Run with:  python -m pytest test_rule_engine.py -q
+"""
+
+import rule_engine
+import rule_packs
+from rule_engine import PhraseMatcher
+
+PHRASES = ["without notice", "access without notice", "late fees", "late fees apply", "as-is"]
+
+SAMPLE = "The landlord may ACCESS WITHOUT NOTICE.\nLate fees apply after the 5th. Sold as-is."
+
+
+def brute_force(phrases, text):
+    lowered = text.lower()
+    return sorted(
+        (i, i + len(p), p)
+        for p in {p.lower() for p in phrases}
+        for i in range(len(text))
+        if lowered.startswith(p, i)
+    )
+
+
+def test_small_table_finds_overlapping_and_nested_phrases():
+    matcher = PhraseMatcher(PHRASES)
+    assert not matcher.use_trie
+    assert list(matcher.finditer(SAMPLE)) == brute_force(PHRASES, SAMPLE)
+
+
+def test_trie_finds_overlapping_and_nested_phrases():
+    matcher = PhraseMatcher(PHRASES)
+    matcher.use_trie = True
+    assert list(matcher.finditer(SAMPLE)) == brute_force(PHRASES, SAMPLE)
+
+
+def test_matches_across_scan_blocks(monkeypatch):
+    monkeypatch.setattr(rule_engine, "SCAN_BLOCK_SIZE", 5)
+    for use_trie in (False, True):
+        matcher = PhraseMatcher(PHRASES)
+        matcher.use_trie = use_trie
+        assert list(matcher.finditer(SAMPLE)) == brute_force(PHRASES, SAMPLE)
+
+
+def test_find_all_returns_distinct_phrases():
+    matcher = PhraseMatcher(PHRASES)
+    assert matcher.find_all(SAMPLE + SAMPLE) == set(PHRASES)
+    assert matcher.find_all("nothing to see here") == set()
+
+
+def test_empty_matcher():
+    assert list(PhraseMatcher([]).finditer(SAMPLE)) == []
+
+
+def test_index_hits_reports_counts_lines_pages_and_clauses():
+    text = "1. Rent is due monthly.\nLate fees apply; see below.\fPage two: late fees are 10%. Sold as-is"
+    matcher = PhraseMatcher(PHRASES)
+    index = rule_engine.index_hits(text, matcher.finditer(text))
+
+    assert index["late fees"]["count"] == 2
+    first, second = index["late fees"]["hits"]
+    assert (first["line"], first["page"], first["clause"]) == (2, 1, "Late fees apply;")
+    assert (second["line"], second["page"], second["clause"]) == (2, 2, "Page two: late fees are 10%.")
+    assert text[first["start"]:first["end"]].lower() == "late fees"
+    assert index["as-is"]["hits"][0]["clause"] == "Sold as-is"
+
+
+def test_index_hits_caps_stored_hits_but_keeps_count():
+    text = "late fees. " * 10
+    index = rule_engine.index_hits(text, PhraseMatcher(["late fees"]).finditer(text), max_per_phrase=3)
+    assert index["late fees"]["count"] == 10
+    assert len(index["late fees"]["hits"]) == 3
+
+
+PATTERN_RULES = [
+    {"id": "waive", "regex": r"\bwaive[sd]?\s+(?:all\s+)?(?:of\s+)?your\s+rights\b"},
+    {"id": "short notice", "regex": r"\b(?:24|48)\s*hours?\s+notice\b", "anchors": ["24", "48"]},
+    {"id": "forfeit", "near": ["deposit", r"forfeit\w*"], "within": 4},
+    {"id": "unanchored", "regex": r"\b(?:sublet|assign)\w*\s+prohibited\b"},
+]
+
+
+def test_pattern_rules_match_wording_variants():
+    text = "You waive all of your rights. Entry on 24 hours notice. Your deposit will be forfeited. Subletting prohibited."
+    matcher = rule_engine.PatternMatcher(PATTERN_RULES)
+    found = [(rule_id, text[start:end]) for start, end, rule_id in matcher.finditer(text)]
+    assert found == [
+        ("waive", "waive all of your rights"),
+        ("short notice", "24 hours notice"),
+        ("forfeit", "deposit will be forfeited"),
+        ("unanchored", "Subletting prohibited"),
+    ]
+
+
+def test_literal_anchors_are_derived_from_rules():
+    assert rule_engine._literal_anchors(PATTERN_RULES[0]) == ["waive"]
+    assert rule_engine._literal_anchors(PATTERN_RULES[2]) == ["deposit"]
+    assert rule_engine._literal_anchors(PATTERN_RULES[3]) == []
+    # No literal starts every match of a top-level alternation
+    alternation = {"id": "late fee", "regex": r"late fee|penalty charge"}
+    assert rule_engine._literal_anchors(alternation) == []
+    assert rule_engine._literal_anchors({"regex": r"late (?:fee|charge)"}) == ["late"]
+    text = "A penalty charge applies after the 5th."
+    assert [rule_id for _, _, rule_id in rule_engine.PatternMatcher([alternation]).finditer(text)] == ["late fee"]
+
+
+def test_negation_window():
+    terms = {"no", "not"}
+    text = "There are no late fees. No pets, but late fees apply. Rent will not be increased."
+    assert rule_engine.is_negated(text, text.index("late fees"), terms)
+    assert not rule_engine.is_negated(text, text.index("late fees apply"), terms)
+    rent = text.index("Rent")
+    assert rule_engine.is_negated(text, rent, terms, end=rent + len("Rent will not be increased"))
+
+
+def test_rule_is_not_negated_by_its_own_words():
+    ruleset = rule_packs.registry.get()
+    found = {rule_id for _, _, rule_id in ruleset.finditer("The rent may be increased without notice.")}
+    assert "unilateral rent increase" in found
+    assert "unilateral rent increase" not in {
+        rule_id for _, _, rule_id in ruleset.finditer("The rent will not be increased without notice.")}
+
+
+def test_streaming_index_matches_whole_text_index():
+    text = ("Clause one. Late fees apply to\nall payments; the unit is sold as-is.\f" * 40)
+    matcher = PhraseMatcher(PHRASES)
+    expected = rule_engine.index_hits(text, matcher.finditer(text))
+
+    for size in (1, 7, 64, 1000):
+        chunks = (text[i:i + size] for i in range(0, len(text), size))
+        indexer = rule_engine.HitIndexer()
+        overlap = matcher.max_phrase_length + rule_engine.MAX_CLAUSE_CHARS
+        windows = rule_engine.scan_chunks(chunks, matcher.finditer, overlap, rule_engine.MAX_CLAUSE_CHARS + 1)
+        for window, offset, matches, done in windows:
+            assert len(window) <= size + overlap + rule_engine.MAX_CLAUSE_CHARS + 1
+            for start, end, phrase in matches:
+                indexer.add(window, offset, start, end, phrase)
+            indexer.advance(window, offset, done)
+        assert indexer.index == expected
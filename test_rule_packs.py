@@ -0,0 +1,114 @@
+"""
+Unit tests for rule pack loading, artifact caching and hot reload.
+
+Run with:  python -m pytest test_rule_packs.py -q
+"""
+
+import json
+import os
+import stat
+
+import pytest
+
+import analysis_cache
+import rule_packs
+
+
+def write_pack(path, phrases, version="1.0.0"):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump({"version": version, "phrases": phrases}, f)
+
+
+@pytest.fixture
+def rules_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(rule_packs, "RULES_DIR", str(tmp_path / "rules"))
+    monkeypatch.setattr(rule_packs, "RULE_CACHE_DIR", str(tmp_path / "cache"))
+    monkeypatch.setattr(rule_packs, "RELOAD_CHECK_INTERVAL", 0)
+    write_pack(str(tmp_path / "rules" / "universal.json"), {"late fees": 68, "No Pets": 20})
+    write_pack(str(tmp_path / "rules" / "states" / "tamil_nadu.json"), {"late fees": 80}, version="2.1")
+    return tmp_path / "rules"
+
+
+def test_packs_are_merged_in_order_with_versions(rules_dir):
+    ruleset = rule_packs.RulePackRegistry().get("Tamil Nadu")
+    assert ruleset.phrases == {"late fees": 80, "no pets": 20}
+    assert ruleset.versions == {"universal": "1.0.0", "states/tamil_nadu": "2.1"}
+    assert ruleset.matcher.find_all("NO PETS and late fees") == {"no pets", "late fees"}
+
+
+def test_missing_state_pack_falls_back_to_universal(rules_dir):
+    ruleset = rule_packs.RulePackRegistry().get("Goa", "lease")
+    assert list(ruleset.versions) == ["universal"]
+
+
+def test_compiled_matcher_is_cached_by_content_hash(rules_dir, monkeypatch):
+    first = rule_packs.RulePackRegistry().get()
+    assert os.path.exists(rule_packs._artifact_path(first.fingerprint))
+
+    def fail(_phrases):
+        raise AssertionError("matcher should have been loaded from the artifact cache")
+
+    monkeypatch.setattr(rule_packs, "PhraseMatcher", fail)
+    second = rule_packs.RulePackRegistry().get()
+    assert second.fingerprint == first.fingerprint
+    assert second.matcher.find_all("late fees") == {"late fees"}
+
+
+def test_registry_hot_reloads_changed_packs(rules_dir):
+    registry = rule_packs.RulePackRegistry()
+    assert "sell your data" not in registry.get().phrases
+
+    write_pack(str(rules_dir / "universal.json"), {"sell your data": 94, "late fees": 68}, version="1.1.0")
+    os.utime(rules_dir / "universal.json", ns=(1, 1))
+
+    ruleset = registry.get()
+    assert ruleset.phrases == {"sell your data": 94, "late fees": 68}
+    assert ruleset.versions == {"universal": "1.1.0"}
+
+
+def test_request_names_cannot_leave_the_rules_dir(rules_dir):
+    write_pack(str(rules_dir.parent / "outside.json"), {"planted": 99})
+    assert rule_packs.normalize_name("../../outside") == ""
+    assert rule_packs.find_pack_files("../outside", "../../outside") == [str(rules_dir / "universal.json")]
+
+    # Unknown names share the universal ruleset instead of adding an entry each
+    registry = rule_packs.RulePackRegistry()
+    assert registry.get("Atlantis") is registry.get("Goa", "unknown type")
+    assert len(registry._entries) == 1
+
+
+def test_broken_pack_edit_keeps_the_last_good_rules(rules_dir):
+    registry = rule_packs.RulePackRegistry()
+    good = registry.get()
+    with open(rules_dir / "universal.json", 'w') as f:
+        f.write('{"phrases": {"late fees": ')
+    os.utime(rules_dir / "universal.json", ns=(1, 1))
+    assert registry.get() is good
+
+
+def test_artifacts_are_not_loaded_from_a_shared_directory(rules_dir, tmp_path, monkeypatch):
+    shared = tmp_path / "shared"
+    shared.mkdir()
+    os.chmod(shared, 0o777)
+    monkeypatch.setattr(rule_packs, "RULE_CACHE_DIR", str(shared))
+    first = rule_packs.RulePackRegistry().get()
+    assert not os.listdir(shared)
+    assert rule_packs._load_artifact(first.fingerprint) is None
+
+
+def test_loading_rules_first_leaves_the_data_dir_usable(rules_dir, tmp_path, monkeypatch):
+    data_dir = tmp_path / "fresh" / "lekha"
+    monkeypatch.setattr(analysis_cache, "DATA_DIR", str(data_dir))
+    monkeypatch.setattr(rule_packs, "RULE_CACHE_DIR", str(data_dir / "rule_cache"))
+    rule_packs.RulePackRegistry().get()
+    assert os.listdir(data_dir / "rule_cache")
+    # Every directory created on the way is private, so the stores can open their files next to it
+    for directory in (tmp_path / "fresh", data_dir):
+        assert stat.S_IMODE(os.stat(directory).st_mode) == 0o700
+    assert analysis_cache.DiskCache(str(data_dir / "analysis_cache.sqlite3")).available
+
+    # A data dir that older versions left readable to others is closed again
+    os.chmod(data_dir, 0o755)
+    assert analysis_cache.DiskCache(str(data_dir / "other.sqlite3")).available
+    assert stat.S_IMODE(os.stat(data_dir).st_mode) == 0o700
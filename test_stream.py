@@ -0,0 +1,101 @@
+"""
+Streamed analysis: the incremental JSON parser and /api/analyze/stream.
+
+Run with:  python -m pytest test_stream.py -q
+"""
+
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks'))
+
+import ai
+import analysis_cache
+import gemini_client
+from corpus import generate_model_response
+from json_stream import IncrementalJSONParser
+
+REPLY = generate_model_response(seed=4, red_flags=4, fair_clauses=2, style="multiline")
+
+
+def pieces(text, size=7):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+@pytest.fixture
+def gemini(monkeypatch):
+    class Chunk:
+        def __init__(self, text):
+            self._text = text
+
+        @property
+        def text(self):
+            if self._text is None:
+                raise ValueError("no text in this chunk")
+            return self._text
+
+    class FakeModel:
+        def generate_content(self, contents, stream=False, request_options=None):
+            if stream:
+                return iter([Chunk(piece) for piece in pieces(REPLY)] + [Chunk(None)])
+            return type("Response", (), {"text": REPLY})()
+
+    monkeypatch.setattr(analysis_cache, "CACHE_ENABLED", False)
+    monkeypatch.setattr(gemini_client.registry, "api_key", lambda: "k" * 39)
+    monkeypatch.setattr(gemini_client.registry, "get_model", lambda *args, **kwargs: FakeModel())
+
+
+@pytest.mark.parametrize("style", ["clean", "fenced", "multiline"])
+def test_parser_emits_each_item_once_it_is_complete(style):
+    reply = generate_model_response(seed=1, red_flags=4, fair_clauses=3, style=style)
+    parser = IncrementalJSONParser(["redFlags", "fairClauses"])
+
+    events = []
+    for piece in pieces(reply):
+        events.extend(parser.feed(piece))
+
+    assert parser.done
+    flags = [value for kind, key, value in events if kind == "item" and key == "redFlags"]
+    assert [flag['title'] for flag in flags] == [f"Risky clause {i}" for i in range(1, 5)]
+    assert len([event for event in events if event[1] == "fairClauses"]) == 3
+    assert ("field", "overallScore", ai.clean_json_response(reply)['overallScore']) in events
+
+
+def test_parser_does_not_emit_an_item_early():
+    parser = IncrementalJSONParser(["redFlags"])
+    assert parser.feed('{"redFlags": [{"title": "Lock-in", "issue": "a } inside"') == []
+    assert parser.feed('}, {"title"') == [("item", "redFlags", {"title": "Lock-in", "issue": "a } inside"})]
+
+
+def test_stream_sends_rules_then_items_then_the_same_result_as_analyze(gemini):
+    import app as flask_app
+
+    form = {'text': 'The deposit is non-refundable. Late fees apply.', 'state': 'Goa'}
+    client = flask_app.app.test_client()
+    response = client.post('/api/analyze/stream', data=form)
+    assert response.mimetype == 'text/event-stream'
+
+    events = []
+    for block in response.get_data(as_text=True).strip().split("\n\n"):
+        name, data = block.split("\n")
+        events.append((name[len("event: "):], json.loads(data[len("data: "):])))
+
+    names = [name for name, _ in events]
+    assert names[0] == "rules"
+    assert names[-1] == "result"
+    assert names.count("redFlag") == 4
+    assert 'overallScore' in events[0][1]['preliminaryResult']
+
+    expected = client.post('/api/analyze', data=form).get_json()
+    assert events[-1][1] == expected
+
+
+def test_stream_rejects_bad_requests_before_streaming(gemini):
+    import app as flask_app
+
+    client = flask_app.app.test_client()
+    assert client.post('/api/analyze/stream', data={'text': 'x', 'mode': 'bogus'}).status_code == 400
+    assert client.post('/api/analyze/stream', data={}).status_code == 400